@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'usuarios.metricas.MetricasMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -134,6 +135,70 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'usuarios.Usuario'
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'compartida' es visible para todos los procesos de la máquina (workers de
+# gunicorn, comandos de gestión); ahí se guardan los contadores de versión.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'compartida',
+    },
+}
+
+USUARIOS_CACHE_VERSIONES = 'compartida'
+
+
+# Recomendador
+# SOLVER: 'greedy' o 'exacto' (ramificación y acotamiento con presupuesto de
+# tiempo por comida; si se agota, se conserva la mejor solución encontrada,
+# como mínimo la greedy).
+
+RECOMENDADOR = {
+    'SOLVER': 'greedy',
+    'PRESUPUESTO_SOLVER_MS': 50,
+    # Tope para el presupuesto pedido con ?presupuesto_ms= o en las preferencias
+    'PRESUPUESTO_SOLVER_MAX_MS': 500,
+    # Plan semanal: veces que puede repetirse un alimento en el periodo
+    'SEMANA_MAX_REPETICIONES': 2,
+    # Requerimientos nutricionales memorizados por proceso (entradas LRU)
+    'MEMO_REQUERIMIENTOS_MAX': 1024,
+    # Alergias estandarizadas memorizadas por texto de historial (entradas LRU)
+    'CACHE_ALERGIAS_MAX': 1024,
+    # Reglas de palatabilidad y ajustes por enfermedad; se recargan al cambiar el archivo
+    'REGLAS_ARCHIVO': BASE_DIR / 'usuarios' / 'reglas_recomendador.json',
+    # Cola de generación (manage.py procesar_trabajos_recomendacion)
+    'TRABAJOS_CONCURRENCIA': 2,
+    'TRABAJOS_INTERVALO_S': 1.0,
+    # Un trabajo 'en_proceso' sin latido en TRABAJOS_TIEMPO_MAXIMO_S se da por
+    # abandonado; el trabajador lo renueva cada TRABAJOS_LATIDO_S
+    'TRABAJOS_TIEMPO_MAXIMO_S': 600,
+    'TRABAJOS_LATIDO_S': 30,
+    # Cada cuánto devuelve cada trabajador a la cola los trabajos abandonados
+    'TRABAJOS_RECUPERAR_CADA_S': 60,
+    # Validez del token de una vista previa (recomendacion/confirmar/)
+    'VISTA_PREVIA_VIGENCIA_S': 3600,
+    # Duración y consultas por etapa en fuente['perf'] y en el log (usuarios/medicion.py)
+    'MEDIR_ETAPAS': False,
+}
+
+# Métricas de peticiones expuestas en /metrics (usuarios/metricas.py). Con
+# varios workers, todos deben compartir DIRECTORIO (en la misma máquina); cada
+# uno escribe su archivo y los de procesos terminados se suman en uno solo.
+METRICAS = {
+    'DIRECTORIO': BASE_DIR / 'metricas',
+    'INTERVALO_ESCRITURA_S': 5.0,
+    # /metrics exige 'Authorization: Bearer <TOKEN>'; sin TOKEN responde 403,
+    # salvo con DEBUG, que atiende a IPS_PERMITIDAS
+    'TOKEN': '',
+    'IPS_PERMITIDAS': ('127.0.0.1', '::1'),
+}
+
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -170,6 +235,16 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'usuarios.paginacion.PaginacionCursor',
+    'PAGE_SIZE': 50,
+}
+
+# Límites de la paginación por cursor (usuarios/paginacion.py)
+PAGINACION = {
+    # Máximo para ?page_size=
+    'TAMANO_MAXIMO': 500,
+    # Filas devueltas con ?paginar=0 en viewsets que crecen sin límite (logs)
+    'SIN_PAGINAR_MAXIMO': 1000,
 }
 
 from datetime import timedelta
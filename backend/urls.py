@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenRefreshView
 from usuarios.views import CustomTokenObtainPairView  # Importamos nuestra vista personalizada
+from usuarios.metricas import metricas
 
 urlpatterns = [
     # ... tus otras rutas ...
@@ -10,4 +11,5 @@ urlpatterns = [
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('admin/', admin.site.urls),
     path('api/', include('usuarios.urls')),
+    path('metrics', metricas),
 ]
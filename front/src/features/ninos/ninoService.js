@@ -1,10 +1,10 @@
-import api from '../../services/api';
+import api, { SIN_PAGINAR } from '../../services/api';
 
 const API_URL = 'usuarios/ninos/';
 
 // Obtener todos los ninos
 export const getNinos = () => {
-  return api.get(API_URL);
+  return api.get(API_URL, SIN_PAGINAR);
 };
 
 // Crear un nuevo nino
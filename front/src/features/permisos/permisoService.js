@@ -1,9 +1,9 @@
-import api from '../../services/api';
+import api, { SIN_PAGINAR } from '../../services/api';
 
 const API_URL = 'usuarios/permisos/';
 
 // CRUD para Permisos
-export const getPermisos = () => api.get(API_URL);
+export const getPermisos = () => api.get(API_URL, SIN_PAGINAR);
 export const getPermiso = (id) => api.get(`${API_URL}${id}/`);
 export const createPermiso = (data) => api.post(API_URL, data);
 export const updatePermiso = (id, data) => api.put(`${API_URL}${id}/`, data);
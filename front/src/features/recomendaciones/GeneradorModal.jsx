@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { generateRecomendacion } from './recomendacionService';
+import { generateRecomendacionYEsperar } from './recomendacionService';
 import { getNinos } from '../ninos/ninoService';
 import Modal from '../../components/modals/ModalBase';
 import { Button } from 'flowbite-react';
@@ -9,6 +9,7 @@ const GeneradorModal = ({ isOpen, onClose, onGenerateSuccess }) => {
   const [ninos, setNinos] = useState([]);
   const [selectedNino, setSelectedNino] = useState(null);
   const [isLoading, setIsLoading] = useState(false);
+  const [progreso, setProgreso] = useState(0);
   const [error, setError] = useState('');
 
   useEffect(() => {
@@ -36,14 +37,11 @@ const GeneradorModal = ({ isOpen, onClose, onGenerateSuccess }) => {
       return;
     }
     setIsLoading(true);
+    setProgreso(0);
     setError('');
     try {
-      const { data } = await generateRecomendacion(selectedNino.value);
-      if (data.ok && data.recomendacion_id) {
-        onGenerateSuccess(data.recomendacion_id);
-      } else {
-        throw new Error(data.error || 'La respuesta de la API no fue la esperada.');
-      }
+      const recomendacionId = await generateRecomendacionYEsperar(selectedNino.value, { onProgreso: setProgreso });
+      onGenerateSuccess(recomendacionId);
     } catch (err) {
       const errorMessage = err.response?.data?.error || err.message || 'Ocurrió un error desconocido.';
       setError(`Error al generar la recomendación: ${errorMessage}`);
@@ -70,7 +68,7 @@ const GeneradorModal = ({ isOpen, onClose, onGenerateSuccess }) => {
         <div className="flex justify-end mt-6">
           <Button color="gray" onClick={onClose} className="mr-2">Cancelar</Button>
           <Button color="blue" onClick={handleGenerateClick} disabled={isLoading || !selectedNino}>
-            {isLoading ? 'Generando...' : 'Generar Dieta'}
+            {isLoading ? `Generando... ${progreso}%` : 'Generar Dieta'}
           </Button>
         </div>
       </div>
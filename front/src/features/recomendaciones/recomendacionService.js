@@ -1,9 +1,14 @@
-import api from '../../services/api';
+import api, { SIN_PAGINAR } from '../../services/api';
 
 // --- Funciones para el CRUD de Recomendaciones ---
 
-// Obtener TODAS las recomendaciones (para la lista)
-export const getRecomendaciones = () => api.get('/usuarios/recomendaciones/');
+// Obtener TODAS las recomendaciones (para la lista), solo con los campos que muestra
+export const getRecomendaciones = () => api.get('/usuarios/recomendaciones/', {
+  params: {
+    ...SIN_PAGINAR.params,
+    fields: 'id,fecha,motivo,nino_details.nombres,nino_details.apellidos',
+  },
+});
 
 // Obtener UNA recomendación por su ID (para ver detalles)
 export const getRecomendacion = (id) => api.get(`/usuarios/recomendaciones/${id}/`);
@@ -20,6 +25,45 @@ export const deleteRecomendacion = (id) => api.delete(`/usuarios/recomendaciones
 
 // --- Función para la Generación Automática ---
 
-// Llama al endpoint del generador automático
-// Devuelve: { ok: true, recomendacion_id: ... }
-export const generateRecomendacion = (ninoId) => api.post(`/recomendacion/${ninoId}/crear/`);
\ No newline at end of file
+// Encola la generación automática. Si nada cambió desde la última, se reutiliza
+// su resultado; { forzar: true } obliga a recalcular.
+// Devuelve: { ok: true, trabajo_id: ..., estado: 'pendiente' }
+export const generateRecomendacion = (ninoId, { forzar = false } = {}) =>
+  api.post(`/recomendacion/${ninoId}/crear/`, null, forzar ? { params: { forzar: 1 } } : undefined);
+
+// Vista previa: calcula sin guardar
+// Devuelve: { ok: true, plan: { comidas, calorias_totales, errores, ... }, token }
+export const previewRecomendacion = (ninoId) => api.get(`/recomendacion/${ninoId}/vista-previa/`);
+
+// Guarda una vista previa con su token, sin recalcularla
+// Devuelve: { ok: true, recomendacion_id }
+export const confirmRecomendacion = (token, motivo) => api.post('/recomendacion/confirmar/', { token, motivo });
+
+// Plan de varios días con variedad entre días
+// Devuelve: { ok: true, recomendaciones: [{ id, fecha }, ...] }
+export const generateSemana = (ninoId, { dias = 7, maxRepeticiones } = {}) =>
+  api.post(`/recomendacion/${ninoId}/semana/`, null, { params: { dias, max_repeticiones: maxRepeticiones } });
+
+// Estado de un trabajo de generación
+// Devuelve: { estado, progreso, recomendacion_id, error, ... }
+export const getTrabajoRecomendacion = (trabajoId) => api.get(`/recomendacion/trabajos/${trabajoId}/`);
+
+// Encola la generación y consulta el trabajo hasta que termina, como mucho
+// maxIntentos veces (2 minutos por defecto); después se rinde con un error.
+// Resuelve con el id de la recomendación generada.
+export const generateRecomendacionYEsperar = async (
+  ninoId, { intervaloMs = 1000, maxIntentos = 120, onProgreso, forzar } = {}
+) => {
+  const { data } = await generateRecomendacion(ninoId, { forzar });
+  if (!data.ok || !data.trabajo_id) {
+    throw new Error(data.error || 'La respuesta de la API no fue la esperada.');
+  }
+  for (let intento = 0; intento < maxIntentos; intento++) {
+    await new Promise(resolve => setTimeout(resolve, intervaloMs));
+    const { data: trabajo } = await getTrabajoRecomendacion(data.trabajo_id);
+    if (onProgreso) onProgreso(trabajo.progreso);
+    if (trabajo.estado === 'completado') return trabajo.recomendacion_id;
+    if (trabajo.estado === 'error') throw new Error(trabajo.error || 'La generación falló.');
+  }
+  throw new Error('La generación está tardando demasiado; revisa la lista de recomendaciones más tarde.');
+};
\ No newline at end of file
@@ -1,8 +1,8 @@
-import api from '../../services/api';
+import api, { SIN_PAGINAR } from '../../services/api';
 
 const API_URL = 'usuarios/logs/';
 
 // Obtener todos los logs
 export const getLogs = () => {
-  return api.get(API_URL);
+  return api.get(API_URL, SIN_PAGINAR);
 };
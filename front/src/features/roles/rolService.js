@@ -1,8 +1,8 @@
-import api from '../../services/api';
+import api, { SIN_PAGINAR } from '../../services/api';
 
 const API_URL = 'usuarios/roles/';
 
-export const getRoles = () => api.get(API_URL);
+export const getRoles = () => api.get(API_URL, SIN_PAGINAR);
 export const getRol = (id) => api.get(`${API_URL}${id}/`);
 export const createRol = (data) => api.post(API_URL, data);
 export const updateRol = (id, data) => api.put(`${API_URL}${id}/`, data);
@@ -1,11 +1,11 @@
 // src/features/usuarios/usuarioService.js
-import api from '../../services/api';
+import api, { SIN_PAGINAR } from '../../services/api';
 
 // La ruta base correcta para los usuarios.
 const USER_API_URL = 'usuarios/usuarios/';
 
 export const getUsuarios = () => {
-  return api.get(USER_API_URL);
+  return api.get(USER_API_URL, SIN_PAGINAR);
 };
 
 // Esta función no se usa actualmente, pero se corrige por si se necesita en el futuro.
@@ -58,10 +58,10 @@ const PERMISO_URL = '/usuarios/permisos/';
  * Obtiene la lista de todos los permisos disponibles.
  */
 export const getPermisos = () => {
-  return api.get(PERMISO_URL);
+  return api.get(PERMISO_URL, SIN_PAGINAR);
 };
 
 // Obtener todos los roles
 export const getRoles = () => {
-  return api.get('/usuarios/roles/');
+  return api.get('/usuarios/roles/', SIN_PAGINAR);
 };
\ No newline at end of file
@@ -43,4 +43,8 @@ api.interceptors.request.use(config => {
   return config;
 });
 
+// El backend pagina los listados por cursor; estos servicios aún esperan la
+// lista completa, así que la piden sin paginar (?paginar=0)
+export const SIN_PAGINAR = { params: { paginar: 0 } };
+
 export default api;
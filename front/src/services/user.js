@@ -2,7 +2,7 @@ export async function fetchUserRole() {
   const token = localStorage.getItem('access_token');
   if (!token) return null;
 
-  const response = await fetch('http://127.0.0.1:8000/api/usuarios/roles/', {
+  const response = await fetch('http://127.0.0.1:8000/api/usuarios/roles/?paginar=0', {
     headers: {
       'Authorization': `Bearer ${token}`,
     },
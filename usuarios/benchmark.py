@@ -0,0 +1,277 @@
+import logging
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import override_settings
+
+from .medicion import MedicionEtapas, resumir_perf
+from .models import (
+    Alimento, HistorialClinico, LogActividad, Nino, ParametroReferencia, Recomendacion, Usuario
+)
+from .recomendador import (
+    COMIDAS, CalculadoraNutricional, CatalogoAlimentos, IndiceParametros, ProcesadorAlergias,
+    _preparar_planificacion, cargar_datos_nino, generar_opciones_recomendacion,
+    generar_recomendacion_automatica_mejorada
+)
+from .signals import versionar_alimento, versionar_parametro_referencia
+from .versiones import incrementar_version
+
+logger = logging.getLogger(__name__)
+
+# Distribuciones aproximadas de un catálogo real: (grupo, peso, rango de calorías, alérgenos frecuentes)
+GRUPOS = [
+    ('vegetales', 0.20, (15, 120), []),
+    ('frutas', 0.15, (30, 150), []),
+    ('proteinas', 0.18, (90, 350), ['huevo', 'pescado', 'soya', 'mariscos']),
+    ('cereales_integrales', 0.15, (80, 380), ['gluten', 'trigo']),
+    ('lacteos', 0.10, (50, 300), ['leche', 'lactosa']),
+    ('grasas', 0.07, (90, 600), ['nuez', 'almendra']),
+    ('dulces', 0.10, (100, 500), ['leche', 'gluten', 'huevo']),
+    ('otros', 0.05, (20, 400), []),
+]
+PROBABILIDAD_ALERGENO = 0.35
+
+NOMBRES = [
+    'pollo', 'pasta', 'arroz', 'platano', 'manzana', 'yogur', 'queso', 'pan', 'sopa', 'ensalada',
+    'lentejas', 'quinua', 'zanahoria', 'brocoli', 'pescado', 'huevo', 'avena', 'papa', 'carne', 'tortilla',
+]
+PREPARACIONES = ['', 'pure de', 'cremoso de', 'guiso de', 'al horno', 'suave de', 'frito de', 'salteado de']
+
+ALERGIAS_HISTORIAL = ['', '', '', 'lactosa', 'nuez', 'Lactosa, nuez', 'gluten', 'huevo, soya', 'camarón']
+
+PARAMETROS = [
+    (1, 3, 1000, 13, 7),
+    (4, 8, 1400, 19, 10),
+    (9, 13, 1800, 34, 8),
+    (14, 18, 2200, 52, 11),
+]
+
+def _memoria_pico_kb(funcion: Callable[[], object]) -> float:
+    tracemalloc.start()
+    try:
+        funcion()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(pico / 1024, 1)
+
+
+def _limpiar_caches_de_calculo() -> None:
+    # La instantánea del catálogo se mide aparte; aquí solo se vacían las memorias por niño
+    CalculadoraNutricional._memo.limpiar()
+    ProcesadorAlergias._cache.limpiar()
+
+
+# Receptores de post_delete que versionan la tabla en cada fila eliminada
+VERSIONADO_POR_FILA = [(versionar_alimento, Alimento), (versionar_parametro_referencia, ParametroReferencia)]
+
+
+@contextmanager
+def _sin_versionado_por_fila():
+    """
+    Desconecta los receptores de VERSIONADO_POR_FILA mientras se vacían las tablas.
+
+    Con ellos conectados, delete() carga cada fila y emite un post_delete (y un
+    incremento de versión) por fila; sin ellos, Django borra con un DELETE por tabla.
+    """
+    for receptor, modelo in VERSIONADO_POR_FILA:
+        post_delete.disconnect(receptor, sender=modelo)
+    try:
+        yield
+    finally:
+        for receptor, modelo in VERSIONADO_POR_FILA:
+            post_delete.connect(receptor, sender=modelo)
+
+
+def sembrar_datos(tamano: int, num_ninos: int, semilla: int = 42) -> List[int]:
+    """
+    Reemplaza el catálogo, los niños y los parámetros por datos sintéticos.
+
+    Solo debe usarse sobre una base de datos desechable. Devuelve los ids de
+    los niños creados.
+    """
+    rng = random.Random(semilla)
+    with _sin_versionado_por_fila():
+        Recomendacion.objects.all().delete()
+        LogActividad.objects.all().delete()
+        Alimento.objects.all().delete()
+        Nino.objects.all().delete()
+        ParametroReferencia.objects.all().delete()
+
+    pesos = [grupo[1] for grupo in GRUPOS]
+    alimentos = []
+    for i in range(tamano):
+        grupo, _, (cal_min, cal_max), alergenos_grupo = rng.choices(GRUPOS, weights=pesos)[0]
+        calorias = rng.uniform(cal_min, cal_max)
+        alergenos = []
+        if alergenos_grupo and rng.random() < PROBABILIDAD_ALERGENO:
+            alergenos = rng.sample(alergenos_grupo, rng.randint(1, min(2, len(alergenos_grupo))))
+        nombre = f"{rng.choice(PREPARACIONES)} {rng.choice(NOMBRES)} {i}".strip()
+        alimentos.append(Alimento(
+            nombre=nombre,
+            categoria=rng.choice(COMIDAS),
+            calorias=calorias,
+            proteinas=calorias * rng.uniform(0.0, 0.08),
+            grasas=calorias * rng.uniform(0.0, 0.06),
+            carbohidratos=calorias * rng.uniform(0.05, 0.2),
+            grupo_alimenticio=grupo,
+            alergenos=alergenos,
+        ))
+    Alimento.objects.bulk_create(alimentos, batch_size=5000)
+
+    ParametroReferencia.objects.bulk_create([
+        ParametroReferencia(edad_min=a, edad_max=b, calorias=c, proteinas=p, hierro=h, fuente='benchmark')
+        for a, b, c, p, h in PARAMETROS
+    ])
+
+    usuario, _ = Usuario.objects.get_or_create(
+        correo='benchmark@example.com',
+        defaults={'nombres': 'Benchmark', 'apellido_paterno': 'B', 'apellido_materno': 'B', 'ci': 'benchmark'},
+    )
+    hoy = date.today()
+    ninos = Nino.objects.bulk_create([
+        Nino(
+            usuario=usuario, nombres=f"Niño {i}", apellido_paterno='Bench', apellido_materno='Mark',
+            ci=f"bench-{i}", fecha_nacimiento=hoy - timedelta(days=rng.randint(365 * 2, 365 * 14)),
+        )
+        for i in range(num_ninos)
+    ])
+    HistorialClinico.objects.bulk_create([
+        HistorialClinico(
+            nino=nino, peso=rng.uniform(10, 50), talla=rng.uniform(0.8, 1.6),
+            actividad_fisica=rng.choice(['baja', 'media', 'alta']),
+            enfermedades=rng.choice(['', '', '', 'desnutricion', 'diabetes']),
+            alergias=rng.choice(ALERGIAS_HISTORIAL),
+        )
+        for nino in ninos
+    ])
+
+    # Ni el borrado sin receptores ni bulk_create versionan: una sola vez por tabla,
+    # y las instantáneas de este proceso se descartan a mano
+    incrementar_version(Alimento)
+    incrementar_version(ParametroReferencia)
+    CatalogoAlimentos.invalidar()
+    IndiceParametros.invalidar()
+    return [nino.id for nino in ninos]
+
+
+def _medir(generar: Callable[[int], Recomendacion], ninos: List[int], repeticiones: int) -> Dict:
+    """
+    Ejecuta el generador de producción con RECOMENDADOR['MEDIR_ETAPAS'] activo
+    y resume el fuente['perf'] de cada ejecución con resumir_perf.
+    """
+    fuentes = []
+    with override_settings(RECOMENDADOR={**getattr(settings, 'RECOMENDADOR', {}), 'MEDIR_ETAPAS': True}):
+        for i in range(repeticiones):
+            _limpiar_caches_de_calculo()
+            fuentes.append(generar(ninos[i % len(ninos)]).fuente)
+    _limpiar_caches_de_calculo()
+
+    resumen = resumir_perf(fuentes)
+    total = resumen.pop('total')
+    return {
+        "etapas": resumen,
+        "total": total,
+        # Sin medición, como en producción por defecto
+        "memoria_pico_kb": _memoria_pico_kb(lambda: generar(ninos[0])),
+    }
+
+
+def _primera_opcion(nino_id: int, num_opciones: int) -> Recomendacion:
+    opciones = generar_opciones_recomendacion(nino_id, num_opciones)
+    if not opciones:
+        raise ValueError(f"generar_opciones_recomendacion no devolvió opciones para el niño {nino_id}")
+    return opciones[0]
+
+
+def _ninos_con_plan(ninos: List[int]) -> List[int]:
+    # Con catálogos pequeños algún niño puede quedarse sin alimentos seguros en una comida
+    validos = []
+    for nino_id in ninos:
+        try:
+            nino, historial, parametro = cargar_datos_nino(nino_id)
+            _preparar_planificacion(nino, historial, parametro, None)
+        except ValueError:
+            continue
+        validos.append(nino_id)
+    return validos
+
+
+def medir_tamano(tamano: int, repeticiones: int, num_ninos: int, num_opciones: int, semilla: int) -> Dict:
+    """Siembra un catálogo de `tamano` alimentos y mide ambos generadores"""
+    inicio = time.perf_counter()
+    ninos = sembrar_datos(tamano, num_ninos, semilla)
+    siembra_s = time.perf_counter() - inicio
+
+    frio = MedicionEtapas()
+    with frio.etapa('catalogo_en_frio'):
+        CatalogoAlimentos.obtener()
+    ninos = _ninos_con_plan(ninos)
+    if not ninos:
+        raise ValueError(f"Ningún niño tiene alimentos seguros con {tamano} alimentos")
+
+    resultado = {"alimentos": tamano, "ninos": len(ninos), "siembra_s": round(siembra_s, 2)}
+    resultado.update(frio.resumen()["etapas"])
+
+    # forzar=True: si no, la segunda vuelta reutilizaría la recomendación por su huella
+    resultado["generar"] = _medir(
+        lambda n: generar_recomendacion_automatica_mejorada(n, "Benchmark", forzar=True), ninos, repeticiones
+    )
+    # La medición de cada llamada queda en la primera opción
+    resultado["opciones"] = _medir(
+        lambda n: _primera_opcion(n, num_opciones), ninos, repeticiones
+    )
+    return resultado
+
+
+def _commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ejecutar_benchmark(
+    tamanos: Iterable[int] = (1000, 10000, 100000),
+    repeticiones: int = 20,
+    num_ninos: int = 20,
+    num_opciones: int = 3,
+    semilla: int = 42
+) -> Dict:
+    """
+    Mide el recomendador sobre catálogos sintéticos de varios tamaños.
+
+    Borra y vuelve a sembrar los datos de la base de datos actual: usarlo solo
+    con una base desechable (el comando benchmark_recomendador crea una).
+    """
+    registrador = logging.getLogger('usuarios')
+    nivel = registrador.level
+    registrador.setLevel(logging.ERROR)  # las advertencias de validación inundarían la salida
+    try:
+        resultados = {
+            str(tamano): medir_tamano(tamano, repeticiones, num_ninos, num_opciones, semilla)
+            for tamano in tamanos
+        }
+    finally:
+        registrador.setLevel(nivel)
+
+    return {
+        "fecha": date.today().isoformat(),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "base_de_datos": connection.vendor,
+        "repeticiones": repeticiones,
+        "semilla": semilla,
+        "resultados": resultados,
+    }
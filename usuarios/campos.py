@@ -0,0 +1,131 @@
+from dataclasses import dataclass
+from typing import FrozenSet, Optional, Tuple
+
+from rest_framework import serializers
+
+
+def _lista(valor: Optional[str]) -> Optional[FrozenSet[str]]:
+    if valor is None:
+        return None
+    return frozenset(parte.strip() for parte in valor.split(',') if parte.strip())
+
+
+@dataclass(frozen=True)
+class FormaRespuesta:
+    """
+    Forma pedida con ?fields= y ?expand=, como rutas con puntos
+    ('desayunos.alimento.nombre').
+
+    Sin ninguno de los dos parámetros la respuesta es la completa de siempre.
+    Con alguno, `fields` limita los campos (un campo anidado sin subcampos se
+    incluye entero, igual que uno expandido que no esté en `fields`) y solo
+    se construyen los serializadores anidados que aparecen en `expand` o en
+    `fields`; el resto se omite o queda en su id.
+    """
+    campos: Optional[FrozenSet[str]] = None
+    expandir: Optional[FrozenSet[str]] = None
+
+    @classmethod
+    def desde_request(cls, request) -> 'FormaRespuesta':
+        # Solo lecturas: en escrituras los campos anidados también se validan
+        if request is None or request.method != 'GET':
+            return cls()
+        parametros = getattr(request, 'query_params', request.GET)
+        return cls(campos=_lista(parametros.get('fields')), expandir=_lista(parametros.get('expand')))
+
+    @property
+    def moldeada(self) -> bool:
+        return self.campos is not None or self.expandir is not None
+
+    @property
+    def campos_efectivos(self) -> Optional[FrozenSet[str]]:
+        """`fields` más cada ruta expandida de la que `fields` no elige subcampos"""
+        if self.campos is None:
+            return None
+        return self.campos | frozenset(
+            expandido for expandido in self.expandir or ()
+            if not any(campo == expandido or campo.startswith(expandido + '.') for campo in self.campos)
+        )
+
+    def incluye(self, ruta: Tuple[str, ...], nombre: str) -> bool:
+        campos = self.campos_efectivos
+        if campos is None:
+            return True
+        camino = '.'.join((*ruta, nombre))
+        return any(
+            campo == camino or campo.startswith(camino + '.') or camino.startswith(campo + '.')
+            for campo in campos
+        )
+
+    def expande(self, ruta: Tuple[str, ...], nombre: str) -> bool:
+        """Si el campo anidado debe construirse (siempre, si la respuesta no está moldeada)"""
+        if not self.moldeada:
+            return True
+        camino = '.'.join((*ruta, nombre))
+        pedidos = (self.expandir or frozenset()) | (self.campos or frozenset())
+        return any(pedido == camino or pedido.startswith(camino + '.') for pedido in pedidos)
+
+    def construye(self, ruta: Tuple[str, ...], nombre: str) -> bool:
+        return self.incluye(ruta, nombre) and self.expande(ruta, nombre)
+
+
+def solo_id():
+    """Representación colapsada de una relación anidada: su clave primaria, sin consultar la fila"""
+    return serializers.PrimaryKeyRelatedField(read_only=True)
+
+
+class CamposDinamicosMixin:
+    """
+    Aplica la FormaRespuesta del request a un ModelSerializer.
+
+    Meta.expandibles indica los campos anidados y cómo se colapsan cuando no
+    se expanden: una función que crea el campo sustituto, o None para omitirlo.
+    Los serializadores anidados reciben la forma de su ruta dentro del raíz.
+    """
+
+    def _ruta(self) -> Tuple[str, ...]:
+        ruta, nodo = [], self
+        while nodo.parent is not None:
+            if nodo.field_name:
+                ruta.append(nodo.field_name)
+            nodo = nodo.parent
+        return tuple(reversed(ruta))
+
+    def forma(self) -> FormaRespuesta:
+        raiz = self.root
+        if not hasattr(raiz, '_forma_respuesta'):
+            raiz._forma_respuesta = FormaRespuesta.desde_request(raiz.context.get('request'))
+        return raiz._forma_respuesta
+
+    def get_fields(self):
+        campos = super().get_fields()
+        forma = self.forma()
+        if not forma.moldeada:
+            return campos
+
+        ruta = self._ruta()
+        expandibles = getattr(self.Meta, 'expandibles', {})
+        for nombre in list(campos):
+            if not forma.incluye(ruta, nombre):
+                del campos[nombre]
+            elif nombre in expandibles and not forma.expande(ruta, nombre):
+                colapsar = expandibles[nombre]
+                if colapsar is None:
+                    del campos[nombre]
+                else:
+                    campos[nombre] = colapsar()
+        return campos
+
+    @classmethod
+    def optimizar_consulta(cls, queryset, forma: Optional[FormaRespuesta] = None, ruta: Tuple[str, ...] = ()):
+        """Queryset con las relaciones que necesita la forma pedida; por defecto, tal cual"""
+        return queryset
+
+
+class ConsultaAdaptadaMixin:
+    """Viewset cuyo queryset carga solo las relaciones que el serializador va a recorrer"""
+
+    def get_queryset(self):
+        return self.get_serializer_class().optimizar_consulta(
+            super().get_queryset(), FormaRespuesta.desde_request(self.request)
+        )
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .reglas import ReglasRecomendador
+from .versiones import obtener_version
+
+
+class GetCondicionalMixin:
+    """
+    ETag fuerte y respuestas 304 para list y retrieve de tablas versionadas.
+
+    El ETag combina la versión de la tabla (versiones.py, incrementada por las
+    señales al guardar o eliminar) y la de las reglas del recomendador (de
+    ellas dependen, por ejemplo, los sinónimos de sin_alergenos) con la URL
+    completa y el formato de la respuesta. Si coincide con If-None-Match se responde 304 tras la
+    autenticación y los permisos, sin evaluar el queryset ni serializar.
+
+    La versión se lee antes de consultar: si la tabla cambia mientras tanto,
+    el cliente recibe datos nuevos con un ETag viejo y la siguiente petición
+    simplemente vuelve a descargar.
+    """
+
+    def etag(self, request) -> str:
+        modelo = self.queryset.model
+        variante = f'{request.get_full_path()}|{request.accepted_renderer.format}'
+        resumen = hashlib.sha1(variante.encode()).hexdigest()[:16]
+        reglas = ReglasRecomendador.obtener().version
+        return f'"{modelo._meta.model_name}-{obtener_version(modelo)}-{reglas}-{resumen}"'
+
+    def _condicional(self, vista, request, *args, **kwargs):
+        etag = self.etag(request)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            respuesta = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            respuesta = vista(request, *args, **kwargs)
+        if respuesta.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            respuesta['ETag'] = etag
+            # Los datos dependen de la autorización: solo cachés privadas, siempre revalidando
+            respuesta['Cache-Control'] = 'private, no-cache'
+        return respuesta
+
+    def list(self, request, *args, **kwargs):
+        return self._condicional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self._condicional(super().retrieve, request, *args, **kwargs)
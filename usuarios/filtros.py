@@ -0,0 +1,48 @@
+from rest_framework.exceptions import ValidationError
+
+from .recomendador import CatalogoAlimentos, ProcesadorAlergias
+
+NUTRIENTES = ('calorias', 'proteinas', 'grasas', 'carbohidratos')
+
+
+def _numero(parametros, nombre: str):
+    valor = parametros.get(nombre)
+    if valor in (None, ''):
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        raise ValidationError({nombre: "Debe ser un número."})
+
+
+def filtrar_alimentos(queryset, parametros):
+    """
+    Filtros de AlimentoViewSet por parámetros de la URL.
+
+    categoria y grupo usan el índice (categoria, grupo_alimenticio); buscar
+    filtra por nombre (índice de trigramas en PostgreSQL, migración 0012);
+    <nutriente>_min y <nutriente>_max acotan calorías, proteínas, grasas y
+    carbohidratos; sin_alergenos (lista separada por comas) excluye los
+    alimentos con alguno de esos alérgenos según el índice del catálogo del
+    recomendador, con sus mismas reglas (sinónimos, tildes, plurales, frases
+    como 'frutos secos' y palabras completas).
+    """
+    if parametros.get('categoria'):
+        queryset = queryset.filter(categoria=parametros['categoria'])
+    if parametros.get('grupo'):
+        queryset = queryset.filter(grupo_alimenticio=parametros['grupo'])
+    if parametros.get('buscar', '').strip():
+        queryset = queryset.filter(nombre__icontains=parametros['buscar'].strip())
+
+    for nutriente in NUTRIENTES:
+        minimo = _numero(parametros, f'{nutriente}_min')
+        maximo = _numero(parametros, f'{nutriente}_max')
+        if minimo is not None:
+            queryset = queryset.filter(**{f'{nutriente}__gte': minimo})
+        if maximo is not None:
+            queryset = queryset.filter(**{f'{nutriente}__lte': maximo})
+
+    alergias = ProcesadorAlergias.procesar_alergias(parametros.get('sin_alergenos', ''))
+    if alergias:
+        queryset = queryset.exclude(id__in=CatalogoAlimentos.obtener().ids_con_alergenos(alergias))
+    return queryset
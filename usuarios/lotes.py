@@ -0,0 +1,181 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from django.db import connections, transaction
+
+from .models import Nino, HistorialClinico
+from .recomendador import (
+    CatalogoAlimentos, IndiceParametros, InstantaneaCatalogo, PlanRecomendacion,
+    calcular_edad, guardar_recomendacion, planificar_recomendacion
+)
+
+logger = logging.getLogger(__name__)
+
+# Estado de cada proceso trabajador, fijado una sola vez por el inicializador
+_catalogo_trabajador: Optional[InstantaneaCatalogo] = None
+_preferencias_trabajador: Optional[Dict] = None
+
+
+@dataclass
+class ResultadoLote:
+    """Resumen de una generación por cohorte"""
+    total: int = 0
+    recomendaciones: List[int] = field(default_factory=list)
+    fallos: Dict[int, str] = field(default_factory=dict)
+    duracion_s: float = 0.0
+
+    @property
+    def por_segundo(self) -> float:
+        return len(self.recomendaciones) / self.duracion_s if self.duracion_s else 0.0
+
+
+def seleccionar_cohorte(
+    usuario_id: Optional[int] = None,
+    edad_min: Optional[int] = None,
+    edad_max: Optional[int] = None,
+    hoy: Optional[date] = None
+) -> List[Nino]:
+    """Niños activos, opcionalmente de un usuario y dentro de un rango de edad"""
+    ninos = Nino.objects.filter(activo=True).order_by('id')
+    if usuario_id is not None:
+        ninos = ninos.filter(usuario_id=usuario_id)
+
+    seleccion = []
+    for nino in ninos:
+        edad = calcular_edad(nino.fecha_nacimiento, hoy)
+        if edad_min is not None and edad < edad_min:
+            continue
+        if edad_max is not None and edad > edad_max:
+            continue
+        seleccion.append(nino)
+    return seleccion
+
+
+def _historiales_recientes(ninos: List[Nino], tamano_bloque: int = 1000) -> Dict[int, HistorialClinico]:
+    """Historial activo más reciente de cada niño, en una consulta por bloque"""
+    historiales = {}
+    ids = [nino.id for nino in ninos]
+    for inicio in range(0, len(ids), tamano_bloque):
+        consulta = HistorialClinico.objects.filter(
+            nino_id__in=ids[inicio:inicio + tamano_bloque],
+            activo=True
+        ).order_by('nino_id', *HistorialClinico.ORDEN_RECIENTE)
+        for historial in consulta:
+            historiales.setdefault(historial.nino_id, historial)
+    return historiales
+
+
+def _inicializar_trabajador(catalogo: InstantaneaCatalogo, preferencias_usuario: Optional[Dict]) -> None:
+    global _catalogo_trabajador, _preferencias_trabajador
+    _catalogo_trabajador = catalogo
+    _preferencias_trabajador = preferencias_usuario
+
+
+def _planificar_en_trabajador(nino, historial, parametro):
+    try:
+        plan = planificar_recomendacion(
+            nino, historial, parametro, _catalogo_trabajador, _preferencias_trabajador
+        )
+        return nino.id, plan, None
+    except Exception as e:
+        return nino.id, None, str(e)
+
+
+def _guardar_bloque(planes: List[PlanRecomendacion], motivo: str, resultado: ResultadoLote) -> None:
+    """Guarda un bloque de planes en una sola transacción; cada plan usa su propio savepoint"""
+    with transaction.atomic():
+        for plan in planes:
+            try:
+                with transaction.atomic():
+                    recomendacion = guardar_recomendacion(plan, motivo)
+                resultado.recomendaciones.append(recomendacion.id)
+            except Exception as e:
+                resultado.fallos[plan.nino.id] = str(e)
+                logger.error(f"Error guardando recomendación para niño {plan.nino.id}: {str(e)}")
+    planes.clear()
+
+
+def generar_recomendaciones_cohorte(
+    ninos: Iterable[Nino],
+    motivo: str = "Recomendación automática por cohorte",
+    procesos: Optional[int] = None,
+    tamano_lote: int = 100,
+    preferencias_usuario: Optional[Dict] = None
+) -> ResultadoLote:
+    """
+    Genera una recomendación por niño de la cohorte.
+
+    El catálogo, los parámetros de referencia y los historiales se cargan una
+    sola vez; el cálculo se reparte entre `procesos` procesos (todos los CPU
+    por defecto) y los resultados se guardan en transacciones de `tamano_lote`
+    recomendaciones. Los fallos se registran por niño sin detener el lote.
+    """
+    inicio = time.perf_counter()
+    ninos = list(ninos)
+    resultado = ResultadoLote(total=len(ninos))
+
+    catalogo = CatalogoAlimentos.obtener()
+    historiales = _historiales_recientes(ninos)
+    edades = [calcular_edad(nino.fecha_nacimiento) for nino in ninos]
+    parametros = IndiceParametros.obtener().buscar_varios(edades)
+
+    tareas = []
+    for nino, edad, parametro in zip(ninos, edades, parametros):
+        historial = historiales.get(nino.id)
+        if not historial:
+            resultado.fallos[nino.id] = "No hay historial clínico activo para este niño."
+            continue
+        if not parametro:
+            resultado.fallos[nino.id] = f"No hay parámetros de referencia para la edad {edad} años."
+            continue
+        tareas.append((nino, historial, parametro))
+
+    procesos = procesos or multiprocessing.cpu_count()
+    if procesos > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        logger.warning("La plataforma no admite fork; la cohorte se procesará en un solo proceso")
+        procesos = 1
+
+    pendientes: List[PlanRecomendacion] = []
+
+    def recibir(nino_id, plan, error):
+        if error:
+            resultado.fallos[nino_id] = error
+            logger.error(f"Error generando recomendación para niño {nino_id}: {error}")
+            return
+        pendientes.append(plan)
+        if len(pendientes) >= tamano_lote:
+            _guardar_bloque(pendientes, motivo, resultado)
+
+    if procesos == 1 or len(tareas) <= 1:
+        _inicializar_trabajador(catalogo, preferencias_usuario)
+        for tarea in tareas:
+            recibir(*_planificar_en_trabajador(*tarea))
+    else:
+        # Los hijos heredarían la conexión del padre: se cierra antes del fork
+        for conexion in connections.all():
+            if not conexion.in_atomic_block:
+                conexion.close()
+        with ProcessPoolExecutor(
+            max_workers=procesos,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_inicializar_trabajador,
+            initargs=(catalogo, preferencias_usuario),
+        ) as ejecutor:
+            futuros = [ejecutor.submit(_planificar_en_trabajador, *tarea) for tarea in tareas]
+            for futuro in as_completed(futuros):
+                recibir(*futuro.result())
+
+    if pendientes:
+        _guardar_bloque(pendientes, motivo, resultado)
+
+    resultado.duracion_s = time.perf_counter() - inicio
+    logger.info(
+        f"Cohorte procesada: {len(resultado.recomendaciones)}/{resultado.total} recomendaciones, "
+        f"{len(resultado.fallos)} fallos, {resultado.por_segundo:.1f} rec/s"
+    )
+    return resultado
@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from usuarios.benchmark import ejecutar_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el recomendador sobre catálogos sintéticos (p50/p95 por etapa, consultas y memoria pico) "
+        "en una base de datos de prueba desechable y guarda el resultado en JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanos', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help="Tamaños de catálogo a medir")
+        parser.add_argument('--repeticiones', type=int, default=20, help="Ejecuciones por generador y tamaño")
+        parser.add_argument('--ninos', type=int, default=20, help="Niños sintéticos entre los que se rota")
+        parser.add_argument('--opciones', type=int, default=3, help="Opciones por llamada a generar_opciones")
+        parser.add_argument('--semilla', type=int, default=42)
+        parser.add_argument('--salida', default='benchmark_recomendador.json', help="Archivo JSON de resultados")
+
+    def handle(self, *args, **options):
+        # Igual que los tests: base 'test_<nombre>' (SQLite en memoria o Postgres desechable)
+        nombre_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            resultado = ejecutar_benchmark(
+                tamanos=options['tamanos'],
+                repeticiones=options['repeticiones'],
+                num_ninos=options['ninos'],
+                num_opciones=options['opciones'],
+                semilla=options['semilla'],
+            )
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0)
+
+        with open(options['salida'], 'w', encoding='utf-8') as archivo:
+            json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+
+        for tamano, medidas in resultado['resultados'].items():
+            self.stdout.write(
+                f"{tamano:>7} alimentos: generar p50 {medidas['generar']['total']['p50_ms']:.1f} ms "
+                f"(p95 {medidas['generar']['total']['p95_ms']:.1f}), "
+                f"opciones p50 {medidas['opciones']['total']['p50_ms']:.1f} ms, "
+                f"catálogo en frío {medidas['catalogo_en_frio']['ms']:.0f} ms"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Resultados en {options['salida']}"))
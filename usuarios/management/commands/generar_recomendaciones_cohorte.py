@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from usuarios.lotes import generar_recomendaciones_cohorte, seleccionar_cohorte
+
+
+class Command(BaseCommand):
+    help = "Genera recomendaciones para una cohorte de niños activos usando varios procesos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', type=int, help="Solo los niños de este usuario (id)")
+        parser.add_argument('--edad-min', type=int, help="Edad mínima en años")
+        parser.add_argument('--edad-max', type=int, help="Edad máxima en años")
+        parser.add_argument('--procesos', type=int, help="Procesos de cálculo (por defecto, uno por CPU)")
+        parser.add_argument('--tamano-lote', type=int, default=100, help="Recomendaciones por transacción")
+        parser.add_argument('--solver', choices=['greedy', 'exacto'], help="Solver de selección de alimentos")
+        parser.add_argument('--motivo', default="Recomendación automática por cohorte")
+
+    def handle(self, *args, **options):
+        ninos = seleccionar_cohorte(
+            usuario_id=options['usuario'],
+            edad_min=options['edad_min'],
+            edad_max=options['edad_max'],
+        )
+        self.stdout.write(f"Cohorte: {len(ninos)} niños")
+
+        preferencias = {'solver': options['solver']} if options['solver'] else None
+        resultado = generar_recomendaciones_cohorte(
+            ninos,
+            motivo=options['motivo'],
+            procesos=options['procesos'],
+            tamano_lote=options['tamano_lote'],
+            preferencias_usuario=preferencias,
+        )
+
+        for nino_id, error in sorted(resultado.fallos.items()):
+            self.stderr.write(f"Niño {nino_id}: {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(resultado.recomendaciones)}/{resultado.total} recomendaciones generadas, "
+            f"{len(resultado.fallos)} fallos en {resultado.duracion_s:.2f} s "
+            f"({resultado.por_segundo:.1f} rec/s)"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from usuarios.trabajos import ejecutar_trabajadores
+
+
+class Command(BaseCommand):
+    help = "Procesa la cola de generación de recomendaciones con varios procesos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrencia', type=int, help="Procesos trabajadores (RECOMENDADOR['TRABAJOS_CONCURRENCIA'])")
+        parser.add_argument('--intervalo', type=float, help="Segundos entre consultas a la cola vacía")
+        parser.add_argument('--hasta-vaciar', action='store_true', help="Terminar cuando no queden trabajos pendientes")
+
+    def handle(self, *args, **options):
+        ejecutar_trabajadores(
+            concurrencia=options['concurrencia'],
+            intervalo=options['intervalo'],
+            hasta_vaciar=options['hasta_vaciar'],
+        )
@@ -0,0 +1,103 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+
+@contextmanager
+def contar_consultas():
+    """Cuenta las consultas SQL ejecutadas dentro del bloque (no requiere DEBUG)"""
+    contador = [0]
+
+    def contar(execute, sql, params, many, context):
+        contador[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(contar):
+        yield contador
+
+
+class MedicionEtapas:
+    """Duración y consultas SQL de cada etapa de una generación"""
+
+    activa = True
+
+    def __init__(self):
+        self.etapas: Dict[str, Dict] = {}
+        self._inicio = time.perf_counter()
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        inicio = time.perf_counter()
+        with contar_consultas() as contador:
+            yield
+        registro = self.etapas.setdefault(nombre, {"ms": 0.0, "consultas": 0})
+        registro["ms"] += (time.perf_counter() - inicio) * 1000
+        registro["consultas"] += contador[0]
+
+    def resumen(self) -> Dict:
+        return {
+            "etapas": {
+                nombre: {"ms": round(registro["ms"], 3), "consultas": registro["consultas"]}
+                for nombre, registro in self.etapas.items()
+            },
+            "total_ms": round((time.perf_counter() - self._inicio) * 1000, 3),
+            "consultas": sum(registro["consultas"] for registro in self.etapas.values()),
+        }
+
+
+class _SinMedicion:
+    """Sustituto de MedicionEtapas cuando la medición está desactivada: no mide nada"""
+
+    activa = False
+    _nulo = nullcontext()
+
+    def etapa(self, nombre: str):
+        return self._nulo
+
+    def resumen(self) -> Optional[Dict]:
+        return None
+
+
+SIN_MEDICION = _SinMedicion()
+
+
+def nueva_medicion():
+    """MedicionEtapas si RECOMENDADOR['MEDIR_ETAPAS'] está activo; si no, SIN_MEDICION"""
+    if getattr(settings, 'RECOMENDADOR', {}).get('MEDIR_ETAPAS', False):
+        return MedicionEtapas()
+    return SIN_MEDICION
+
+
+def resumir_perf(fuentes: Iterable[Dict]) -> Dict:
+    """
+    Agrega el bloque 'perf' de varias fuentes de Recomendacion.
+
+    Por ejemplo: resumir_perf(Recomendacion.objects.values_list('fuente', flat=True)).
+    Devuelve, por etapa y para el total, n, p50, p95 y media en ms y consultas medias.
+    """
+    tiempos: Dict[str, list] = {}
+    consultas: Dict[str, list] = {}
+    for fuente in fuentes:
+        perf = (fuente or {}).get("perf")
+        if not perf:
+            continue
+        for nombre, registro in perf["etapas"].items():
+            tiempos.setdefault(nombre, []).append(registro["ms"])
+            consultas.setdefault(nombre, []).append(registro["consultas"])
+        tiempos.setdefault("total", []).append(perf["total_ms"])
+        consultas.setdefault("total", []).append(perf["consultas"])
+
+    return {
+        nombre: {
+            "n": len(valores),
+            "p50_ms": round(float(np.percentile(valores, 50)), 3),
+            "p95_ms": round(float(np.percentile(valores, 95)), 3),
+            "media_ms": round(float(np.mean(valores)), 3),
+            "consultas_media": round(float(np.mean(consultas[nombre])), 2),
+        }
+        for nombre, valores in tiempos.items()
+    }
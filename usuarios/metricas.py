@@ -0,0 +1,312 @@
+import atexit
+import bisect
+import hmac
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin cerrojo de archivos no se pliegan los procesos terminados
+    fcntl = None
+
+# Límites superiores de los buckets de cada histograma (Prometheus añade +Inf)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+HISTOGRAMAS = {
+    'duracion': (
+        'nutricion_http_request_duration_seconds',
+        'Duración de la petición por vista, método y estado HTTP',
+        BUCKETS_SEGUNDOS,
+    ),
+    'consultas': (
+        'nutricion_http_request_db_queries',
+        'Consultas SQL por petición',
+        BUCKETS_CONSULTAS,
+    ),
+    'tiempo_db': (
+        'nutricion_http_request_db_seconds',
+        'Tiempo en la base de datos por petición',
+        BUCKETS_SEGUNDOS,
+    ),
+}
+ETIQUETAS = ('view', 'method', 'status')
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# metricas_<pid>_<instancia>.json: la instancia distingue a un proceso nuevo que reutiliza un pid
+PATRON_ARCHIVO = re.compile(r'^metricas_(\d+)_[0-9a-f]+\.json$')
+ARCHIVO_TERMINADOS = 'metricas_terminados.json'
+
+
+def _configuracion(clave: str, por_defecto):
+    return getattr(settings, 'METRICAS', {}).get(clave, por_defecto)
+
+
+def directorio() -> Path:
+    return Path(_configuracion('DIRECTORIO', Path(tempfile.gettempdir()) / 'nutricion_metricas'))
+
+
+class RegistroMetricas:
+    """
+    Histogramas de las peticiones atendidas por este proceso.
+
+    Cada proceso (worker de gunicorn) acumula en memoria y vuelca sus totales
+    a su propio archivo, metricas_<pid>_<instancia>.json, con un reemplazo
+    atómico; nunca escribe en el archivo de otro. La vista /metrics suma los
+    archivos de todos los procesos; los de procesos que ya terminaron se
+    pliegan en metricas_terminados.json (recolectar), para que los contadores
+    no retrocedan al reciclar workers y los archivos no se acumulen.
+    """
+
+    _lock = threading.Lock()
+    _lock_archivo = threading.Lock()
+    # histograma -> etiquetas -> [conteos por bucket..., suma, total]
+    _datos: Dict[str, Dict[Tuple[str, ...], List[float]]] = {nombre: {} for nombre in HISTOGRAMAS}
+    _ultimo_volcado = 0.0
+    _pid = None
+    _instancia = ''
+
+    @classmethod
+    def _nuevo_proceso(cls) -> None:
+        cls._datos = {nombre: {} for nombre in HISTOGRAMAS}
+        cls._pid = os.getpid()
+        cls._instancia = uuid.uuid4().hex[:12]
+
+    @classmethod
+    def observar(cls, etiquetas: Tuple[str, ...], valores: Dict[str, float]) -> None:
+        with cls._lock:
+            if cls._pid != os.getpid():
+                # Proceso hijo tras un fork: empieza de cero con su propio archivo
+                cls._nuevo_proceso()
+            for nombre, valor in valores.items():
+                buckets = HISTOGRAMAS[nombre][2]
+                serie = cls._datos[nombre].get(etiquetas)
+                if serie is None:
+                    serie = cls._datos[nombre][etiquetas] = [0] * (len(buckets) + 2)
+                posicion = bisect.bisect_left(buckets, valor)
+                if posicion < len(buckets):
+                    serie[posicion] += 1
+                serie[-2] += valor
+                serie[-1] += 1
+
+        if time.monotonic() - cls._ultimo_volcado >= _configuracion('INTERVALO_ESCRITURA_S', 5.0):
+            cls.volcar()
+
+    @classmethod
+    def volcar(cls) -> None:
+        """Escribe los totales del proceso en su archivo (nada si no atendió peticiones)"""
+        # _lock_archivo ordena las escrituras: nunca queda una instantánea anterior
+        with cls._lock_archivo:
+            with cls._lock:
+                if cls._pid != os.getpid() or not any(cls._datos.values()):
+                    return
+                contenido = json.dumps(_serializar(cls._datos))
+                nombre = f'metricas_{cls._pid}_{cls._instancia}.json'
+                cls._ultimo_volcado = time.monotonic()
+
+            _escribir(directorio(), nombre, contenido)
+
+    @classmethod
+    def reiniciar(cls) -> None:
+        with cls._lock:
+            cls._nuevo_proceso()
+            cls._ultimo_volcado = 0.0
+
+
+atexit.register(RegistroMetricas.volcar)
+
+
+def _serializar(datos: Dict[str, Dict[Tuple[str, ...], List[float]]]) -> Dict:
+    return {
+        nombre: [[list(etiquetas), serie] for etiquetas, serie in series.items()]
+        for nombre, series in datos.items()
+    }
+
+
+def _escribir(carpeta: Path, nombre: str, contenido: str) -> None:
+    carpeta.mkdir(parents=True, exist_ok=True)
+    temporal = carpeta / f'.{nombre}.{os.getpid()}.tmp'
+    temporal.write_text(contenido)
+    os.replace(temporal, carpeta / nombre)
+
+
+def agregar_archivos(archivos: Iterable[Path]) -> Dict[str, Dict[Tuple[str, ...], List[float]]]:
+    """Suma los histogramas de los archivos de todos los procesos"""
+    total = {nombre: {} for nombre in HISTOGRAMAS}
+    for archivo in archivos:
+        try:
+            datos = json.loads(archivo.read_text())
+        except (OSError, ValueError):
+            continue
+        for nombre, series in datos.items():
+            if nombre not in total:
+                continue
+            for etiquetas, serie in series:
+                acumulada = total[nombre].setdefault(tuple(etiquetas), [0] * len(serie))
+                for i, valor in enumerate(serie):
+                    acumulada[i] += valor
+    return total
+
+
+def _proceso_vivo(pid: int) -> bool:
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _plegar_terminados(carpeta: Path) -> List[Path]:
+    """
+    Suma a ARCHIVO_TERMINADOS los archivos de procesos que ya no existen y los borra.
+
+    El archivo de terminados lista los archivos que ya contiene ('plegados'):
+    si el proceso muere entre escribirlo y borrarlos, no se cuentan dos veces.
+    Devuelve los archivos de procesos vivos.
+    """
+    terminados = carpeta / ARCHIVO_TERMINADOS
+    try:
+        plegados = set(json.loads(terminados.read_text()).get('plegados', []))
+    except (OSError, ValueError):
+        plegados = set()
+    plegados = {nombre for nombre in plegados if (carpeta / nombre).exists()}
+
+    vivos, muertos = [], []
+    for archivo in carpeta.glob('metricas_*.json'):
+        coincidencia = PATRON_ARCHIVO.match(archivo.name)
+        if coincidencia is None or archivo.name in plegados:
+            continue
+        (vivos if _proceso_vivo(int(coincidencia[1])) else muertos).append(archivo)
+
+    if muertos:
+        total = agregar_archivos([terminados, *muertos])
+        plegados |= {archivo.name for archivo in muertos}
+        _escribir(carpeta, ARCHIVO_TERMINADOS, json.dumps({**_serializar(total), 'plegados': sorted(plegados)}))
+    for nombre in plegados:
+        (carpeta / nombre).unlink(missing_ok=True)
+    return vivos
+
+
+def recolectar(carpeta: Path) -> Dict[str, Dict[Tuple[str, ...], List[float]]]:
+    """Totales de todos los procesos, vivos y terminados"""
+    if fcntl is None:
+        return agregar_archivos(carpeta.glob('metricas_*.json'))
+
+    carpeta.mkdir(parents=True, exist_ok=True)
+    # Un solo plegado a la vez, y nadie suma mientras otro pliega
+    with open(carpeta / '.metricas.lock', 'a') as cerrojo:
+        fcntl.flock(cerrojo, fcntl.LOCK_EX)
+        vivos = _plegar_terminados(carpeta)
+        return agregar_archivos([carpeta / ARCHIVO_TERMINADOS, *vivos])
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formato(valor: float) -> str:
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exponer(datos: Dict[str, Dict[Tuple[str, ...], List[float]]]) -> str:
+    """Histogramas en el formato de texto de Prometheus"""
+    lineas = []
+    for nombre, (metrica, ayuda, buckets) in HISTOGRAMAS.items():
+        lineas.append(f'# HELP {metrica} {ayuda}')
+        lineas.append(f'# TYPE {metrica} histogram')
+        for etiquetas, serie in sorted(datos[nombre].items()):
+            base = ','.join(f'{clave}="{_escapar(valor)}"' for clave, valor in zip(ETIQUETAS, etiquetas))
+            acumulado = 0
+            for limite, conteo in zip(buckets, serie):
+                acumulado += conteo
+                lineas.append(f'{metrica}_bucket{{{base},le="{_formato(limite)}"}} {acumulado}')
+            lineas.append(f'{metrica}_bucket{{{base},le="+Inf"}} {serie[-1]}')
+            lineas.append(f'{metrica}_sum{{{base}}} {_formato(serie[-2])}')
+            lineas.append(f'{metrica}_count{{{base}}} {serie[-1]}')
+    return '\n'.join(lineas) + '\n'
+
+
+def nombre_vista(request) -> str:
+    """'NinoViewSet.list', 'generar_recomendacion'... o 'sin_ruta' si la URL no resolvió"""
+    coincidencia = getattr(request, 'resolver_match', None)
+    if coincidencia is None:
+        return 'sin_ruta'
+    funcion = coincidencia.func
+    clase = getattr(funcion, 'cls', None)
+    if clase is None:
+        return getattr(funcion, '__name__', coincidencia.view_name or 'desconocida')
+    acciones = getattr(funcion, 'actions', None) or {}
+    accion = acciones.get(request.method.lower(), request.method.lower())
+    return f'{clase.__name__}.{accion}'
+
+
+class MetricasMiddleware:
+    """Registra latencia, consultas SQL y tiempo en base de datos de cada petición"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.path == '/metrics':
+            return self.get_response(request)
+
+        db = {'consultas': 0, 'segundos': 0.0}
+
+        def medir_consulta(execute, sql, params, many, context):
+            inicio = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db['consultas'] += 1
+                db['segundos'] += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(medir_consulta):
+            response = self.get_response(request)
+        duracion = time.perf_counter() - inicio
+
+        RegistroMetricas.observar(
+            (nombre_vista(request), request.method, str(response.status_code)),
+            {'duracion': duracion, 'consultas': db['consultas'], 'tiempo_db': db['segundos']},
+        )
+        return response
+
+
+def autorizado(request) -> bool:
+    """
+    Con METRICAS['TOKEN'], exige 'Authorization: Bearer <token>'.
+
+    Sin token se niega el acceso: detrás de un proxy en la misma máquina toda
+    petición llega desde 127.0.0.1. Solo con DEBUG se atiende sin token a las
+    direcciones de METRICAS['IPS_PERMITIDAS'] (localhost por defecto).
+    """
+    token = _configuracion('TOKEN', '')
+    if token:
+        recibido = request.headers.get('Authorization', '')
+        return hmac.compare_digest(recibido.encode(), f'Bearer {token}'.encode())
+    if not settings.DEBUG:
+        return False
+    return request.META.get('REMOTE_ADDR') in _configuracion('IPS_PERMITIDAS', ('127.0.0.1', '::1'))
+
+
+def metricas(request):
+    """Métricas de todos los workers en formato Prometheus"""
+    if not autorizado(request):
+        return HttpResponse(status=403)
+    RegistroMetricas.volcar()
+    return HttpResponse(exponer(recolectar(directorio())), content_type=CONTENT_TYPE)
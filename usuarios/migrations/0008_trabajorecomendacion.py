@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0007_permiso_rolpermiso_rolpersonalizado_rolpermiso_rol_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoRecomendacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('motivo', models.CharField(default='Recomendación automática generada', max_length=255)),
+                ('preferencias', models.JSONField(blank=True, null=True)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_proceso', 'En proceso'), ('completado', 'Completado'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('progreso', models.PositiveSmallIntegerField(default=0, help_text='Porcentaje completado')),
+                ('error', models.TextField(blank=True)),
+                ('trabajador', models.CharField(blank=True, max_length=100)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('nino', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trabajos_recomendacion', to='usuarios.nino')),
+                ('recomendacion', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos', to='usuarios.recomendacion')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='usuarios_tr_estado_bf294c_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0008_trabajorecomendacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alimento',
+            name='rasgos',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
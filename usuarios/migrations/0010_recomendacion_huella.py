@@ -0,0 +1,22 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0009_alimento_rasgos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recomendacion',
+            name='huella',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='recomendacion',
+            index=models.Index(fields=['nino', 'huella'], name='usuarios_re_nino_id_15076d_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0010_recomendacion_huella'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='logactividad',
+            index=models.Index(fields=['-fecha_hora', '-id'], name='usuarios_lo_fecha_h_915d76_idx'),
+        ),
+    ]
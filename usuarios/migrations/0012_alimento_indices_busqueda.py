@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+# Trigramas sobre UPPER(nombre): es la expresión que genera nombre__icontains
+# en PostgreSQL, así que la búsqueda por subcadena usa el índice. Requiere la
+# extensión pg_trgm (el usuario de la migración debe poder crearla).
+INDICE_TRIGRAMAS = 'usuarios_alimento_nombre_trgm'
+
+
+def crear_indice_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDICE_TRIGRAMAS} '
+        'ON usuarios_alimento USING gin (UPPER(nombre) gin_trgm_ops)'
+    )
+
+
+def eliminar_indice_trigramas(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDICE_TRIGRAMAS}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0011_logactividad_fecha_hora_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alimento',
+            index=models.Index(fields=['categoria', 'grupo_alimenticio'], name='usuarios_al_categor_e056e0_idx'),
+        ),
+        migrations.RunPython(crear_indice_trigramas, eliminar_indice_trigramas),
+    ]
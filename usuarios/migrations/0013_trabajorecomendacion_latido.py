@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0012_alimento_indices_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trabajorecomendacion',
+            name='latido',
+            field=models.DateTimeField(blank=True, help_text='Último aviso del trabajador que lo procesa', null=True),
+        ),
+    ]
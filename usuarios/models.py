@@ -1,6 +1,12 @@
 from django.db import models
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 
+# Se emite una vez por recomendación al guardar sus alimentos en bloque
+# (bulk_create no dispara post_save por cada fila)
+alimentos_recomendacion_agregados = Signal()
+recomendaciones_creadas_en_bloque = Signal()
+
 # Gestor personalizado de usuarios
 class UsuarioManager(BaseUserManager):
     def create_user(self, correo, password=None, **extra_fields):
@@ -66,6 +72,23 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
         return permisos.exists()
 
 
+class NinoQuerySet(models.QuerySet):
+    def con_historial_reciente(self):
+        """
+        Anota alergias y enfermedades del historial más reciente de cada niño
+        (historial_reciente_id es None si no tiene), con subconsultas en la
+        misma consulta en vez de una consulta por niño.
+        """
+        reciente = HistorialClinico.objects.filter(
+            nino=models.OuterRef('pk')
+        ).order_by(*HistorialClinico.ORDEN_RECIENTE)
+        return self.annotate(
+            historial_reciente_id=models.Subquery(reciente.values('id')[:1]),
+            historial_alergias=models.Subquery(reciente.values('alergias')[:1]),
+            historial_enfermedades=models.Subquery(reciente.values('enfermedades')[:1]),
+        )
+
+
 # Modelo de niño relacionado a un usuario
 class Nino(models.Model):
     usuario = models.ForeignKey(Usuario, on_delete=models.CASCADE, related_name='ninos')
@@ -78,6 +101,8 @@ class Nino(models.Model):
     fecha_nacimiento = models.DateField()
     activo = models.BooleanField(default=True)  # Para "eliminar" lógicamente
 
+    objects = NinoQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.nombres} {self.apellido_paterno}"
 
@@ -91,6 +116,10 @@ class LogActividad(models.Model):
     descripcion = models.TextField()
     fecha_hora = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Orden del listado y de su paginación por cursor
+        indexes = [models.Index(fields=['-fecha_hora', '-id'])]
+
     def __str__(self):
         return f"{self.accion} por {self.usuario} el {self.fecha_hora}"
 
@@ -111,6 +140,9 @@ class HistorialClinico(models.Model):
     activo = models.BooleanField(default=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
 
+    # Orden para obtener el historial más reciente de un niño
+    ORDEN_RECIENTE = ('-fecha_actualizacion', '-id')
+
     def __str__(self):
         return f"Historial de {self.nino.nombres} {self.nino.apellido_paterno} - {self.fecha_actualizacion.strftime('%Y-%m-%d')}"
 
@@ -131,6 +163,13 @@ class Alimento(models.Model):
     carbohidratos = models.FloatField()
     grupo_alimenticio = models.CharField(max_length=50)
     alergenos = models.JSONField()
+    # Rasgos de palatabilidad según las reglas del recomendador (signals, al guardar)
+    rasgos = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        # Filtros de AlimentoViewSet; la búsqueda por nombre usa además un
+        # índice de trigramas solo en PostgreSQL (migración 0012)
+        indexes = [models.Index(fields=['categoria', 'grupo_alimenticio'])]
 
     def __str__(self):
         return self.nombre
@@ -147,10 +186,65 @@ class Recomendacion(models.Model):
     proteinas_totales = models.FloatField(null=True, blank=True)
     alergenos_evitados = models.JSONField(null=True, blank=True)
     notas = models.TextField(blank=True)
+    # Hash de las entradas del generador; vacío en las recomendaciones manuales
+    huella = models.CharField(max_length=64, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['nino', 'huella']),
+        ]
 
     def __str__(self):
         return f"Recomendacion para {self.nino.nombres} {self.nino.apellido_paterno} - {self.fecha} ({self.estado})"
 
+    def agregar_alimentos(self, desayunos=(), almuerzos=(), cenas=()):
+        """
+        Guarda en bloque los alimentos de cada comida.
+
+        Hace un INSERT por comida con alimentos y emite una sola señal de
+        auditoría para todo el conjunto.
+        """
+        items = {
+            'desayuno': RecomendacionDesayuno.objects.bulk_create(
+                [RecomendacionDesayuno(recomendacion=self, alimento=alimento) for alimento in desayunos]
+            ),
+            'almuerzo': RecomendacionAlmuerzo.objects.bulk_create(
+                [RecomendacionAlmuerzo(recomendacion=self, alimento=alimento) for alimento in almuerzos]
+            ),
+            'cena': RecomendacionCena.objects.bulk_create(
+                [RecomendacionCena(recomendacion=self, alimento=alimento) for alimento in cenas]
+            ),
+        }
+        alimentos_recomendacion_agregados.send(sender=Recomendacion, instance=self, items=items)
+        return items
+
+    @classmethod
+    def crear_en_bloque(cls, recomendaciones, comidas):
+        """
+        Guarda varias recomendaciones nuevas con sus alimentos.
+
+        comidas[i] es {'desayuno': [...], 'almuerzo': [...], 'cena': [...]} de
+        recomendaciones[i]. Hace un INSERT para las recomendaciones, uno por
+        comida para los alimentos de todas y emite una sola señal de auditoría.
+        """
+        recomendaciones = cls.objects.bulk_create(recomendaciones)
+        posicion = {recomendacion.pk: i for i, recomendacion in enumerate(recomendaciones)}
+        items = [{} for _ in recomendaciones]
+        for comida, modelo in (
+            ('desayuno', RecomendacionDesayuno), ('almuerzo', RecomendacionAlmuerzo), ('cena', RecomendacionCena)
+        ):
+            for item_comida in items:
+                item_comida[comida] = []
+            creados = modelo.objects.bulk_create([
+                modelo(recomendacion=recomendacion, alimento=alimento)
+                for recomendacion, comidas_dia in zip(recomendaciones, comidas)
+                for alimento in comidas_dia.get(comida, ())
+            ])
+            for item in creados:
+                items[posicion[item.recomendacion_id]][comida].append(item)
+        recomendaciones_creadas_en_bloque.send(sender=cls, instances=recomendaciones, items=items)
+        return recomendaciones
+
 
 class RecomendacionDesayuno(models.Model):
     recomendacion = models.ForeignKey(Recomendacion, on_delete=models.CASCADE, related_name='desayunos')
@@ -176,6 +270,38 @@ class RecomendacionCena(models.Model):
         return f"Cena: {self.alimento.nombre} para recomendacion {self.recomendacion.id}"
 
 
+# Cola de generación de recomendaciones (procesada por procesar_trabajos_recomendacion)
+
+class TrabajoRecomendacion(models.Model):
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_proceso', 'En proceso'),
+        ('completado', 'Completado'),
+        ('error', 'Error'),
+    ]
+
+    nino = models.ForeignKey(Nino, on_delete=models.CASCADE, related_name='trabajos_recomendacion')
+    motivo = models.CharField(max_length=255, default="Recomendación automática generada")
+    preferencias = models.JSONField(null=True, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='pendiente')
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="Porcentaje completado")
+    recomendacion = models.ForeignKey(
+        Recomendacion, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos'
+    )
+    error = models.TextField(blank=True)
+    trabajador = models.CharField(max_length=100, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    latido = models.DateTimeField(null=True, blank=True, help_text="Último aviso del trabajador que lo procesa")
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['estado', 'fecha_creacion'])]
+
+    def __str__(self):
+        return f"Trabajo {self.id} para {self.nino} ({self.estado})"
+
+
 # Modelo Parametros
 
 class ParametroReferencia(models.Model):
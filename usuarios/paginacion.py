@@ -0,0 +1,51 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+def _configuracion(clave: str, por_defecto):
+    return getattr(settings, 'PAGINACION', {}).get(clave, por_defecto)
+
+
+class PaginacionCursor(CursorPagination):
+    """
+    Paginación por cursor para todos los viewsets.
+
+    Estable ante inserciones y sin OFFSET: cada página filtra a partir de la
+    última fila de la anterior usando el orden del viewset (`orden_cursor`,
+    por defecto '-id'), que debe estar indexado.
+
+    `?page_size=` elige el tamaño hasta PAGINACION['TAMANO_MAXIMO'].
+    `?paginar=0` devuelve la lista completa sin envoltorio, como antes de la
+    paginación; en los viewsets con `limitar_sin_paginar` se corta en las
+    PAGINACION['SIN_PAGINAR_MAXIMO'] filas más recientes.
+    """
+
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    parametro_sin_paginar = 'paginar'
+
+    @property
+    def max_page_size(self):
+        return _configuracion('TAMANO_MAXIMO', 500)
+
+    def get_ordering(self, request, queryset, view):
+        orden = getattr(view, 'orden_cursor', None)
+        if orden:
+            return (orden,) if isinstance(orden, str) else tuple(orden)
+        return super().get_ordering(request, queryset, view)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.sin_paginar = request.query_params.get(self.parametro_sin_paginar) in ('0', 'false', 'no')
+        if not self.sin_paginar:
+            return super().paginate_queryset(queryset, request, view)
+
+        if getattr(view, 'limitar_sin_paginar', False):
+            orden = self.get_ordering(request, queryset, view)
+            return list(queryset.order_by(*orden)[:_configuracion('SIN_PAGINAR_MAXIMO', 1000)])
+        return list(queryset)
+
+    def get_paginated_response(self, data):
+        if self.sin_paginar:
+            return Response(data)
+        return super().get_paginated_response(data)
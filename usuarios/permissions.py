@@ -36,3 +36,17 @@ class CustomDjangoModelPermission(BasePermission):
         
         # Verificar si el usuario tiene el permiso con ese código
         return usuario.tiene_permiso(codigo_permiso)
+
+
+def requiere_permiso(codigo_permiso):
+    """
+    Permiso por código fijo, para vistas de función que no tienen un queryset
+    del que deducirlo (p. ej. requiere_permiso('crear_recomendacion')).
+    """
+
+    class PermisoPorCodigo(BasePermission):
+        def has_permission(self, request, view):
+            return request.user.tiene_permiso(codigo_permiso)
+
+    PermisoPorCodigo.__name__ = f'Permiso_{codigo_permiso}'
+    return PermisoPorCodigo
@@ -1,18 +1,30 @@
-from datetime import date
+from datetime import date, timedelta
+from django.conf import settings
 from django.db import transaction
 from django.utils.timezone import now
 from django.db.models import Q
 import json
 import logging
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
-from collections import defaultdict
+import math
+import bisect
+import hashlib
+import re
+import itertools
+import threading
+import time
+import numpy as np
+from typing import Callable, List, Dict, Tuple, Optional, FrozenSet
+from dataclasses import dataclass, asdict, replace
+from collections import defaultdict, OrderedDict
 from .models import Alimento, ParametroReferencia, HistorialClinico, Recomendacion, RecomendacionAlmuerzo, RecomendacionCena, RecomendacionDesayuno, Nino
+from .versiones import obtener_version
+from .reglas import ReglasRecomendador, ConjuntoReglas
+from .medicion import SIN_MEDICION, nueva_medicion
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(frozen=True)
 class RequisitoNutricional:
     """Clase para manejar requerimientos nutricionales calculados"""
     calorias_totales: float
@@ -30,6 +42,53 @@ class RequisitoNutricional:
     almuerzo_proteinas: float
     cena_proteinas: float
 
+    # Valores intermedios, para no recalcularlos al armar la fuente
+    tmb: float = 0.0
+    factor_actividad: float = 1.4
+
+class CacheLRU:
+    """Diccionario acotado con desalojo LRU, seguro entre hilos y con contadores de aciertos"""
+
+    def __init__(self, capacidad: int):
+        self.capacidad = capacidad
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave, calcular):
+        """Valor de la clave; si no está, lo calcula con calcular() y lo guarda"""
+        with self._lock:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                self.aciertos += 1
+                return self._datos[clave]
+            self.fallos += 1
+        valor = calcular()
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.capacidad:
+                self._datos.popitem(last=False)
+        return valor
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+            self.aciertos = 0
+            self.fallos = 0
+
+    def estadisticas(self) -> Dict[str, float]:
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+                "tamano": len(self._datos),
+                "capacidad": self.capacidad,
+            }
+
 @dataclass 
 class AlimentoConPuntuacion:
     """Alimento con puntuación calculada para optimización"""
@@ -39,6 +98,203 @@ class AlimentoConPuntuacion:
     puntuacion_total: float
     porcion_sugerida: float
 
+@dataclass(frozen=True)
+class InstantaneaCatalogo:
+    """Copia inmutable del catálogo de alimentos en un momento dado"""
+    version: Tuple[int, str]  # (versión de la tabla Alimento, versión de las reglas)
+    alimentos: Dict[str, Tuple['Alimento', ...]]
+    # categoría -> alérgeno estandarizado -> ids de alimentos que lo contienen
+    indice_alergenos: Dict[str, Dict[str, FrozenSet[int]]]
+    matrices: Dict[str, 'MatrizNutricional']
+
+    def por_categoria(self, categoria: str) -> Tuple['Alimento', ...]:
+        return self.alimentos.get(categoria, ())
+
+    def _excluidos(self, categoria: str, alergias: List[str]) -> set:
+        indice = self.indice_alergenos.get(categoria, {})
+        return set().union(*(indice.get(alergia, ()) for alergia in alergias))
+
+    def ids_con_alergenos(self, alergias: List[str]) -> set:
+        """
+        Ids de los alimentos de cualquier categoría que contienen alguna de las alergias.
+
+        Las alergias deben venir de ProcesadorAlergias.procesar_alergias, que
+        normaliza igual que el índice (ConjuntoReglas.alergenos_en_texto).
+        """
+        return set().union(*(self._excluidos(categoria, alergias) for categoria in self.indice_alergenos))
+
+    def alimentos_seguros(self, categoria: str, alergias: List[str]) -> List['Alimento']:
+        """Alimentos de la categoría que no contienen ninguna de las alergias estandarizadas"""
+        return list(self.matriz_segura(categoria, alergias).alimentos)
+
+    def matriz_segura(self, categoria: str, alergias: List[str]) -> 'MatrizNutricional':
+        """Matriz nutricional de los alimentos seguros de la categoría"""
+        matriz = self.matrices.get(categoria)
+        if matriz is None:
+            return MatrizNutricional.desde_alimentos(())
+        excluidos = self._excluidos(categoria, alergias)
+        if not excluidos:
+            return matriz
+        return matriz.subconjunto(~np.isin(matriz.ids, list(excluidos)))
+
+class CatalogoAlimentos:
+    """
+    Instantánea del catálogo de alimentos compartida por todo el proceso.
+
+    Se recarga solo cuando cambia la versión de la tabla Alimento, que los
+    signals incrementan en cada alta, edición o baja, o cuando cambian las
+    reglas del recomendador.
+    """
+
+    _instantanea: Optional[InstantaneaCatalogo] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def obtener(cls) -> InstantaneaCatalogo:
+        """Devuelve la instantánea vigente, recargándola si quedó obsoleta"""
+        reglas = ReglasRecomendador.obtener()
+        version = (obtener_version(Alimento), reglas.version)
+        instantanea = cls._instantanea
+        if instantanea is not None and instantanea.version == version:
+            return instantanea
+
+        with cls._lock:
+            instantanea = cls._instantanea
+            if instantanea is None or instantanea.version != version:
+                instantanea = cls._cargar(version, reglas)
+                cls._instantanea = instantanea
+        return instantanea
+
+    @classmethod
+    def invalidar(cls) -> None:
+        """Descarta la instantánea del proceso actual"""
+        with cls._lock:
+            cls._instantanea = None
+
+    @staticmethod
+    def _cargar(version: Tuple[int, str], reglas: ConjuntoReglas) -> InstantaneaCatalogo:
+        por_categoria = defaultdict(list)
+        indice = defaultdict(lambda: defaultdict(set))
+        for alimento in Alimento.objects.order_by('id'):
+            por_categoria[alimento.categoria].append(alimento)
+            for alergeno in ProcesadorAlergias.alergenos_de_alimento(alimento, reglas):
+                indice[alimento.categoria][alergeno].add(alimento.id)
+
+        logger.info(f"Catálogo de alimentos cargado (versión {version})")
+        return InstantaneaCatalogo(
+            version=version,
+            alimentos={categoria: tuple(lista) for categoria, lista in por_categoria.items()},
+            matrices={
+                categoria: MatrizNutricional.desde_alimentos(lista, reglas)
+                for categoria, lista in por_categoria.items()
+            },
+            indice_alergenos={
+                categoria: {alergeno: frozenset(ids) for alergeno, ids in por_alergeno.items()}
+                for categoria, por_alergeno in indice.items()
+            },
+        )
+
+@dataclass(frozen=True)
+class InstantaneaParametros:
+    """
+    Parámetros de referencia como índice de intervalos de edad ordenados.
+
+    Los rangos se reparten en tramos disjuntos [inicio, fin]; si dos filas se
+    solapan, el tramo común queda para la de menor id (la que devolvía la
+    consulta sin orden en la práctica) y el solapamiento se reporta al cargar.
+    """
+    version: int
+    inicios: np.ndarray
+    fines: np.ndarray
+    parametros: Tuple['ParametroReferencia', ...]
+    solapamientos: Tuple[Tuple[int, int], ...]
+
+    @classmethod
+    def desde_parametros(cls, parametros, version: int = 0) -> 'InstantaneaParametros':
+        parametros = sorted(parametros, key=lambda p: p.id)
+        limites = sorted({p.edad_min for p in parametros} | {p.edad_max + 1 for p in parametros})
+        tramos = []
+        for inicio, siguiente in zip(limites, limites[1:]):
+            # El primero en orden de id gana el tramo
+            parametro = next((p for p in parametros if p.edad_min <= inicio <= p.edad_max), None)
+            if parametro is None:
+                continue
+            if tramos and tramos[-1][2] is parametro and tramos[-1][1] == inicio - 1:
+                tramos[-1][1] = siguiente - 1
+            else:
+                tramos.append([inicio, siguiente - 1, parametro])
+
+        solapamientos = tuple(
+            (a.id, b.id) for a, b in itertools.combinations(parametros, 2)
+            if a.edad_min <= b.edad_max and b.edad_min <= a.edad_max
+        )
+        return cls(
+            version=version,
+            inicios=np.array([t[0] for t in tramos], dtype=np.int64),
+            fines=np.array([t[1] for t in tramos], dtype=np.int64),
+            parametros=tuple(t[2] for t in tramos),
+            solapamientos=solapamientos,
+        )
+
+    def buscar(self, edad: int) -> Optional['ParametroReferencia']:
+        """Parámetro vigente para la edad, o None si ningún rango la cubre"""
+        i = bisect.bisect_right(self.inicios, edad) - 1
+        if i < 0 or edad > self.fines[i]:
+            return None
+        return self.parametros[i]
+
+    def buscar_varios(self, edades) -> List[Optional['ParametroReferencia']]:
+        """buscar() para un arreglo de edades en una sola pasada"""
+        edades = np.asarray(edades, dtype=np.int64)
+        posiciones = np.searchsorted(self.inicios, edades, side='right') - 1
+        validas = posiciones >= 0
+        validas[validas] &= edades[validas] <= self.fines[posiciones[validas]]
+        return [self.parametros[i] if ok else None for i, ok in zip(posiciones.tolist(), validas.tolist())]
+
+class IndiceParametros:
+    """
+    Índice de parámetros de referencia compartido por todo el proceso.
+
+    Igual que CatalogoAlimentos: se recarga cuando cambia la versión de la
+    tabla ParametroReferencia.
+    """
+
+    _instantanea: Optional[InstantaneaParametros] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def obtener(cls) -> InstantaneaParametros:
+        """Devuelve el índice vigente, recargándolo si quedó obsoleto"""
+        version = obtener_version(ParametroReferencia)
+        instantanea = cls._instantanea
+        if instantanea is not None and instantanea.version == version:
+            return instantanea
+
+        with cls._lock:
+            instantanea = cls._instantanea
+            if instantanea is None or instantanea.version != version:
+                instantanea = cls._cargar(version)
+                cls._instantanea = instantanea
+        return instantanea
+
+    @classmethod
+    def invalidar(cls) -> None:
+        """Descarta el índice del proceso actual"""
+        with cls._lock:
+            cls._instantanea = None
+
+    @staticmethod
+    def _cargar(version: int) -> InstantaneaParametros:
+        instantanea = InstantaneaParametros.desde_parametros(ParametroReferencia.objects.all(), version)
+        if instantanea.solapamientos:
+            logger.warning(
+                "Parámetros de referencia con rangos de edad solapados (ids): "
+                + ", ".join(f"{a}/{b}" for a, b in instantanea.solapamientos)
+                + "; se usa el de menor id"
+            )
+        logger.info(f"Parámetros de referencia cargados (versión {version})")
+        return instantanea
+
 class CalculadoraNutricional:
     """Clase para cálculos nutricionales avanzados"""
     
@@ -84,15 +340,41 @@ class CalculadoraNutricional:
             else:  # mixto
                 return 14.85 * peso + 698.5
 
+    # Requerimientos ya calculados, compartidos por todo el proceso
+    _memo = CacheLRU(getattr(settings, 'RECOMENDADOR', {}).get('MEMO_REQUERIMIENTOS_MAX', 1024))
+
+    @classmethod
+    def requerimientos(
+        cls, nino, historial: 'HistorialClinico', parametro: 'ParametroReferencia', hoy: Optional[date] = None
+    ) -> RequisitoNutricional:
+        """
+        Igual que calcular_requerimientos, pero memorizado.
+
+        La clave es (historial, fecha_actualizacion, parámetro, edad a la fecha,
+        versión de las reglas): cualquier edición del historial cambia
+        fecha_actualizacion y con ella la clave. Los historiales sin guardar se
+        calculan siempre.
+        """
+        if historial.pk is None or parametro.pk is None:
+            return cls.calcular_requerimientos(nino, historial, parametro, hoy)
+        clave = (
+            historial.pk, historial.fecha_actualizacion, parametro.pk, parametro.hierro,
+            calcular_edad(nino.fecha_nacimiento, hoy), ReglasRecomendador.obtener().version
+        )
+        return cls._memo.obtener(clave, lambda: cls.calcular_requerimientos(nino, historial, parametro, hoy))
+
+    @classmethod
+    def estadisticas_memo(cls) -> Dict[str, float]:
+        return cls._memo.estadisticas()
+
     @classmethod
-    def calcular_requerimientos(cls, nino, historial: 'HistorialClinico', parametro: 'ParametroReferencia') -> RequisitoNutricional:
+    def calcular_requerimientos(
+        cls, nino, historial: 'HistorialClinico', parametro: 'ParametroReferencia', hoy: Optional[date] = None
+    ) -> RequisitoNutricional:
         """Calcula requerimientos nutricionales personalizados"""
         
         # Calcular edad
-        hoy = date.today()
-        edad = hoy.year - nino.fecha_nacimiento.year - (
-            (hoy.month, hoy.day) < (nino.fecha_nacimiento.month, nino.fecha_nacimiento.day)
-        )
+        edad = calcular_edad(nino.fecha_nacimiento, hoy)
         
         # TMB base
         tmb = cls.calcular_tmb_pediatrica(historial.peso, historial.talla, edad)
@@ -101,17 +383,16 @@ class CalculadoraNutricional:
         factor_actividad = cls.FACTORES_ACTIVIDAD.get(historial.actividad_fisica, 1.4)
         calorias_totales = tmb * factor_actividad
         
-        # Ajustar por condiciones especiales
-        if 'desnutricion' in historial.enfermedades.lower():
-            calorias_totales *= 1.2  # 20% extra para recuperación
-        if 'diabetes' in historial.enfermedades.lower():
-            calorias_totales *= 0.95  # Ligera reducción
+        # Ajustar por condiciones especiales (reglas 'enfermedades')
+        ajustes = ReglasRecomendador.obtener().ajustes_enfermedad(historial.enfermedades)
+        for ajuste in ajustes:
+            calorias_totales *= ajuste.factor_calorias
             
         # Calcular macronutrientes
         # Proteínas: 1.2-2.0g/kg según edad y condición
         proteinas_por_kg = 1.5 if edad < 6 else 1.2
-        if 'desnutricion' in historial.enfermedades.lower():
-            proteinas_por_kg *= 1.3
+        for ajuste in ajustes:
+            proteinas_por_kg *= ajuste.factor_proteinas
             
         proteinas_totales = historial.peso * proteinas_por_kg
         
@@ -136,50 +417,102 @@ class CalculadoraNutricional:
             desayuno_proteinas=proteinas_totales * cls.DISTRIBUCION_PROTEINAS['desayuno'],
             almuerzo_proteinas=proteinas_totales * cls.DISTRIBUCION_PROTEINAS['almuerzo'],
             cena_proteinas=proteinas_totales * cls.DISTRIBUCION_PROTEINAS['cena'],
+
+            tmb=tmb,
+            factor_actividad=factor_actividad,
         )
 
 class ProcesadorAlergias:
-    """Maneja el procesamiento y normalización de alergias"""
-    
-    # Mapeo de alergias comunes a términos estandarizados
-    MAPEO_ALERGIAS = {
-        'leche': ['lactosa', 'caseina', 'lacteo'],
-        'huevo': ['clara', 'yema'],
-        'trigo': ['gluten', 'harina'],
-        'soja': ['soya'],
-        'frutos_secos': ['nuez', 'almendra', 'avellana', 'pistacho'],
-        'mariscos': ['camaron', 'langosta', 'cangrejo'],
-        'pescado': ['atun', 'salmon', 'merluza'],
-    }
+    """
+    Maneja el procesamiento y normalización de alergias.
+
+    El mapeo de sinónimos a términos estandarizados es la sección 'alergias'
+    de las reglas del recomendador; se compara sin mayúsculas ni tildes.
+    """
+
+    SEPARADORES = re.compile(r'[,;/\n]')
+
+    # Texto libre de HistorialClinico.alergias -> alergias estandarizadas
+    _cache = CacheLRU(getattr(settings, 'RECOMENDADOR', {}).get('CACHE_ALERGIAS_MAX', 1024))
     
+    @classmethod
+    def normalizar_alergeno(cls, termino: str, reglas: Optional[ConjuntoReglas] = None) -> str:
+        """Devuelve el término estandarizado de un alérgeno"""
+        return (reglas or ReglasRecomendador.obtener()).estandarizar_alergeno(termino)
+
     @classmethod
     def procesar_alergias(cls, texto_alergias: str) -> List[str]:
-        """Convierte texto de alergias a lista estandarizada"""
+        """
+        Convierte texto de alergias a lista estandarizada (memorizado por texto).
+
+        Cada entrada pasa por ConjuntoReglas.alergenos_en_texto, igual que los
+        alérgenos de los alimentos: 'frutos secos' excluye la nuez y 'huevo'
+        excluye un alimento que declara 'huevos'.
+        """
         if not texto_alergias:
             return []
-            
-        alergias_raw = [a.strip().lower() for a in texto_alergias.split(',')]
-        alergias_normalizadas = set()
-        
-        for alergia in alergias_raw:
-            # Buscar en mapeo
-            encontrada = False
-            for clave, sinonimos in cls.MAPEO_ALERGIAS.items():
-                if alergia in sinonimos or alergia == clave:
-                    alergias_normalizadas.add(clave)
-                    encontrada = True
-                    break
-            
-            if not encontrada:
-                alergias_normalizadas.add(alergia)
-                
-        return list(alergias_normalizadas)
+
+        reglas = ReglasRecomendador.obtener()
+
+        def calcular():
+            return tuple(sorted(set().union(*(
+                reglas.alergenos_en_texto(alergia)
+                for alergia in cls.SEPARADORES.split(texto_alergias)
+            ))))
+
+        return list(cls._cache.obtener((texto_alergias, reglas.version), calcular))
+
+    @classmethod
+    def estadisticas_cache(cls) -> Dict[str, float]:
+        return cls._cache.estadisticas()
+
+    @classmethod
+    def alergenos_de_alimento(cls, alimento: 'Alimento', reglas: Optional[ConjuntoReglas] = None) -> set:
+        """
+        Alérgenos estandarizados declarados en el campo JSON de un alimento.
+
+        Cada entrada se compara por palabras completas (ConjuntoReglas.alergenos_en_texto):
+        'Leche entera' cuenta como 'leche', y una alergia 'le' no excluye la leche.
+        """
+        reglas = reglas or ReglasRecomendador.obtener()
+        valor = alimento.alergenos
+        if isinstance(valor, str):
+            terminos = cls.SEPARADORES.split(valor)
+        elif isinstance(valor, dict):
+            terminos = [clave for clave, presente in valor.items() if presente]
+        elif isinstance(valor, (list, tuple)):
+            terminos = [str(termino) for termino in valor]
+        else:
+            terminos = []
+
+        return set().union(*(reglas.alergenos_en_texto(termino) for termino in terminos))
+
+def rasgos_de_alimento(alimento: 'Alimento', reglas: Optional[ConjuntoReglas] = None) -> Dict:
+    """
+    Rasgos de palatabilidad precalculados al guardar el alimento.
+
+    Si se calcularon con otras reglas (o el alimento nunca pasó por save, p. ej.
+    bulk_create), se recalculan en memoria.
+    """
+    reglas = reglas or ReglasRecomendador.obtener()
+    rasgos = alimento.rasgos or {}
+    if rasgos.get('version') == reglas.version:
+        return rasgos
+    return reglas.rasgos_alimento(alimento.nombre, alimento.grupo_alimenticio)
 
 class OptimizadorAlimentos:
-    """Optimiza la selección de alimentos usando algoritmos avanzados"""
+    """
+    Optimiza la selección de alimentos usando algoritmos avanzados.
+
+    Los grupos importantes, los alimentos aceptados por niños y las texturas
+    suaves vienen de las reglas del recomendador (reglas_recomendador.json).
+    """
+
+    # Candidatos que se ordenan completos antes de la selección greedy
+    TOP_K_CANDIDATOS = 64
     
-    @staticmethod
-    def calcular_puntuacion_nutricional(alimento: 'Alimento', objetivo_calorias: float, objetivo_proteinas: float) -> float:
+    @classmethod
+    def calcular_puntuacion_nutricional(cls, alimento: 'Alimento', objetivo_calorias: float, objetivo_proteinas: float) -> float:
         """Calcula puntuación nutricional del alimento"""
         
         # Densidad nutricional (nutrientes por caloría)
@@ -192,8 +525,7 @@ class OptimizadorAlimentos:
         puntuacion = densidad_proteina * 100
         
         # Bonus por grupos alimenticios importantes
-        grupos_importantes = ['vegetales', 'frutas', 'proteinas', 'lacteos', 'cereales_integrales']
-        if alimento.grupo_alimenticio.lower() in grupos_importantes:
+        if rasgos_de_alimento(alimento)['grupo_importante']:
             puntuacion += 20
             
         # Penalización por exceso de grasas saturadas o azúcares
@@ -202,34 +534,83 @@ class OptimizadorAlimentos:
             
         return max(0, puntuacion)
     
-    @staticmethod
-    def calcular_puntuacion_palatabilidad(alimento: 'Alimento', edad: int) -> float:
+    @classmethod
+    def calcular_puntuacion_palatabilidad(cls, alimento: 'Alimento', edad: int) -> float:
         """Calcula puntuación de palatabilidad según edad"""
         
-        # Alimentos generalmente aceptados por niños
-        alimentos_infantiles = [
-            'pollo', 'pasta', 'arroz', 'platano', 'manzana', 
-            'yogur', 'queso', 'pan', 'leche'
-        ]
-        
         puntuacion = 50  # Base
         
-        nombre_lower = alimento.nombre.lower()
-        for alimento_popular in alimentos_infantiles:
-            if alimento_popular in nombre_lower:
-                puntuacion += 25
-                break
+        rasgos = rasgos_de_alimento(alimento)
+        if rasgos['infantil']:
+            puntuacion += 25
                 
         # Ajustar por edad
         if edad < 5:
             # Preferencia por texturas suaves
-            if any(word in nombre_lower for word in ['pure', 'suave', 'cremoso']):
+            if rasgos['textura_suave']:
                 puntuacion += 15
         elif edad > 10:
             # Mayor variedad aceptada
             puntuacion += 10
             
         return puntuacion
+
+    @staticmethod
+    def puntuar_matriz(
+        matriz: 'MatrizNutricional',
+        objetivo_calorias: float,
+        edad: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Versión vectorizada de las puntuaciones y la porción sugerida.
+
+        Reproduce operación por operación los cálculos por alimento, por lo que
+        los resultados coinciden exactamente. Devuelve (nutricional,
+        palatabilidad, total, porción).
+        """
+        calorias = matriz.calorias
+        con_calorias = calorias != 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            densidad_proteina = np.where(con_calorias, matriz.proteinas / calorias, 0.0)
+            porcion = np.where(calorias > 0, objetivo_calorias / calorias, 1.0)
+
+        nutricional = densidad_proteina * 100
+        nutricional = nutricional + np.where(matriz.grupo_importante, 20.0, 0.0)
+        nutricional = nutricional - np.where(matriz.grasas > calorias * 0.4 / 9, 15.0, 0.0)
+        nutricional = np.where(con_calorias, np.maximum(nutricional, 0.0), 0.0)
+
+        palatabilidad = np.where(matriz.nombre_infantil, 75.0, 50.0)
+        if edad < 5:
+            palatabilidad = palatabilidad + np.where(matriz.textura_suave, 15.0, 0.0)
+        elif edad > 10:
+            palatabilidad = palatabilidad + 10.0
+
+        total = nutricional * 0.7 + palatabilidad * 0.3
+        porcion = np.minimum(porcion, 2.0)
+
+        return nutricional, palatabilidad, total, porcion
+
+    @staticmethod
+    def _orden_descendente(puntuaciones: np.ndarray, k: int):
+        """
+        Recorre las posiciones de mayor a menor puntuación (empates por posición).
+
+        Solo ordena por completo los k mejores; el resto se ordena si la
+        selección llega a necesitarlo.
+        """
+        n = len(puntuaciones)
+        posiciones = np.arange(n)
+        if n > k:
+            umbral = np.partition(puntuaciones, n - k)[n - k]
+            cabeza = puntuaciones >= umbral
+        else:
+            cabeza = np.ones(n, dtype=bool)
+
+        for mascara in (cabeza, ~cabeza):
+            bloque = posiciones[mascara]
+            if bloque.size:
+                yield from bloque[np.lexsort((bloque, -puntuaciones[bloque]))].tolist()
     
     @classmethod
     def seleccionar_alimentos_optimizados(
@@ -239,56 +620,65 @@ class OptimizadorAlimentos:
         objetivo_calorias: float,
         objetivo_proteinas: float,
         edad: int,
-        max_alimentos: int = 5
+        max_alimentos: int = 5,
+        matriz: Optional['MatrizNutricional'] = None
     ) -> List[AlimentoConPuntuacion]:
         """Selecciona óptimamente alimentos para una categoría"""
+
+        if matriz is None:
+            matriz = MatrizNutricional.desde_alimentos(alimentos_disponibles)
         
         # Calcular puntuaciones para todos los alimentos
-        alimentos_puntuados = []
-        
-        for alimento in alimentos_disponibles:
-            punt_nutricional = cls.calcular_puntuacion_nutricional(alimento, objetivo_calorias, objetivo_proteinas)
-            punt_palatabilidad = cls.calcular_puntuacion_palatabilidad(alimento, edad)
-            punt_total = punt_nutricional * 0.7 + punt_palatabilidad * 0.3
-            
-            # Calcular porción sugerida
-            porcion = min(objetivo_calorias / alimento.calorias if alimento.calorias > 0 else 1, 2.0)
-            
-            alimentos_puntuados.append(AlimentoConPuntuacion(
-                alimento=alimento,
-                puntuacion_nutricional=punt_nutricional,
-                puntuacion_palatabilidad=punt_palatabilidad,
-                puntuacion_total=punt_total,
-                porcion_sugerida=porcion
-            ))
-        
-        # Ordenar por puntuación total
-        alimentos_puntuados.sort(key=lambda x: x.puntuacion_total, reverse=True)
+        puntuaciones = cls.puntuar_matriz(matriz, objetivo_calorias, edad)
         
-        # Selección con algoritmo greedy mejorado
+        posiciones = cls._seleccion_greedy(
+            matriz, puntuaciones[2], puntuaciones[3], objetivo_calorias, objetivo_proteinas, max_alimentos
+        )
+        return cls._construir_seleccion(matriz, puntuaciones, posiciones)
+
+    @classmethod
+    def _seleccion_greedy(
+        cls,
+        matriz: 'MatrizNutricional',
+        orden: np.ndarray,
+        porciones: np.ndarray,
+        objetivo_calorias: float,
+        objetivo_proteinas: float,
+        max_alimentos: int,
+        bloqueados: Optional[np.ndarray] = None
+    ) -> List[int]:
+        """
+        Greedy con diversidad de grupos y topes; recorre los alimentos de mayor a menor `orden`.
+
+        Las posiciones marcadas en `bloqueados` no se eligen.
+        """
         seleccionados = []
         calorias_acum = 0
         proteinas_acum = 0
         grupos_usados = set()
         
-        for alimento_puntuado in alimentos_puntuados:
+        for posicion in cls._orden_descendente(orden, max(cls.TOP_K_CANDIDATOS, max_alimentos)):
             if len(seleccionados) >= max_alimentos:
                 break
+
+            if bloqueados is not None and bloqueados[posicion]:
+                continue
                 
-            alimento = alimento_puntuado.alimento
+            alimento = matriz.alimentos[posicion]
             
             # Evitar repetir grupos alimenticios (diversidad)
             if alimento.grupo_alimenticio in grupos_usados and len(seleccionados) > 0:
                 continue
                 
             # Verificar si ayuda a alcanzar objetivos
-            calorias_aporte = alimento.calorias * alimento_puntuado.porcion_sugerida
-            proteinas_aporte = alimento.proteinas * alimento_puntuado.porcion_sugerida
+            porcion = porciones[posicion].item()
+            calorias_aporte = alimento.calorias * porcion
+            proteinas_aporte = alimento.proteinas * porcion
             
             if (calorias_acum + calorias_aporte <= objetivo_calorias * 1.2 and 
                 proteinas_acum + proteinas_aporte <= objetivo_proteinas * 1.3):
                 
-                seleccionados.append(alimento_puntuado)
+                seleccionados.append(posicion)
                 calorias_acum += calorias_aporte
                 proteinas_acum += proteinas_aporte
                 grupos_usados.add(alimento.grupo_alimenticio)
@@ -299,6 +689,433 @@ class OptimizadorAlimentos:
         
         return seleccionados
 
+    @staticmethod
+    def _construir_seleccion(matriz: 'MatrizNutricional', puntuaciones, posiciones: List[int]) -> List[AlimentoConPuntuacion]:
+        nutricional, palatabilidad, total, porciones = puntuaciones
+        return [
+            AlimentoConPuntuacion(
+                alimento=matriz.alimentos[posicion],
+                puntuacion_nutricional=nutricional[posicion].item(),
+                puntuacion_palatabilidad=palatabilidad[posicion].item(),
+                puntuacion_total=total[posicion].item(),
+                porcion_sugerida=porciones[posicion].item()
+            )
+            for posicion in posiciones
+        ]
+
+    @classmethod
+    def seleccionar_k_mejores(
+        cls,
+        matriz: 'MatrizNutricional',
+        objetivo_calorias: float,
+        objetivo_proteinas: float,
+        edad: int,
+        k: int,
+        max_alimentos: int = 5
+    ) -> List[List[AlimentoConPuntuacion]]:
+        """
+        Hasta k selecciones distintas para una comida a partir de una sola puntuación.
+
+        Cada selección relega al final del orden los alimentos ya usados por las
+        anteriores (más cuanto más se hayan usado), así que solo se repiten cuando
+        no quedan alternativas que cumplan los topes.
+        """
+        puntuaciones = cls.puntuar_matriz(matriz, objetivo_calorias, edad)
+        total = puntuaciones[2]
+        if not len(total):
+            return [[] for _ in range(k)]
+
+        escalon = float(total.max() - total.min()) + 1.0
+        usos = np.zeros(len(total))
+        selecciones = []
+        for _ in range(k):
+            posiciones = cls._seleccion_greedy(
+                matriz, total - usos * escalon, puntuaciones[3],
+                objetivo_calorias, objetivo_proteinas, max_alimentos
+            )
+            usos[posiciones] += 1
+            selecciones.append(cls._construir_seleccion(matriz, puntuaciones, posiciones))
+        return selecciones
+
+    @classmethod
+    def seleccionar_semana(
+        cls,
+        matriz: 'MatrizNutricional',
+        objetivo_calorias: float,
+        objetivo_proteinas: float,
+        edad: int,
+        dias: int,
+        max_repeticiones: int,
+        max_alimentos: int = 5
+    ) -> Tuple[List[List[AlimentoConPuntuacion]], List[int]]:
+        """
+        Selecciones de una comida para varios días, con variedad entre días.
+
+        Se puntúa una sola vez para todo el periodo. Cada día relega los
+        alimentos según cuántas veces se usaron (como seleccionar_k_mejores) y
+        no elige los que ya llegaron a max_repeticiones. Si el tope deja un día
+        sin alimentos, ese día se resuelve sin tope. Devuelve las selecciones y
+        los índices de los días en que hubo que relajarlo.
+        """
+        puntuaciones = cls.puntuar_matriz(matriz, objetivo_calorias, edad)
+        total, porciones = puntuaciones[2], puntuaciones[3]
+        if not len(total):
+            return [[] for _ in range(dias)], []
+
+        escalon = float(total.max() - total.min()) + 1.0
+        usos = np.zeros(len(total), dtype=np.int64)
+        selecciones, relajados = [], []
+        for dia in range(dias):
+            orden = total - usos * escalon
+            posiciones = cls._seleccion_greedy(
+                matriz, orden, porciones, objetivo_calorias, objetivo_proteinas, max_alimentos,
+                bloqueados=usos >= max_repeticiones
+            )
+            if not posiciones:
+                posiciones = cls._seleccion_greedy(
+                    matriz, orden, porciones, objetivo_calorias, objetivo_proteinas, max_alimentos
+                )
+                relajados.append(dia)
+            usos[posiciones] += 1
+            selecciones.append(cls._construir_seleccion(matriz, puntuaciones, posiciones))
+        return selecciones, relajados
+
+    @classmethod
+    def resolver_comida(
+        cls,
+        categoria: str,
+        matriz: 'MatrizNutricional',
+        objetivo_calorias: float,
+        objetivo_proteinas: float,
+        edad: int,
+        max_alimentos: int = 5,
+        modo: Optional[str] = None,
+        presupuesto_ms: Optional[float] = None
+    ) -> Tuple[List[AlimentoConPuntuacion], Dict]:
+        """
+        Selecciona los alimentos de una comida con el solver configurado.
+
+        'greedy' es la selección clásica; 'exacto' usa SolverComidaExacto con
+        un presupuesto de tiempo. Devuelve la selección y sus estadísticas.
+        """
+        configuracion = getattr(settings, 'RECOMENDADOR', {})
+        modo = modo or configuracion.get('SOLVER', 'greedy')
+        if modo not in ('greedy', 'exacto'):
+            raise ValueError(f"Solver desconocido: {modo}")
+
+        inicio = time.perf_counter()
+        seleccionados = cls.seleccionar_alimentos_optimizados(
+            categoria, matriz.alimentos, objetivo_calorias, objetivo_proteinas, edad,
+            max_alimentos, matriz=matriz
+        )
+        if modo == 'greedy':
+            return seleccionados, {
+                "modo": "greedy",
+                "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 3),
+            }
+
+        solver = SolverComidaExacto(
+            matriz, objetivo_calorias, objetivo_proteinas, edad, max_alimentos, presupuesto_ms
+        )
+        return solver.resolver(seleccionados)
+
+@dataclass(frozen=True)
+class MatrizNutricional:
+    """Columnas nutricionales de un conjunto de alimentos para puntuación vectorizada"""
+    alimentos: Tuple['Alimento', ...]
+    ids: np.ndarray
+    calorias: np.ndarray
+    proteinas: np.ndarray
+    grasas: np.ndarray
+    carbohidratos: np.ndarray
+    grupos: np.ndarray  # código entero de grupo_alimenticio
+    grupo_importante: np.ndarray
+    nombre_infantil: np.ndarray
+    textura_suave: np.ndarray
+
+    @classmethod
+    def desde_alimentos(cls, alimentos, reglas: Optional[ConjuntoReglas] = None) -> 'MatrizNutricional':
+        alimentos = tuple(alimentos)
+        reglas = reglas or ReglasRecomendador.obtener()
+        codigos_grupo = {}
+        grupos, importantes, infantiles, suaves = [], [], [], []
+
+        for alimento in alimentos:
+            grupos.append(codigos_grupo.setdefault(alimento.grupo_alimenticio, len(codigos_grupo)))
+            rasgos = rasgos_de_alimento(alimento, reglas)
+            importantes.append(rasgos['grupo_importante'])
+            infantiles.append(rasgos['infantil'])
+            suaves.append(rasgos['textura_suave'])
+
+        def columna(campo):
+            return np.fromiter((getattr(a, campo) for a in alimentos), dtype=np.float64, count=len(alimentos))
+
+        return cls(
+            alimentos=alimentos,
+            ids=np.fromiter((a.id for a in alimentos), dtype=np.int64, count=len(alimentos)),
+            calorias=columna('calorias'),
+            proteinas=columna('proteinas'),
+            grasas=columna('grasas'),
+            carbohidratos=columna('carbohidratos'),
+            grupos=np.array(grupos, dtype=np.int32),
+            grupo_importante=np.array(importantes, dtype=bool),
+            nombre_infantil=np.array(infantiles, dtype=bool),
+            textura_suave=np.array(suaves, dtype=bool),
+        )
+
+    def subconjunto(self, mascara: np.ndarray) -> 'MatrizNutricional':
+        """Matriz restringida a las filas marcadas en la máscara booleana"""
+        return MatrizNutricional(
+            alimentos=tuple(a for a, incluido in zip(self.alimentos, mascara.tolist()) if incluido),
+            ids=self.ids[mascara],
+            calorias=self.calorias[mascara],
+            proteinas=self.proteinas[mascara],
+            grasas=self.grasas[mascara],
+            carbohidratos=self.carbohidratos[mascara],
+            grupos=self.grupos[mascara],
+            grupo_importante=self.grupo_importante[mascara],
+            nombre_infantil=self.nombre_infantil[mascara],
+            textura_suave=self.textura_suave[mascara],
+        )
+
+class SolverComidaExacto:
+    """
+    Ramificación y acotamiento para componer una comida.
+
+    Optimiza en conjunto el ajuste de calorías y proteínas, la diversidad de
+    grupos y la puntuación media, con las mismas restricciones que el greedy
+    (un alimento por grupo, como máximo 1.2x calorías y 1.3x proteínas).
+    Busca sobre candidatos prepodados (los mejores de cada grupo) y una rejilla
+    de porciones; el óptimo y el gap reportados se refieren a ese espacio.
+    Arranca desde la solución greedy y la conserva si el presupuesto de tiempo
+    se agota sin mejorarla.
+    """
+
+    PESO_CALORIAS = 0.45
+    PESO_PROTEINAS = 0.30
+    PESO_DIVERSIDAD = 0.10
+    PESO_PUNTUACION = 0.15
+
+    PORCIONES = (0.5, 1.0, 1.5, 2.0)
+    CANDIDATOS_POR_GRUPO = 3
+    MAX_CANDIDATOS = 24
+    NODOS_ENTRE_CONTROLES = 256
+
+    def __init__(
+        self,
+        matriz: 'MatrizNutricional',
+        objetivo_calorias: float,
+        objetivo_proteinas: float,
+        edad: int,
+        max_alimentos: int = 5,
+        presupuesto_ms: Optional[float] = None
+    ):
+        self.matriz = matriz
+        self.objetivo_calorias = objetivo_calorias
+        self.objetivo_proteinas = objetivo_proteinas
+        self.max_alimentos = max_alimentos
+        self.presupuesto_ms = self.presupuesto_efectivo(presupuesto_ms)
+        self.tope_calorias = objetivo_calorias * 1.2
+        self.tope_proteinas = objetivo_proteinas * 1.3
+
+        (self.nutricional, self.palatabilidad,
+         self.total, self.porciones) = OptimizadorAlimentos.puntuar_matriz(matriz, objetivo_calorias, edad)
+        self.puntuacion_maxima = float(self.total.max()) if len(self.total) else 1.0
+
+    @staticmethod
+    def presupuesto_efectivo(presupuesto_ms: Optional[float] = None) -> float:
+        """
+        Presupuesto pedido (o RECOMENDADOR['PRESUPUESTO_SOLVER_MS'] si no se pide)
+        acotado a [0, RECOMENDADOR['PRESUPUESTO_SOLVER_MAX_MS']]
+        """
+        configuracion = getattr(settings, 'RECOMENDADOR', {})
+        if presupuesto_ms is None:
+            presupuesto_ms = configuracion.get('PRESUPUESTO_SOLVER_MS', 50)
+        presupuesto_ms = float(presupuesto_ms)
+        if math.isnan(presupuesto_ms):
+            raise ValueError("presupuesto_ms debe ser un número")
+        return min(max(presupuesto_ms, 0.0), float(configuracion.get('PRESUPUESTO_SOLVER_MAX_MS', 500)))
+
+    @staticmethod
+    def _ajuste(valor: float, objetivo: float) -> float:
+        if objetivo <= 0:
+            return 1.0
+        return max(0.0, 1 - abs(valor - objetivo) / objetivo)
+
+    def _objetivo(self, calorias: float, proteinas: float, cantidad: int, suma_puntuacion: float) -> float:
+        if cantidad == 0:
+            return float('-inf')
+        return (
+            self.PESO_CALORIAS * self._ajuste(calorias, self.objetivo_calorias)
+            + self.PESO_PROTEINAS * self._ajuste(proteinas, self.objetivo_proteinas)
+            + self.PESO_DIVERSIDAD * cantidad / self.max_alimentos
+            + self.PESO_PUNTUACION * (suma_puntuacion / cantidad) / self.puntuacion_maxima
+        )
+
+    def _ajuste_maximo(self, valor: float, aporte_maximo: float, objetivo: float) -> float:
+        # Los aportes son positivos: pasado el objetivo el ajuste solo puede empeorar
+        if valor >= objetivo:
+            return self._ajuste(valor, objetivo)
+        if valor + aporte_maximo >= objetivo:
+            return 1.0
+        return self._ajuste(valor + aporte_maximo, objetivo)
+
+    def _cota(self, grupo: int, calorias: float, proteinas: float, cantidad: int, suma_puntuacion: float) -> float:
+        """Cota superior del objetivo alcanzable desde un nodo"""
+        restantes = min(self.max_alimentos - cantidad, len(self.opciones) - grupo)
+        if restantes <= 0:
+            return self._objetivo(calorias, proteinas, cantidad, suma_puntuacion)
+
+        aporte_calorias = min(restantes * self.calorias_sufijo[grupo], self.tope_calorias - calorias)
+        aporte_proteinas = min(restantes * self.proteinas_sufijo[grupo], self.tope_proteinas - proteinas)
+        media_actual = suma_puntuacion / cantidad if cantidad else 0.0
+
+        return (
+            self.PESO_CALORIAS * self._ajuste_maximo(calorias, aporte_calorias, self.objetivo_calorias)
+            + self.PESO_PROTEINAS * self._ajuste_maximo(proteinas, aporte_proteinas, self.objetivo_proteinas)
+            + self.PESO_DIVERSIDAD * (cantidad + restantes) / self.max_alimentos
+            + self.PESO_PUNTUACION * max(media_actual, self.puntuacion_sufijo[grupo]) / self.puntuacion_maxima
+        )
+
+    def _mejores_por_grupo(self, clave: np.ndarray) -> List[int]:
+        """Posiciones de los CANDIDATOS_POR_GRUPO mejores de cada grupo según la clave, de mayor a menor"""
+        matriz = self.matriz
+        n = len(matriz.alimentos)
+        if n == 0:
+            return []
+        posiciones = np.arange(n)
+        orden = np.lexsort((posiciones, -clave, matriz.grupos))
+        grupos_ordenados = matriz.grupos[orden]
+        inicio_grupo = np.r_[True, grupos_ordenados[1:] != grupos_ordenados[:-1]]
+        rango = posiciones - np.maximum.accumulate(np.where(inicio_grupo, posiciones, 0))
+        elegidos = orden[(rango < self.CANDIDATOS_POR_GRUPO) & (matriz.calorias[orden] > 0)]
+        return elegidos[np.lexsort((elegidos, -clave[elegidos]))].tolist()
+
+    def _preparar_opciones(self) -> None:
+        """Agrupa los candidatos prepodados en opciones (alimento, porción) por grupo"""
+        matriz = self.matriz
+
+        # Se alternan los mejores por puntuación y los más energéticos, para que
+        # la poda no deje fuera los alimentos que permiten cubrir las calorías
+        candidatos = []
+        vistos = set()
+        for par in itertools.zip_longest(self._mejores_por_grupo(self.total), self._mejores_por_grupo(matriz.calorias)):
+            for posicion in par:
+                if posicion is not None and posicion not in vistos and len(candidatos) < self.MAX_CANDIDATOS:
+                    vistos.add(posicion)
+                    candidatos.append(posicion)
+
+        por_grupo = defaultdict(list)
+        for posicion in candidatos:
+            alimento = matriz.alimentos[posicion]
+            puntuacion = self.total[posicion].item()
+            for porcion in sorted(set(self.PORCIONES) | {self.porciones[posicion].item()}):
+                calorias = alimento.calorias * porcion
+                proteinas = alimento.proteinas * porcion
+                if calorias <= self.tope_calorias and proteinas <= self.tope_proteinas:
+                    por_grupo[matriz.grupos[posicion].item()].append(
+                        (posicion, porcion, calorias, proteinas, puntuacion)
+                    )
+
+        # Grupos con mejores opciones primero, para encontrar pronto buenas soluciones
+        self.opciones = sorted(por_grupo.values(), key=lambda opciones: -opciones[0][4])
+
+        cantidad = len(self.opciones)
+        self.calorias_sufijo = [0.0] * (cantidad + 1)
+        self.proteinas_sufijo = [0.0] * (cantidad + 1)
+        self.puntuacion_sufijo = [0.0] * (cantidad + 1)
+        for grupo in range(cantidad - 1, -1, -1):
+            opciones = self.opciones[grupo]
+            self.calorias_sufijo[grupo] = max(self.calorias_sufijo[grupo + 1], max(o[2] for o in opciones))
+            self.proteinas_sufijo[grupo] = max(self.proteinas_sufijo[grupo + 1], max(o[3] for o in opciones))
+            self.puntuacion_sufijo[grupo] = max(self.puntuacion_sufijo[grupo + 1], max(o[4] for o in opciones))
+
+    def resolver(self, solucion_greedy: List[AlimentoConPuntuacion]) -> Tuple[List[AlimentoConPuntuacion], Dict]:
+        """Devuelve la mejor selección encontrada y estadísticas de la búsqueda"""
+        inicio = time.perf_counter()
+        limite = inicio + self.presupuesto_ms / 1000
+
+        objetivo_greedy = self._objetivo(
+            sum(a.alimento.calorias * a.porcion_sugerida for a in solucion_greedy),
+            sum(a.alimento.proteinas * a.porcion_sugerida for a in solucion_greedy),
+            len(solucion_greedy),
+            sum(a.puntuacion_total for a in solucion_greedy),
+        )
+        mejor_valor = objetivo_greedy
+        mejor_eleccion = None
+
+        self._preparar_opciones()
+        pila = [(self._cota(0, 0.0, 0.0, 0, 0.0), 0, 0.0, 0.0, 0, 0.0, ())]
+        nodos = 0
+        agotado = False
+
+        while pila:
+            if nodos % self.NODOS_ENTRE_CONTROLES == 0 and time.perf_counter() > limite:
+                agotado = True
+                break
+
+            cota, grupo, calorias, proteinas, cantidad, suma, eleccion = pila.pop()
+            nodos += 1
+            if cota <= mejor_valor:
+                continue
+
+            valor = self._objetivo(calorias, proteinas, cantidad, suma)
+            if valor > mejor_valor:
+                mejor_valor = valor
+                mejor_eleccion = eleccion
+
+            if grupo >= len(self.opciones) or cantidad >= self.max_alimentos:
+                continue
+
+            # Saltar el grupo se explora al final; las mejores opciones primero
+            hijos = [(grupo + 1, calorias, proteinas, cantidad, suma, eleccion)]
+            for opcion in self.opciones[grupo]:
+                _, _, calorias_op, proteinas_op, puntuacion_op = opcion
+                if (calorias + calorias_op <= self.tope_calorias and
+                        proteinas + proteinas_op <= self.tope_proteinas):
+                    hijos.append((grupo + 1, calorias + calorias_op, proteinas + proteinas_op,
+                                  cantidad + 1, suma + puntuacion_op, eleccion + (opcion,)))
+
+            for hijo in [hijos[0]] + hijos[:0:-1]:
+                cota_hijo = self._cota(*hijo[:5])
+                if cota_hijo > mejor_valor:
+                    pila.append((cota_hijo,) + hijo)
+
+        if not agotado:
+            gap = 0.0
+        elif mejor_valor == float('-inf'):
+            gap = None
+        else:
+            cota_global = max([mejor_valor] + [nodo[0] for nodo in pila])
+            gap = round((cota_global - mejor_valor) / cota_global, 6) if cota_global > 0 else 0.0
+
+        if mejor_eleccion is None:
+            seleccion = solucion_greedy
+        else:
+            seleccion = [
+                AlimentoConPuntuacion(
+                    alimento=self.matriz.alimentos[posicion],
+                    puntuacion_nutricional=self.nutricional[posicion].item(),
+                    puntuacion_palatabilidad=self.palatabilidad[posicion].item(),
+                    puntuacion_total=puntuacion,
+                    porcion_sugerida=porcion
+                )
+                for posicion, porcion, _, _, puntuacion in sorted(mejor_eleccion, key=lambda o: -o[4])
+            ]
+
+        estadisticas = {
+            "modo": "exacto",
+            "metodo": "greedy" if mejor_eleccion is None else "exacto",
+            "estado": "limite_tiempo" if agotado else "optimo",
+            "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 3),
+            "presupuesto_ms": self.presupuesto_ms,
+            "gap": gap,
+            "nodos": nodos,
+            "objetivo": round(mejor_valor, 6) if seleccion else None,
+            "objetivo_greedy": round(objetivo_greedy, 6) if solucion_greedy else None,
+        }
+        return seleccion, estadisticas
+
 class ValidadorRecomendaciones:
     """Valida que las recomendaciones cumplan criterios mínimos"""
     
@@ -342,172 +1159,545 @@ class ValidadorRecomendaciones:
             
         return len(errores) == 0, errores
 
-def generar_recomendacion_automatica_mejorada(
-    nino_id: int, 
-    motivo: str = "Recomendación automática generada",
-    preferencias_usuario: Optional[Dict] = None
-) -> 'Recomendacion':
+@dataclass
+class PlanRecomendacion:
+    """Recomendación calculada en memoria, antes de guardarse en la base de datos"""
+    nino: 'Nino'
+    edad: int
+    historial: 'HistorialClinico'
+    parametro: 'ParametroReferencia'
+    requisitos: RequisitoNutricional
+    alergias: List[str]
+    desayuno: List[AlimentoConPuntuacion]
+    almuerzo: List[AlimentoConPuntuacion]
+    cena: List[AlimentoConPuntuacion]
+    solver: Dict[str, Dict]
+    es_valida: bool
+    errores: List[str]
+
+    @property
+    def comidas(self) -> Dict[str, List[AlimentoConPuntuacion]]:
+        return {'desayuno': self.desayuno, 'almuerzo': self.almuerzo, 'cena': self.cena}
+
+    @property
+    def calorias_totales(self) -> float:
+        return sum([
+            sum(a.alimento.calorias * a.porcion_sugerida for a in categoria)
+            for categoria in [self.desayuno, self.almuerzo, self.cena]
+        ])
+
+    @property
+    def proteinas_totales(self) -> float:
+        return sum([
+            sum(a.alimento.proteinas * a.porcion_sugerida for a in categoria)
+            for categoria in [self.desayuno, self.almuerzo, self.cena]
+        ])
+
+    @property
+    def puntuacion_media(self) -> float:
+        """Puntuación total media de los alimentos del plan, para ordenar opciones"""
+        puntuaciones = [a.puntuacion_total for categoria in (self.desayuno, self.almuerzo, self.cena) for a in categoria]
+        return sum(puntuaciones) / len(puntuaciones) if puntuaciones else 0.0
+
+    def fuente(self) -> Dict:
+        historial = self.historial
+        parametro = self.parametro
+        return {
+            "version": "2.0_mejorada",
+            "edad": self.edad,
+            "datos_fisicos": {
+                "peso": historial.peso,
+                "talla": historial.talla,
+                "actividad_fisica": historial.actividad_fisica,
+            },
+            "condiciones_medicas": {
+                "enfermedades": historial.enfermedades,
+                "alergias": self.alergias,
+            },
+            "parametros_referencia": {
+                "calorias_objetivo": parametro.calorias,
+                "proteinas_objetivo": parametro.proteinas,
+                "hierro_objetivo": parametro.hierro,
+            },
+            "calculos_personalizados": {
+                "tmb_calculada": self.requisitos.tmb,
+                "factor_actividad": self.requisitos.factor_actividad,
+                "calorias_personalizadas": self.requisitos.calorias_totales,
+                "proteinas_personalizadas": self.requisitos.proteinas_totales,
+            },
+            "validacion": {
+                "es_valida": self.es_valida,
+                "errores": self.errores if self.errores else None,
+            },
+            "solver": self.solver,
+        }
+
+    def notas(self) -> str:
+        return f"Generado automáticamente por sistema mejorado v2.0. " + (
+            f"Advertencias: {'; '.join(self.errores)}" if self.errores else "Recomendación validada correctamente."
+        )
+
+    def resumen(self) -> Dict:
+        """Plan serializable a JSON: alimentos y porciones por comida, totales y validación"""
+        return {
+            "nino_id": self.nino.id,
+            "edad": self.edad,
+            "alergias": self.alergias,
+            "requisitos": asdict(self.requisitos),
+            "comidas": {
+                categoria: [
+                    {
+                        "alimento_id": a.alimento.id,
+                        "nombre": a.alimento.nombre,
+                        "grupo_alimenticio": a.alimento.grupo_alimenticio,
+                        "porcion_sugerida": a.porcion_sugerida,
+                        "calorias": a.alimento.calorias * a.porcion_sugerida,
+                        "proteinas": a.alimento.proteinas * a.porcion_sugerida,
+                        "puntuacion_total": a.puntuacion_total,
+                    }
+                    for a in alimentos
+                ]
+                for categoria, alimentos in self.comidas.items()
+            },
+            "calorias_totales": self.calorias_totales,
+            "proteinas_totales": self.proteinas_totales,
+            "es_valida": self.es_valida,
+            "errores": self.errores,
+            "solver": self.solver,
+        }
+
+def calcular_edad(fecha_nacimiento: date, hoy: Optional[date] = None) -> int:
+    """Edad en años cumplidos a la fecha indicada (hoy por defecto)"""
+    hoy = hoy or date.today()
+    return hoy.year - fecha_nacimiento.year - (
+        (hoy.month, hoy.day) < (fecha_nacimiento.month, fecha_nacimiento.day)
+    )
+
+COMIDAS = ('desayuno', 'almuerzo', 'cena')
+
+def _preparar_planificacion(
+    nino: 'Nino',
+    historial: 'HistorialClinico',
+    parametro: 'ParametroReferencia',
+    catalogo: Optional[InstantaneaCatalogo],
+    medicion=SIN_MEDICION
+) -> Tuple[int, RequisitoNutricional, List[str], Dict[str, 'MatrizNutricional']]:
+    """Edad, requerimientos, alergias normalizadas y alimentos seguros por comida"""
+    edad = calcular_edad(nino.fecha_nacimiento)
+
+    # Calcular requerimientos nutricionales personalizados
+    with medicion.etapa('requerimientos'):
+        requisitos = CalculadoraNutricional.requerimientos(nino, historial, parametro)
+    
+    with medicion.etapa('catalogo'):
+        catalogo = catalogo or CatalogoAlimentos.obtener()
+
+    # Procesar alergias y filtrar alimentos seguros por categoría
+    with medicion.etapa('alergias'):
+        alergias_normalizadas = ProcesadorAlergias.procesar_alergias(historial.alergias)
+        matrices = {
+            categoria: catalogo.matriz_segura(categoria, alergias_normalizadas)
+            for categoria in COMIDAS
+        }
+    
+    # Verificar disponibilidad mínima
+    for categoria in COMIDAS:
+        if not matrices[categoria].alimentos:
+            raise ValueError(f"No hay alimentos de {categoria} disponibles con las restricciones actuales")
+
+    return edad, requisitos, alergias_normalizadas, matrices
+
+def _ensamblar_plan(
+    nino: 'Nino',
+    historial: 'HistorialClinico',
+    parametro: 'ParametroReferencia',
+    edad: int,
+    requisitos: RequisitoNutricional,
+    alergias: List[str],
+    comidas: Dict[str, List[AlimentoConPuntuacion]],
+    solver: Dict[str, Dict]
+) -> PlanRecomendacion:
+    """Valida la selección de alimentos y arma el plan"""
+    validador = ValidadorRecomendaciones()
+    es_valida, errores = validador.validar_recomendacion(
+        comidas['desayuno'], comidas['almuerzo'], comidas['cena'], requisitos
+    )
+    
+    if not es_valida:
+        logger.warning(f"Recomendación para niño {nino.id} tiene advertencias: {errores}")
+
+    return PlanRecomendacion(
+        nino=nino,
+        edad=edad,
+        historial=historial,
+        parametro=parametro,
+        requisitos=requisitos,
+        alergias=alergias,
+        desayuno=comidas['desayuno'],
+        almuerzo=comidas['almuerzo'],
+        cena=comidas['cena'],
+        solver=solver,
+        es_valida=es_valida,
+        errores=errores,
+    )
+
+def planificar_recomendacion(
+    nino: 'Nino',
+    historial: 'HistorialClinico',
+    parametro: 'ParametroReferencia',
+    catalogo: Optional[InstantaneaCatalogo] = None,
+    preferencias_usuario: Optional[Dict] = None,
+    medicion=SIN_MEDICION
+) -> PlanRecomendacion:
     """
-    Genera recomendación nutricional automatizada con algoritmos mejorados
+    Calcula una recomendación completa sin tocar la base de datos.
+
+    Recibe los datos ya cargados, por lo que puede ejecutarse en otro proceso
+    a partir de una instantánea del catálogo. `medicion` (ver medicion.py)
+    registra la duración de cada etapa.
     """
+    edad, requisitos, alergias, matrices = _preparar_planificacion(
+        nino, historial, parametro, catalogo, medicion
+    )
     
-    try:
-        # Obtener datos base
-        nino = Nino.objects.get(id=nino_id)
-        
-        # Calcular edad
-        hoy = date.today()
-        edad = hoy.year - nino.fecha_nacimiento.year - (
-            (hoy.month, hoy.day) < (nino.fecha_nacimiento.month, nino.fecha_nacimiento.day)
+    # Optimizar selección de alimentos
+    optimizador = OptimizadorAlimentos()
+    preferencias = preferencias_usuario or {}
+    comidas, solver = {}, {}
+    with medicion.etapa('puntuacion'):
+        for categoria in COMIDAS:
+            comidas[categoria], solver[categoria] = optimizador.resolver_comida(
+                categoria, matrices[categoria],
+                getattr(requisitos, f'{categoria}_calorias'), getattr(requisitos, f'{categoria}_proteinas'), edad,
+                modo=preferencias.get('solver'), presupuesto_ms=preferencias.get('presupuesto_ms')
+            )
+
+    with medicion.etapa('validacion'):
+        return _ensamblar_plan(nino, historial, parametro, edad, requisitos, alergias, comidas, solver)
+
+def planificar_opciones(
+    nino: 'Nino',
+    historial: 'HistorialClinico',
+    parametro: 'ParametroReferencia',
+    num_opciones: int,
+    catalogo: Optional[InstantaneaCatalogo] = None,
+    medicion=SIN_MEDICION
+) -> List[PlanRecomendacion]:
+    """
+    Hasta num_opciones planes distintos en una sola pasada de optimización.
+
+    Las puntuaciones se calculan una vez por comida; cada opción evita los
+    alimentos elegidos por las anteriores. Los planes idénticos a uno previo
+    se descartan y el resto se devuelve de mayor a menor puntuación media.
+    """
+    edad, requisitos, alergias, matrices = _preparar_planificacion(
+        nino, historial, parametro, catalogo, medicion
+    )
+
+    with medicion.etapa('puntuacion'):
+        selecciones = {
+            categoria: OptimizadorAlimentos.seleccionar_k_mejores(
+                matrices[categoria],
+                getattr(requisitos, f'{categoria}_calorias'), getattr(requisitos, f'{categoria}_proteinas'), edad,
+                num_opciones
+            )
+            for categoria in COMIDAS
+        }
+
+    distintas, vistos = [], set()
+    for i in range(num_opciones):
+        comidas = {categoria: selecciones[categoria][i] for categoria in COMIDAS}
+        firma = tuple(
+            tuple(a.alimento.id for a in comidas[categoria]) for categoria in COMIDAS
         )
-        
-        # Obtener historial clínico más reciente
-        historial = HistorialClinico.objects.filter(
-            nino=nino, 
-            activo=True
-        ).order_by('-fecha_actualizacion').first()
-        
-        if not historial:
-            raise ValueError("No hay historial clínico activo para este niño.")
-        
-        # Obtener parámetros de referencia
-        parametro = ParametroReferencia.objects.filter(
-            edad_min__lte=edad, 
-            edad_max__gte=edad
-        ).first()
-        
-        if not parametro:
-            raise ValueError(f"No hay parámetros de referencia para la edad {edad} años.")
-        
-        # Calcular requerimientos nutricionales personalizados
-        requisitos = CalculadoraNutricional.calcular_requerimientos(nino, historial, parametro)
-        
-        # Procesar alergias
-        alergias_normalizadas = ProcesadorAlergias.procesar_alergias(historial.alergias)
-        
-        # Filtrar alimentos seguros por categoría
-        def obtener_alimentos_seguros(categoria: str) -> List['Alimento']:
-            query = Alimento.objects.filter(categoria=categoria)
-            
-            # Filtrar alérgenos
-            if alergias_normalizadas:
-                for alergia in alergias_normalizadas:
-                    query = query.exclude(alergenos__icontains=alergia)
-            
-            return list(query)
-        
-        # Obtener alimentos disponibles por categoría
-        alimentos_desayuno_disponibles = obtener_alimentos_seguros('desayuno')
-        alimentos_almuerzo_disponibles = obtener_alimentos_seguros('almuerzo')
-        alimentos_cena_disponibles = obtener_alimentos_seguros('cena')
-        
-        # Verificar disponibilidad mínima
-        if not alimentos_desayuno_disponibles:
-            raise ValueError("No hay alimentos de desayuno disponibles con las restricciones actuales")
-        if not alimentos_almuerzo_disponibles:
-            raise ValueError("No hay alimentos de almuerzo disponibles con las restricciones actuales")
-        if not alimentos_cena_disponibles:
-            raise ValueError("No hay alimentos de cena disponibles con las restricciones actuales")
-        
-        # Optimizar selección de alimentos
-        optimizador = OptimizadorAlimentos()
-        
-        alimentos_desayuno = optimizador.seleccionar_alimentos_optimizados(
-            'desayuno', alimentos_desayuno_disponibles, 
-            requisitos.desayuno_calorias, requisitos.desayuno_proteinas, edad
+        if firma in vistos:
+            continue
+        vistos.add(firma)
+        distintas.append(comidas)
+
+    with medicion.etapa('validacion'):
+        planes = [
+            _ensamblar_plan(nino, historial, parametro, edad, requisitos, alergias, comidas, {})
+            for comidas in distintas
+        ]
+    planes.sort(key=lambda plan: -plan.puntuacion_media)
+    return [
+        replace(plan, solver={categoria: {"modo": "k_mejores", "opcion": i + 1} for categoria in COMIDAS})
+        for i, plan in enumerate(planes)
+    ]
+
+def planificar_semana(
+    nino: 'Nino',
+    historial: 'HistorialClinico',
+    parametro: 'ParametroReferencia',
+    dias: int = 7,
+    max_repeticiones: Optional[int] = None,
+    catalogo: Optional[InstantaneaCatalogo] = None
+) -> List[PlanRecomendacion]:
+    """
+    Un plan por día para `dias` días, sin repetir un alimento más de
+    max_repeticiones veces en el periodo (RECOMENDADOR['SEMANA_MAX_REPETICIONES']).
+
+    Los datos y las puntuaciones se calculan una vez por comida para todo el
+    periodo; los días se eligen en conjunto compartiendo el conteo de usos.
+    """
+    if max_repeticiones is None:
+        max_repeticiones = getattr(settings, 'RECOMENDADOR', {}).get('SEMANA_MAX_REPETICIONES', 2)
+    edad, requisitos, alergias, matrices = _preparar_planificacion(nino, historial, parametro, catalogo)
+
+    selecciones, relajados = {}, {}
+    for categoria in COMIDAS:
+        selecciones[categoria], relajados[categoria] = OptimizadorAlimentos.seleccionar_semana(
+            matrices[categoria],
+            getattr(requisitos, f'{categoria}_calorias'), getattr(requisitos, f'{categoria}_proteinas'), edad,
+            dias, max_repeticiones
         )
-        
-        alimentos_almuerzo = optimizador.seleccionar_alimentos_optimizados(
-            'almuerzo', alimentos_almuerzo_disponibles,
-            requisitos.almuerzo_calorias, requisitos.almuerzo_proteinas, edad
+        if relajados[categoria]:
+            logger.warning(
+                f"No hay suficientes alimentos de {categoria} para {dias} días con máximo "
+                f"{max_repeticiones} repeticiones; se repiten en {len(relajados[categoria])} días"
+            )
+
+    planes = []
+    for dia in range(dias):
+        comidas = {categoria: selecciones[categoria][dia] for categoria in COMIDAS}
+        solver = {
+            categoria: {
+                "modo": "semanal", "dia": dia + 1, "dias": dias,
+                "max_repeticiones": max_repeticiones, "relajado": dia in relajados[categoria],
+            }
+            for categoria in COMIDAS
+        }
+        planes.append(_ensamblar_plan(nino, historial, parametro, edad, requisitos, alergias, comidas, solver))
+    return planes
+
+def guardar_semana(
+    planes: List[PlanRecomendacion],
+    motivo: str,
+    fecha_inicio: Optional[date] = None
+) -> List['Recomendacion']:
+    """
+    Persiste los planes de planificar_semana, uno por día desde fecha_inicio
+    (hoy por defecto), en una transacción con inserciones en bloque.
+    """
+    fecha_inicio = fecha_inicio or now().date()
+    recomendaciones = [
+        Recomendacion(
+            nino=plan.nino,
+            fecha=fecha_inicio + timedelta(days=dia),
+            motivo=motivo,
+            fuente=plan.fuente(),
+            estado='vigente',
+            calorias_totales=plan.calorias_totales,
+            proteinas_totales=plan.proteinas_totales,
+            alergenos_evitados=plan.alergias,
+            notas=plan.notas()
         )
-        
-        alimentos_cena = optimizador.seleccionar_alimentos_optimizados(
-            'cena', alimentos_cena_disponibles,
-            requisitos.cena_calorias, requisitos.cena_proteinas, edad
+        for dia, plan in enumerate(planes)
+    ]
+    comidas = [
+        {categoria: [a.alimento for a in alimentos] for categoria, alimentos in plan.comidas.items()}
+        for plan in planes
+    ]
+    with transaction.atomic():
+        return Recomendacion.crear_en_bloque(recomendaciones, comidas)
+
+def huella_generacion(
+    nino: 'Nino',
+    historial: 'HistorialClinico',
+    parametro: 'ParametroReferencia',
+    preferencias_usuario: Optional[Dict] = None,
+    catalogo: Optional[InstantaneaCatalogo] = None
+) -> str:
+    """
+    Hash de todas las entradas del generador de un día.
+
+    Incluye la edad, la versión del historial (id y fecha_actualizacion), los
+    valores del parámetro de referencia, la versión del catálogo y de las
+    reglas, y el solver efectivo. Dos generaciones con la misma huella
+    producen el mismo plan.
+    """
+    configuracion = getattr(settings, 'RECOMENDADOR', {})
+    preferencias = preferencias_usuario or {}
+    modo = preferencias.get('solver') or configuracion.get('SOLVER', 'greedy')
+    presupuesto_ms = SolverComidaExacto.presupuesto_efectivo(preferencias.get('presupuesto_ms'))
+    version_catalogo = catalogo.version if catalogo else (
+        obtener_version(Alimento), ReglasRecomendador.obtener().version
+    )
+    entradas = {
+        "generador": "2.0_mejorada",
+        "nino": nino.id,
+        "edad": calcular_edad(nino.fecha_nacimiento),
+        "historial": [historial.id, historial.fecha_actualizacion.isoformat()],
+        "parametro": [
+            parametro.id, parametro.edad_min, parametro.edad_max,
+            parametro.calorias, parametro.proteinas, parametro.hierro,
+        ],
+        "catalogo": list(version_catalogo),
+        "solver": modo,
+        "presupuesto_ms": presupuesto_ms if modo == 'exacto' else None,
+    }
+    return hashlib.sha256(json.dumps(entradas, sort_keys=True).encode()).hexdigest()
+
+def buscar_recomendacion_equivalente(nino: 'Nino', huella: str) -> Optional['Recomendacion']:
+    """Última recomendación vigente del niño generada con la misma huella"""
+    return Recomendacion.objects.filter(nino=nino, huella=huella, estado='vigente').order_by('-id').first()
+
+def reutilizar_recomendacion(existente: 'Recomendacion', motivo: str) -> 'Recomendacion':
+    """
+    Resultado de una generación equivalente, sin recalcular.
+
+    Si la recomendación existente es de hoy se devuelve tal cual; si es de
+    otro día se copia con fecha de hoy y los mismos alimentos.
+    """
+    if existente.fecha == now().date():
+        return existente
+
+    fuente = dict(existente.fuente or {})
+    fuente.pop("perf", None)
+    fuente["reutiliza_recomendacion"] = existente.id
+    return crear_recomendacion(
+        nino=existente.nino,
+        motivo=motivo,
+        fuente=fuente,
+        calorias_totales=existente.calorias_totales,
+        proteinas_totales=existente.proteinas_totales,
+        alergias=existente.alergenos_evitados,
+        notas=existente.notas,
+        comidas={
+            categoria: [item.alimento for item in getattr(existente, relacion).select_related('alimento').order_by('id')]
+            for categoria, relacion in (('desayuno', 'desayunos'), ('almuerzo', 'almuerzos'), ('cena', 'cenas'))
+        },
+        huella=existente.huella,
+    )
+
+def guardar_recomendacion(plan: PlanRecomendacion, motivo: str, huella: str = '') -> 'Recomendacion':
+    """Persiste un plan como Recomendacion con sus alimentos por comida"""
+    return crear_recomendacion(
+        nino=plan.nino,
+        motivo=motivo,
+        fuente=plan.fuente(),
+        calorias_totales=plan.calorias_totales,
+        proteinas_totales=plan.proteinas_totales,
+        alergias=plan.alergias,
+        notas=plan.notas(),
+        comidas={categoria: [a.alimento for a in alimentos] for categoria, alimentos in plan.comidas.items()},
+        huella=huella,
+    )
+
+def crear_recomendacion(
+    nino: 'Nino',
+    motivo: str,
+    fuente: Dict,
+    calorias_totales: float,
+    proteinas_totales: float,
+    alergias: List[str],
+    notas: str,
+    comidas: Dict[str, List['Alimento']],
+    huella: str = ''
+) -> 'Recomendacion':
+    """Crea la Recomendacion y sus alimentos por comida en una transacción"""
+    with transaction.atomic():
+        recomendacion = Recomendacion.objects.create(
+            nino=nino,
+            fecha=now().date(),
+            motivo=motivo,
+            fuente=fuente,
+            estado='vigente',
+            calorias_totales=calorias_totales,
+            proteinas_totales=proteinas_totales,
+            alergenos_evitados=alergias,
+            notas=notas,
+            huella=huella
         )
         
-        # Validar recomendación
-        validador = ValidadorRecomendaciones()
-        es_valida, errores = validador.validar_recomendacion(
-            alimentos_desayuno, alimentos_almuerzo, alimentos_cena, requisitos
+        # Guardar alimentos en bloque
+        recomendacion.agregar_alimentos(
+            desayunos=comidas['desayuno'],
+            almuerzos=comidas['almuerzo'],
+            cenas=comidas['cena'],
         )
+
+    return recomendacion
+
+def cargar_datos_nino(nino_id: int) -> Tuple['Nino', 'HistorialClinico', 'ParametroReferencia']:
+    """Niño, historial clínico activo más reciente y parámetros de referencia para su edad"""
+    # Obtener datos base
+    nino = Nino.objects.get(id=nino_id)
+    
+    # Calcular edad
+    edad = calcular_edad(nino.fecha_nacimiento)
+    
+    # Obtener historial clínico más reciente
+    historial = HistorialClinico.objects.filter(
+        nino=nino, 
+        activo=True
+    ).order_by(*HistorialClinico.ORDEN_RECIENTE).first()
+    
+    if not historial:
+        raise ValueError("No hay historial clínico activo para este niño.")
+    
+    # Obtener parámetros de referencia
+    parametro = IndiceParametros.obtener().buscar(edad)
+    
+    if not parametro:
+        raise ValueError(f"No hay parámetros de referencia para la edad {edad} años.")
+
+    return nino, historial, parametro
+
+def generar_recomendacion_automatica_mejorada(
+    nino_id: int, 
+    motivo: str = "Recomendación automática generada",
+    preferencias_usuario: Optional[Dict] = None,
+    forzar: bool = False,
+    progreso: Optional[Callable[[int], None]] = None
+) -> 'Recomendacion':
+    """
+    Genera recomendación nutricional automatizada con algoritmos mejorados
+
+    preferencias_usuario admite 'solver' ('greedy' o 'exacto') y
+    'presupuesto_ms' para sobrescribir la configuración RECOMENDADOR.
+    Si ya hay una recomendación con las mismas entradas (huella_generacion) se
+    reutiliza en vez de recalcular, salvo que forzar sea True.
+    `progreso` recibe el porcentaje de avance (lo usa la cola de trabajos).
+
+    Con RECOMENDADOR['MEDIR_ETAPAS'] activo, la duración y las consultas de
+    cada etapa se registran en el log y en fuente['perf'] (agregables con
+    medicion.resumir_perf).
+    """
+    medicion = nueva_medicion()
+    avanzar = progreso or (lambda porcentaje: None)
+
+    try:
+        with medicion.etapa('carga_datos'):
+            nino, historial, parametro = cargar_datos_nino(nino_id)
+        avanzar(20)
+
+        with medicion.etapa('reutilizacion'):
+            huella = huella_generacion(nino, historial, parametro, preferencias_usuario)
+            existente = None if forzar else buscar_recomendacion_equivalente(nino, huella)
+        if existente:
+            logger.info(f"Entradas sin cambios para niño {nino_id}; se reutiliza la recomendación {existente.id}")
+            with medicion.etapa('persistencia'):
+                recomendacion = reutilizar_recomendacion(existente, motivo)
+            _registrar_medicion(nino_id, medicion)
+            return recomendacion
         
-        if not es_valida:
-            logger.warning(f"Recomendación para niño {nino_id} tiene advertencias: {errores}")
-        
-        # Calcular totales reales
-        calorias_reales = sum([
-            sum(a.alimento.calorias * a.porcion_sugerida for a in categoria)
-            for categoria in [alimentos_desayuno, alimentos_almuerzo, alimentos_cena]
-        ])
-        
-        proteinas_reales = sum([
-            sum(a.alimento.proteinas * a.porcion_sugerida for a in categoria)
-            for categoria in [alimentos_desayuno, alimentos_almuerzo, alimentos_cena]
-        ])
+        plan = planificar_recomendacion(
+            nino, historial, parametro, preferencias_usuario=preferencias_usuario, medicion=medicion
+        )
+        avanzar(70)
         
         # Guardar en base de datos
-        with transaction.atomic():
-            recomendacion = Recomendacion.objects.create(
-                nino=nino,
-                fecha=now().date(),
-                motivo=motivo,
-                fuente={
-                    "version": "2.0_mejorada",
-                    "edad": edad,
-                    "datos_fisicos": {
-                        "peso": historial.peso,
-                        "talla": historial.talla,
-                        "actividad_fisica": historial.actividad_fisica,
-                    },
-                    "condiciones_medicas": {
-                        "enfermedades": historial.enfermedades,
-                        "alergias": alergias_normalizadas,
-                    },
-                    "parametros_referencia": {
-                        "calorias_objetivo": parametro.calorias,
-                        "proteinas_objetivo": parametro.proteinas,
-                        "hierro_objetivo": parametro.hierro,
-                    },
-                    "calculos_personalizados": {
-                        "tmb_calculada": CalculadoraNutricional.calcular_tmb_pediatrica(historial.peso, historial.talla, edad),
-                        "factor_actividad": CalculadoraNutricional.FACTORES_ACTIVIDAD.get(historial.actividad_fisica, 1.4),
-                        "calorias_personalizadas": requisitos.calorias_totales,
-                        "proteinas_personalizadas": requisitos.proteinas_totales,
-                    },
-                    "validacion": {
-                        "es_valida": es_valida,
-                        "errores": errores if errores else None,
-                    }
-                },
-                estado='vigente',
-                calorias_totales=calorias_reales,
-                proteinas_totales=proteinas_reales,
-                alergenos_evitados=alergias_normalizadas,
-                notas=f"Generado automáticamente por sistema mejorado v2.0. " + 
-                      (f"Advertencias: {'; '.join(errores)}" if errores else "Recomendación validada correctamente.")
-            )
-            
-            # Guardar alimentos con información de porciones
-            for alimento_puntuado in alimentos_desayuno:
-                RecomendacionDesayuno.objects.create(
-                    recomendacion=recomendacion, 
-                    alimento=alimento_puntuado.alimento
-                )
-                
-            for alimento_puntuado in alimentos_almuerzo:
-                RecomendacionAlmuerzo.objects.create(
-                    recomendacion=recomendacion, 
-                    alimento=alimento_puntuado.alimento
-                )
-                
-            for alimento_puntuado in alimentos_cena:
-                RecomendacionCena.objects.create(
-                    recomendacion=recomendacion, 
-                    alimento=alimento_puntuado.alimento
-                )
+        with medicion.etapa('persistencia'):
+            recomendacion = guardar_recomendacion(plan, motivo, huella)
         
+        perf = _registrar_medicion(nino_id, medicion)
+        if perf:
+            # Una consulta extra, solo con la medición activa, para incluir la persistencia
+            recomendacion.fuente = {**recomendacion.fuente, "perf": perf}
+            Recomendacion.objects.filter(id=recomendacion.id).update(fuente=recomendacion.fuente)
+
         logger.info(f"Recomendación generada exitosamente para niño {nino_id}")
         return recomendacion
         
@@ -515,20 +1705,58 @@ def generar_recomendacion_automatica_mejorada(
         logger.error(f"Error generando recomendación para niño {nino_id}: {str(e)}")
         raise
 
+def _registrar_medicion(nino_id: int, medicion) -> Optional[Dict]:
+    """Resumen de la medición (None si está desactivada), emitido también al log"""
+    perf = medicion.resumen()
+    if perf:
+        logger.info(f"Etapas de generación para niño {nino_id}: {json.dumps(perf, sort_keys=True)}")
+    return perf
+
+def generar_semana_recomendaciones(
+    nino_id: int,
+    dias: int = 7,
+    max_repeticiones: Optional[int] = None,
+    motivo: str = "Plan semanal automático",
+    fecha_inicio: Optional[date] = None
+) -> List['Recomendacion']:
+    """Genera y guarda un plan de `dias` días con variedad entre días"""
+    nino, historial, parametro = cargar_datos_nino(nino_id)
+    planes = planificar_semana(nino, historial, parametro, dias, max_repeticiones)
+    recomendaciones = guardar_semana(planes, motivo, fecha_inicio)
+    logger.info(f"Plan de {dias} días generado para niño {nino_id}")
+    return recomendaciones
+
 # Función auxiliar para generar múltiples opciones
 def generar_opciones_recomendacion(nino_id: int, num_opciones: int = 3) -> List['Recomendacion']:
-    """Genera múltiples opciones de recomendación para que el usuario elija"""
-    opciones = []
-    
-    for i in range(num_opciones):
-        try:
-            recomendacion = generar_recomendacion_automatica_mejorada(
-                nino_id, 
-                motivo=f"Opción {i+1} de recomendación automática"
-            )
-            opciones.append(recomendacion)
-        except Exception as e:
-            logger.warning(f"No se pudo generar opción {i+1}: {str(e)}")
-            continue
-    
-    return opciones
\ No newline at end of file
+    """
+    Genera múltiples opciones de recomendación para que el usuario elija
+
+    Los datos se cargan una vez, las opciones salen de una sola pasada de
+    optimización y se guardan juntas en una transacción. Con
+    RECOMENDADOR['MEDIR_ETAPAS'] activo, la medición de la llamada queda en
+    fuente['perf'] de la primera opción.
+    """
+    medicion = nueva_medicion()
+    try:
+        with medicion.etapa('carga_datos'):
+            nino, historial, parametro = cargar_datos_nino(nino_id)
+        planes = planificar_opciones(nino, historial, parametro, num_opciones, medicion=medicion)
+    except Exception as e:
+        logger.warning(f"No se pudieron generar opciones para niño {nino_id}: {str(e)}")
+        return []
+
+    if len(planes) < num_opciones:
+        logger.warning(f"Solo hay {len(planes)} opciones distintas para niño {nino_id}")
+
+    with medicion.etapa('persistencia'), transaction.atomic():
+        recomendaciones = [
+            guardar_recomendacion(plan, motivo=f"Opción {i+1} de recomendación automática")
+            for i, plan in enumerate(planes)
+        ]
+
+    perf = _registrar_medicion(nino_id, medicion)
+    if perf and recomendaciones:
+        primera = recomendaciones[0]
+        primera.fuente = {**primera.fuente, "perf": perf}
+        Recomendacion.objects.filter(id=primera.id).update(fuente=primera.fuente)
+    return recomendaciones
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_POR_DEFECTO = Path(__file__).with_name('reglas_recomendador.json')
+
+# Palabras de un texto ya normalizado; '_' separa igual que un espacio
+PALABRAS = re.compile(r'[^\W_]+')
+
+# Artículos y preposiciones que no cuentan solos como alérgeno ('trazas de leche')
+PALABRAS_VACIAS = frozenset({
+    'a', 'al', 'con', 'de', 'del', 'e', 'el', 'en', 'la', 'las', 'lo', 'los',
+    'o', 'por', 'sin', 'u', 'un', 'una', 'y',
+})
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas y sin tildes ni diéresis ('Plátano' -> 'platano')"""
+    descompuesto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def formas_singulares(palabra: str) -> Tuple[str, ...]:
+    """
+    La palabra normalizada y sus posibles singulares.
+
+    'huevos' -> ('huevos', 'huevo'); 'nueces' -> ('nueces', 'nuece', 'nuec', 'nuez').
+    Las formas sobrantes no hacen daño: ambos lados de la comparación generan
+    las mismas, y solo coinciden entre sí.
+    """
+    formas = [palabra]
+    if len(palabra) > 3 and palabra.endswith('s'):
+        formas.append(palabra[:-1])
+        if len(palabra) > 4 and palabra.endswith('es'):
+            formas.append(palabra[:-2])
+            if palabra.endswith('ces'):
+                formas.append(palabra[:-3] + 'z')
+    return tuple(formas)
+
+
+class ComparadorPalabras:
+    """
+    Autómata de Aho-Corasick sobre un conjunto de palabras clave.
+
+    Encuentra en una sola pasada por el texto todas las palabras contenidas en
+    él (como subcadena, igual que `palabra in texto`) y devuelve sus etiquetas.
+    """
+
+    def __init__(self, patrones: Iterable[Tuple[str, object]]):
+        self._transiciones: List[Dict[str, int]] = [{}]
+        self._fallo: List[int] = [0]
+        self._salida: List[Set] = [set()]
+
+        for patron, etiqueta in patrones:
+            patron = normalizar_texto(patron)
+            if not patron:
+                continue
+            estado = 0
+            for caracter in patron:
+                siguiente = self._transiciones[estado].get(caracter)
+                if siguiente is None:
+                    siguiente = len(self._transiciones)
+                    self._transiciones[estado][caracter] = siguiente
+                    self._transiciones.append({})
+                    self._fallo.append(0)
+                    self._salida.append(set())
+                estado = siguiente
+            self._salida[estado].add(etiqueta)
+
+        # Enlaces de fallo en anchura: el de cada nodo ya está listo al visitar sus hijos
+        cola = deque(self._transiciones[0].values())
+        while cola:
+            estado = cola.popleft()
+            for caracter, siguiente in self._transiciones[estado].items():
+                cola.append(siguiente)
+                fallo = self._fallo[estado]
+                while fallo and caracter not in self._transiciones[fallo]:
+                    fallo = self._fallo[fallo]
+                self._fallo[siguiente] = self._transiciones[fallo].get(caracter, 0)
+                self._salida[siguiente] |= self._salida[self._fallo[siguiente]]
+
+    def etiquetas(self, texto: str) -> Set:
+        """Etiquetas de todas las palabras clave que aparecen en el texto"""
+        estado, encontradas = 0, set()
+        for caracter in normalizar_texto(texto):
+            while estado and caracter not in self._transiciones[estado]:
+                estado = self._fallo[estado]
+            estado = self._transiciones[estado].get(caracter, 0)
+            if self._salida[estado]:
+                encontradas |= self._salida[estado]
+        return encontradas
+
+
+@dataclass(frozen=True)
+class AjusteEnfermedad:
+    """Factores que se aplican a los requerimientos si el historial menciona el patrón"""
+    patron: str
+    factor_calorias: float = 1.0
+    factor_proteinas: float = 1.0
+
+
+@dataclass(frozen=True)
+class ConjuntoReglas:
+    """Reglas del recomendador ya compiladas, identificadas por el hash de sus datos"""
+    version: str
+    grupos_importantes: FrozenSet[str]
+    palabras: ComparadorPalabras
+    enfermedades: Tuple[AjusteEnfermedad, ...]
+    comparador_enfermedades: ComparadorPalabras
+    # sinónimo (o término estándar) normalizado -> término estándar
+    sinonimos_alergias: Dict[str, str]
+
+    @classmethod
+    def desde_datos(cls, datos: Dict, version: str = '') -> 'ConjuntoReglas':
+        enfermedades = tuple(AjusteEnfermedad(**regla) for regla in datos.get('enfermedades', []))
+        sinonimos_alergias = {}
+        for estandar, sinonimos in datos.get('alergias', {}).items():
+            # Si un término aparece en varias entradas, gana la primera
+            for termino in (estandar, *sinonimos):
+                sinonimos_alergias.setdefault(normalizar_texto(termino).strip(), estandar)
+        return cls(
+            version=version,
+            grupos_importantes=frozenset(normalizar_texto(g) for g in datos.get('grupos_importantes', [])),
+            palabras=ComparadorPalabras(
+                (palabra, rasgo)
+                for rasgo, lista in datos.get('palabras', {}).items()
+                for palabra in lista
+            ),
+            enfermedades=enfermedades,
+            comparador_enfermedades=ComparadorPalabras(
+                (ajuste.patron, posicion) for posicion, ajuste in enumerate(enfermedades)
+            ),
+            sinonimos_alergias=sinonimos_alergias,
+        )
+
+    def rasgos_alimento(self, nombre: str, grupo_alimenticio: str) -> Dict:
+        """Rasgos de palatabilidad de un alimento, tal como se guardan en Alimento.rasgos"""
+        encontrados = self.palabras.etiquetas(nombre)
+        return {
+            "version": self.version,
+            "infantil": 'infantil' in encontrados,
+            "textura_suave": 'textura_suave' in encontrados,
+            "grupo_importante": normalizar_texto(grupo_alimenticio) in self.grupos_importantes,
+        }
+
+    def estandarizar_alergeno(self, termino: str) -> str:
+        """Término estándar de un alérgeno, o el término normalizado si no tiene sinónimos"""
+        termino = normalizar_texto(termino).strip()
+        return self.sinonimos_alergias.get(termino, termino)
+
+    def alergenos_en_texto(self, texto: str) -> Set[str]:
+        """
+        Alérgenos estandarizados que aparecen como palabras completas en el texto.
+
+        Es la única normalización de alérgenos: se aplica igual a las alergias
+        del historial, al filtro sin_alergenos y a los alérgenos de cada
+        alimento, así que ambos lados producen los mismos términos.
+
+        'Leche entera' y 'leche de vaca' dan {'leche'}, pero 'le' no coincide
+        con 'leche'. Se prueban las frases de hasta tantas palabras como el
+        sinónimo más largo ('frutos secos' o 'frutos_secos' -> 'frutos_secos'),
+        tal cual y en singular ('huevos' -> 'huevo'); cada palabra (salvo
+        artículos y preposiciones) y el texto completo también cuentan como
+        términos, para alérgenos que no figuran en las reglas.
+        """
+        palabras = PALABRAS.findall(normalizar_texto(texto))
+        if not palabras:
+            return set()
+
+        encontrados = {
+            self.sinonimos_alergias.get(forma, forma)
+            for palabra in palabras if palabra not in PALABRAS_VACIAS
+            for forma in formas_singulares(palabra)
+        }
+        # Las frases se prueban tal cual y sin la 's' final de cada palabra
+        for frase_completa in (palabras, [formas_singulares(palabra)[:2][-1] for palabra in palabras]):
+            completo = ' '.join(frase_completa)
+            encontrados.add(self.sinonimos_alergias.get(completo, completo))
+            for inicio in range(len(frase_completa)):
+                for fin in range(inicio + 2, min(len(frase_completa), inicio + self.max_palabras_alergia) + 1):
+                    frase = frase_completa[inicio:fin]
+                    for clave in (' '.join(frase), '_'.join(frase)):
+                        if clave in self.sinonimos_alergias:
+                            encontrados.add(self.sinonimos_alergias[clave])
+        return encontrados
+
+    @cached_property
+    def max_palabras_alergia(self) -> int:
+        return max((len(PALABRAS.findall(termino)) for termino in self.sinonimos_alergias), default=1)
+
+    def ajustes_enfermedad(self, enfermedades: str) -> List[AjusteEnfermedad]:
+        """Ajustes cuyos patrones aparecen en el texto, en el orden del archivo"""
+        return [self.enfermedades[i] for i in sorted(self.comparador_enfermedades.etiquetas(enfermedades))]
+
+
+class ReglasRecomendador:
+    """
+    Reglas del recomendador cargadas desde el archivo JSON de reglas.
+
+    El archivo se vuelve a leer cuando cambia su fecha de modificación, así que
+    los cambios se aplican sin reiniciar los procesos.
+    """
+
+    _reglas: Optional[ConjuntoReglas] = None
+    _marca: Optional[Tuple[int, int]] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def archivo() -> Path:
+        return Path(getattr(settings, 'RECOMENDADOR', {}).get('REGLAS_ARCHIVO', ARCHIVO_POR_DEFECTO))
+
+    @classmethod
+    def obtener(cls) -> ConjuntoReglas:
+        """Devuelve las reglas vigentes, recompilándolas si el archivo cambió"""
+        estado = os.stat(cls.archivo())
+        marca = (estado.st_mtime_ns, estado.st_size)
+        reglas = cls._reglas
+        if reglas is not None and cls._marca == marca:
+            return reglas
+
+        with cls._lock:
+            if cls._reglas is None or cls._marca != marca:
+                cls._reglas = cls._cargar()
+                cls._marca = marca
+            return cls._reglas
+
+    @classmethod
+    def invalidar(cls) -> None:
+        with cls._lock:
+            cls._reglas = None
+            cls._marca = None
+
+    @classmethod
+    def _cargar(cls) -> ConjuntoReglas:
+        contenido = cls.archivo().read_bytes()
+        version = hashlib.sha1(contenido).hexdigest()[:12]
+        reglas = ConjuntoReglas.desde_datos(json.loads(contenido), version)
+        logger.info(f"Reglas del recomendador cargadas (versión {version})")
+        return reglas
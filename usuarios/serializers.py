@@ -1,7 +1,10 @@
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
+from .campos import CamposDinamicosMixin, FormaRespuesta, solo_id
 from .models import Usuario, Nino, LogActividad, HistorialClinico, Alimento, RecomendacionAlmuerzo, RecomendacionCena, RecomendacionDesayuno, Recomendacion, ParametroReferencia, Permiso, RolPermiso, RolPersonalizado
 
-class UsuarioSerializer(serializers.ModelSerializer):
+class UsuarioSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     # Hacemos que la contraseña y el rol sean opcionales para las actualizaciones
     password = serializers.CharField(write_only=True, required=False, allow_blank=True)
     rol = serializers.CharField(write_only=True, required=False, allow_blank=True)
@@ -51,7 +54,7 @@ class UsuarioSerializer(serializers.ModelSerializer):
         return instance
 
 
-class NinoSerializer(serializers.ModelSerializer):
+class NinoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     apellidos = serializers.SerializerMethodField()
     alergias = serializers.SerializerMethodField()
     enfermedades = serializers.SerializerMethodField()
@@ -64,25 +67,39 @@ class NinoSerializer(serializers.ModelSerializer):
             'alergias', 'enfermedades'
         ]
 
+    @classmethod
+    def optimizar_consulta(cls, queryset, forma=None, ruta=()):
+        forma = forma or FormaRespuesta()
+        if forma.incluye(ruta, 'alergias') or forma.incluye(ruta, 'enfermedades'):
+            return queryset.con_historial_reciente()
+        return queryset
+
     def get_apellidos(self, obj):
         parts = [obj.apellido_paterno, obj.apellido_materno]
         return " ".join(filter(None, parts))
 
     def get_historial_reciente(self, obj):
-        return obj.historiales.order_by('-fecha_actualizacion').first()
+        return obj.historiales.order_by(*HistorialClinico.ORDEN_RECIENTE).first()
+
+    def _campo_historial(self, obj, campo):
+        # Niños de Nino.objects.con_historial_reciente(): sin consultas extra
+        if hasattr(obj, 'historial_reciente_id'):
+            if obj.historial_reciente_id is None:
+                return 'No registradas'
+            return getattr(obj, f'historial_{campo}')
+        historial = self.get_historial_reciente(obj)
+        return getattr(historial, campo) if historial else 'No registradas'
 
     def get_alergias(self, obj):
-        historial = self.get_historial_reciente(obj)
-        return historial.alergias if historial else 'No registradas'
+        return self._campo_historial(obj, 'alergias')
 
     def get_enfermedades(self, obj):
-        historial = self.get_historial_reciente(obj)
-        return historial.enfermedades if historial else 'No registradas'
+        return self._campo_historial(obj, 'enfermedades')
 
 
 # usuarios/serializers.py
 
-class LogActividadSerializer(serializers.ModelSerializer):
+class LogActividadSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = LogActividad
         fields = '__all__'
@@ -90,41 +107,54 @@ class LogActividadSerializer(serializers.ModelSerializer):
 # usuarios/serializers.py
 
 
-class HistorialClinicoSerializer(serializers.ModelSerializer):
+class HistorialClinicoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = HistorialClinico
         fields = '__all__'
 
-class AlimentoSerializer(serializers.ModelSerializer):
+class AlimentoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Alimento
-        fields = '__all__'
+        # rasgos es un cálculo interno del recomendador, no parte de la API
+        exclude = ['rasgos']
+
+class ItemComidaMixin(CamposDinamicosMixin):
+    """Alimento de una comida de la recomendación; el alimento se colapsa a su id"""
 
-class RecomendacionDesayunoSerializer(serializers.ModelSerializer):
+    @classmethod
+    def optimizar_consulta(cls, queryset, forma=None, ruta=()):
+        if (forma or FormaRespuesta()).construye(ruta, 'alimento'):
+            return queryset.select_related('alimento')
+        return queryset
+
+class RecomendacionDesayunoSerializer(ItemComidaMixin, serializers.ModelSerializer):
     alimento = AlimentoSerializer(read_only=True)
     alimento_id = serializers.PrimaryKeyRelatedField(queryset=Alimento.objects.all(), source='alimento', write_only=True)
 
     class Meta:
         model = RecomendacionDesayuno
         fields = ['id', 'recomendacion', 'alimento', 'alimento_id']
+        expandibles = {'alimento': solo_id}
 
-class RecomendacionAlmuerzoSerializer(serializers.ModelSerializer):
+class RecomendacionAlmuerzoSerializer(ItemComidaMixin, serializers.ModelSerializer):
     alimento = AlimentoSerializer(read_only=True)
     alimento_id = serializers.PrimaryKeyRelatedField(queryset=Alimento.objects.all(), source='alimento', write_only=True)
 
     class Meta:
         model = RecomendacionAlmuerzo
         fields = ['id', 'recomendacion', 'alimento', 'alimento_id']
+        expandibles = {'alimento': solo_id}
 
-class RecomendacionCenaSerializer(serializers.ModelSerializer):
+class RecomendacionCenaSerializer(ItemComidaMixin, serializers.ModelSerializer):
     alimento = AlimentoSerializer(read_only=True)
     alimento_id = serializers.PrimaryKeyRelatedField(queryset=Alimento.objects.all(), source='alimento', write_only=True)
 
     class Meta:
         model = RecomendacionCena
         fields = ['id', 'recomendacion', 'alimento', 'alimento_id']
+        expandibles = {'alimento': solo_id}
 
-class RecomendacionSerializer(serializers.ModelSerializer):
+class RecomendacionSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     nino_details = NinoSerializer(source='nino', read_only=True)
     desayunos = RecomendacionDesayunoSerializer(many=True, required=False)
     almuerzos = RecomendacionAlmuerzoSerializer(many=True, required=False)
@@ -137,54 +167,67 @@ class RecomendacionSerializer(serializers.ModelSerializer):
             'calorias_totales', 'proteinas_totales', 'alergenos_evitados', 'notas',
             'desayunos', 'almuerzos', 'cenas'
         ]
+        expandibles = {'nino_details': None, 'desayunos': None, 'almuerzos': None, 'cenas': None}
+
+    @classmethod
+    def optimizar_consulta(cls, queryset, forma=None, ruta=()):
+        """
+        Carga de una vez lo que va a recorrer el serializador para la forma
+        pedida: una consulta por relación anidada que se construya, sin
+        importar cuántas recomendaciones haya.
+        """
+        forma = forma or FormaRespuesta()
+        plan = []
+        if forma.construye(ruta, 'nino_details'):
+            plan.append(Prefetch('nino', queryset=NinoSerializer.optimizar_consulta(
+                Nino.objects.all(), forma, (*ruta, 'nino_details')
+            )))
+        for relacion, serializador in (
+            ('desayunos', RecomendacionDesayunoSerializer),
+            ('almuerzos', RecomendacionAlmuerzoSerializer),
+            ('cenas', RecomendacionCenaSerializer),
+        ):
+            if forma.construye(ruta, relacion):
+                plan.append(Prefetch(relacion, queryset=serializador.optimizar_consulta(
+                    serializador.Meta.model.objects.all(), forma, (*ruta, relacion)
+                )))
+        return queryset.prefetch_related(*plan)
 
     def create(self, validated_data):
-        desayunos_data = validated_data.pop('desayunos', [])
-        almuerzos_data = validated_data.pop('almuerzos', [])
-        cenas_data = validated_data.pop('cenas', [])
-
-        recomendacion = Recomendacion.objects.create(**validated_data)
+        desayunos = [item['alimento'] for item in validated_data.pop('desayunos', [])]
+        almuerzos = [item['alimento'] for item in validated_data.pop('almuerzos', [])]
+        cenas = [item['alimento'] for item in validated_data.pop('cenas', [])]
 
-        alimentos_totales = []
+        alimentos_totales = desayunos + almuerzos + cenas
         alergenos_set = set()
-
-        for desayuno_data in desayunos_data:
-            item = RecomendacionDesayuno.objects.create(recomendacion=recomendacion, **desayuno_data)
-            alimentos_totales.append(item.alimento)
-        for almuerzo_data in almuerzos_data:
-            item = RecomendacionAlmuerzo.objects.create(recomendacion=recomendacion, **almuerzo_data)
-            alimentos_totales.append(item.alimento)
-        for cena_data in cenas_data:
-            item = RecomendacionCena.objects.create(recomendacion=recomendacion, **cena_data)
-            alimentos_totales.append(item.alimento)
-
-        calorias = sum(a.calorias for a in alimentos_totales)
-        proteinas = sum(a.proteinas for a in alimentos_totales)
-
         for a in alimentos_totales:
             alergenos_set.update(a.alergenos or [])
 
-        recomendacion.calorias_totales = calorias
-        recomendacion.proteinas_totales = proteinas
-        recomendacion.alergenos_evitados = ', '.join(sorted(alergenos_set))
-        recomendacion.save()
+        # Los totales se calculan antes de crear para guardar la recomendación una sola vez
+        validated_data['calorias_totales'] = sum(a.calorias for a in alimentos_totales)
+        validated_data['proteinas_totales'] = sum(a.proteinas for a in alimentos_totales)
+        validated_data['alergenos_evitados'] = ', '.join(sorted(alergenos_set))
+
+        with transaction.atomic():
+            recomendacion = Recomendacion.objects.create(**validated_data)
+            recomendacion.agregar_alimentos(desayunos=desayunos, almuerzos=almuerzos, cenas=cenas)
 
         return recomendacion
 
     
-class ParametroReferenciaSerializer(serializers.ModelSerializer):
+class ParametroReferenciaSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = ParametroReferencia
         fields = '__all__'
 
 
-class PermisoSerializer(serializers.ModelSerializer):
+class PermisoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     class Meta:
         model = Permiso
         fields = ['id', 'nombre', 'descripcion', 'codigo']
 
 
-class RolPermisoSerializer(serializers.ModelSerializer):
+class RolPermisoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     permiso = PermisoSerializer(read_only=True)
     permiso_id = serializers.PrimaryKeyRelatedField(
         queryset=Permiso.objects.all(), source='permiso', write_only=True
@@ -193,9 +236,16 @@ class RolPermisoSerializer(serializers.ModelSerializer):
     class Meta:
         model = RolPermiso
         fields = ['id', 'rol', 'permiso', 'permiso_id']
+        expandibles = {'permiso': solo_id}
 
+    @classmethod
+    def optimizar_consulta(cls, queryset, forma=None, ruta=()):
+        if (forma or FormaRespuesta()).construye(ruta, 'permiso'):
+            return queryset.select_related('permiso')
+        return queryset
 
-class RolPersonalizadoSerializer(serializers.ModelSerializer):
+
+class RolPersonalizadoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
     permisos = PermisoSerializer(many=True, read_only=True)
     permiso_ids = serializers.PrimaryKeyRelatedField(
         queryset=Permiso.objects.all(), many=True, write_only=True, source='permisos'
@@ -204,15 +254,22 @@ class RolPersonalizadoSerializer(serializers.ModelSerializer):
     class Meta:
         model = RolPersonalizado
         fields = ['id', 'usuario', 'rol', 'permisos', 'permiso_ids']
+        expandibles = {'permisos': None}
+
+    @classmethod
+    def optimizar_consulta(cls, queryset, forma=None, ruta=()):
+        if (forma or FormaRespuesta()).construye(ruta, 'permisos'):
+            return queryset.prefetch_related('permisos')
+        return queryset
 
-        def create(self, validated_data):
-            # Usamos 'permisos', que es el nombre que el serializador usa internamente
-            # gracias a source='permisos'. Hacemos pop con un valor por defecto ([])
-            # para evitar errores si el campo no se envía.
-            permisos_data = validated_data.pop('permisos', [])
-            rol = RolPersonalizado.objects.create(**validated_data)
-            rol.permisos.set(permisos_data)
-            return rol
+    def create(self, validated_data):
+        # Usamos 'permisos', que es el nombre que el serializador usa internamente
+        # gracias a source='permisos'. Hacemos pop con un valor por defecto ([])
+        # para evitar errores si el campo no se envía.
+        permisos_data = validated_data.pop('permisos', [])
+        rol = RolPersonalizado.objects.create(**validated_data)
+        rol.permisos.set(permisos_data)
+        return rol
 
     def update(self, instance, validated_data):
             # Hacemos lo mismo para la actualización.
@@ -1,20 +1,21 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from usuarios.models import (
     Nino, HistorialClinico, Alimento,
     Recomendacion, RecomendacionDesayuno, RecomendacionAlmuerzo, RecomendacionCena,
     ParametroReferencia, Permiso, RolPersonalizado, RolPermiso,
-    LogActividad, Usuario
+    LogActividad, Usuario, alimentos_recomendacion_agregados, recomendaciones_creadas_en_bloque
 )
+from usuarios.versiones import incrementar_version
+from usuarios.reglas import ReglasRecomendador
 
 # Función para obtener el usuario sistema cuando se necesite
 def get_usuario_sistema():
     return Usuario.objects.filter(correo="sistema@tusitio.com").first()
 
 def obtener_rol(usuario):
-    if usuario and usuario.roles_personalizados.exists():
-        return usuario.roles_personalizados.first().rol
-    return "sin_rol"
+    rol = usuario.roles_personalizados.order_by('pk').values_list('rol', flat=True).first() if usuario else None
+    return rol or "sin_rol"
 
 # Nino
 @receiver(post_save, sender=Nino)
@@ -47,6 +48,15 @@ def log_historial(sender, instance, created, **kwargs):
     )
 
 # Alimento
+@receiver(pre_save, sender=Alimento)
+def precalcular_rasgos_alimento(sender, instance, **kwargs):
+    instance.rasgos = ReglasRecomendador.obtener().rasgos_alimento(instance.nombre, instance.grupo_alimenticio)
+
+@receiver(post_save, sender=Alimento)
+@receiver(post_delete, sender=Alimento)
+def versionar_alimento(sender, **kwargs):
+    incrementar_version(Alimento)
+
 @receiver(post_save, sender=Alimento)
 def log_alimento(sender, instance, created, **kwargs):
     usuario = get_usuario_sistema()
@@ -123,7 +133,54 @@ def log_recomendacion_cena(sender, instance, created, **kwargs):
         descripcion=descripcion
     )
 
+# Alimentos de una recomendación guardados en bloque
+@receiver(alimentos_recomendacion_agregados, sender=Recomendacion)
+def log_alimentos_recomendacion(sender, instance, items, **kwargs):
+    detalle = "; ".join(
+        f"{comida}: {', '.join(item.alimento.nombre for item in creados)}"
+        for comida, creados in items.items() if creados
+    )
+    if not detalle:
+        return
+    usuario = instance.nino.usuario
+    rol = obtener_rol(usuario)
+    descripcion = f"Crear alimentos para recomendación {instance.id} ({detalle})"
+    LogActividad.objects.create(
+        usuario=usuario,
+        rol=rol,
+        accion="crear",
+        modulo="recomendacion_alimentos",
+        descripcion=descripcion
+    )
+
+# Recomendaciones creadas en bloque (p. ej. un plan semanal); bulk_create no emite post_save
+@receiver(recomendaciones_creadas_en_bloque, sender=Recomendacion)
+def log_recomendaciones_en_bloque(sender, instances, items, **kwargs):
+    roles = {}
+    logs = []
+    for instance, items_recomendacion in zip(instances, items):
+        usuario = instance.nino.usuario
+        if usuario.pk not in roles:
+            roles[usuario.pk] = obtener_rol(usuario)
+        detalle = "; ".join(
+            f"{comida}: {', '.join(item.alimento.nombre for item in creados)}"
+            for comida, creados in items_recomendacion.items() if creados
+        )
+        logs.append(LogActividad(
+            usuario=usuario,
+            rol=roles[usuario.pk],
+            accion="crear",
+            modulo="recomendacion",
+            descripcion=f"Crear recomendación {instance.id} para {instance.nino.nombres} {instance.nino.apellido_paterno} del {instance.fecha} ({detalle})"
+        ))
+    LogActividad.objects.bulk_create(logs)
+
 # ParametroReferencia
+@receiver(post_save, sender=ParametroReferencia)
+@receiver(post_delete, sender=ParametroReferencia)
+def versionar_parametro_referencia(sender, **kwargs):
+    incrementar_version(ParametroReferencia)
+
 @receiver(post_save, sender=ParametroReferencia)
 def log_parametro_referencia(sender, instance, created, **kwargs):
     usuario = get_usuario_sistema()
@@ -146,6 +203,11 @@ def log_parametro_referencia(sender, instance, created, **kwargs):
         print(f"Error al crear LogActividad: {e}")
 
 # Permiso
+@receiver(post_save, sender=Permiso)
+@receiver(post_delete, sender=Permiso)
+def versionar_permiso(sender, **kwargs):
+    incrementar_version(Permiso)
+
 @receiver(post_save, sender=Permiso)
 def log_permiso(sender, instance, created, **kwargs):
     usuario = get_usuario_sistema()
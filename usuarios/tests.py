@@ -1,3 +1,1258 @@
-from django.test import TestCase
+import itertools
+import json
+import os
+import re
+import tempfile
+from collections import Counter
+from dataclasses import replace
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_delete
+from unittest import skipUnless
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import (
+    Usuario, RolPersonalizado, Nino, HistorialClinico, Alimento, ParametroReferencia, LogActividad, Recomendacion,
+    Permiso, RolPermiso, TrabajoRecomendacion
+)
+from .recomendador import generar_recomendacion_automatica_mejorada, planificar_semana, guardar_semana, CatalogoAlimentos, CalculadoraNutricional, ProcesadorAlergias, InstantaneaParametros, IndiceParametros, AlimentoConPuntuacion, MatrizNutricional, OptimizadorAlimentos, SolverComidaExacto, cargar_datos_nino, planificar_recomendacion, planificar_opciones, generar_opciones_recomendacion, guardar_recomendacion
+from .benchmark import ejecutar_benchmark, sembrar_datos
+from .lotes import _historiales_recientes, generar_recomendaciones_cohorte, seleccionar_cohorte
+from .medicion import resumir_perf
+from .metricas import ARCHIVO_TERMINADOS, RegistroMetricas
+from .reglas import ComparadorPalabras, ReglasRecomendador
+from .serializers import NinoSerializer, RecomendacionSerializer, RolPersonalizadoSerializer
+from .trabajos import _bucle_trabajador, _progreso, encolar_recomendacion, procesar_trabajo, recuperar_abandonados, tomar_siguiente
+from .urls import router
+from .versiones import obtener_version
+
+# Los archivos de métricas de las pruebas no van al DIRECTORIO real
+DIRECTORIO_METRICAS = tempfile.TemporaryDirectory(prefix='nutricion_metricas_')
+
+
+@override_settings(
+    METRICAS={**settings.METRICAS, 'DIRECTORIO': DIRECTORIO_METRICAS.name},
+    # Contadores de versión en memoria, no en la caché de archivos compartida
+    CACHES={**settings.CACHES, 'versiones_pruebas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'versiones_pruebas',
+    }},
+    USUARIOS_CACHE_VERSIONES='versiones_pruebas',
+)
+class PruebaTestCase(TestCase):
+    """TestCase aislado de lo que comparte la instalación (métricas, versiones)"""
+
+    @classmethod
+    def tearDownClass(cls):
+        # Sin contadores pendientes, el volcado de atexit (ya sin este
+        # DIRECTORIO) no escribe nada
+        RegistroMetricas.reiniciar()
+        super().tearDownClass()
+
+
+class DatosRecomendadorMixin:
+    """Usuario, niño con historial, parámetros y un catálogo pequeño por comida"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = Usuario.objects.create_user(
+            correo='tutor@example.com', password='clave', nombres='Ana',
+            apellido_paterno='Rojas', apellido_materno='Vega', ci='100'
+        )
+        RolPersonalizado.objects.create(usuario=cls.usuario, rol='padre')
+        cls.nino = Nino.objects.create(
+            usuario=cls.usuario, nombres='Luis', apellido_paterno='Rojas', apellido_materno='Vega',
+            ci='200', fecha_nacimiento=date(date.today().year - 6, 1, 1)
+        )
+        HistorialClinico.objects.create(
+            nino=cls.nino, peso=20, talla=1.15, actividad_fisica='media', alergias='lactosa'
+        )
+        ParametroReferencia.objects.create(
+            edad_min=4, edad_max=8, calorias=1400, proteinas=19, hierro=10, fuente='OMS'
+        )
+        grupos = ['vegetales', 'frutas', 'proteinas', 'cereales_integrales', 'lacteos']
+        for categoria, _ in Alimento.CATEGORIAS:
+            for i in range(10):
+                Alimento.objects.create(
+                    nombre=f"{categoria} {i}", categoria=categoria,
+                    calorias=80 + 15 * i, proteinas=2 + i, grasas=3, carbohidratos=12,
+                    grupo_alimenticio=grupos[i % len(grupos)],
+                    alergenos=['leche'] if i == 0 else [],
+                )
+
+    def setUp(self):
+        # Las versiones se publican al confirmar; los TestCase nunca confirman
+        CatalogoAlimentos.invalidar()
+        IndiceParametros.invalidar()
+
+
+class InstantaneasVersionadasTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_guardar_y_eliminar_alimento_reconstruyen_el_catalogo(self):
+        version = obtener_version(Alimento)
+        antes = CatalogoAlimentos.obtener()
+        with self.assertNumQueries(0):
+            self.assertIs(CatalogoAlimentos.obtener(), antes)
+
+        alimento = Alimento.objects.filter(categoria='almuerzo').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            alimento.calorias = 999
+            alimento.save()
+        self.assertGreater(obtener_version(Alimento), version)
+
+        despues = CatalogoAlimentos.obtener()
+        self.assertIsNot(despues, antes)
+        self.assertEqual(next(a for a in despues.por_categoria('almuerzo') if a.id == alimento.id).calorias, 999)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            alimento.delete()
+        self.assertNotIn(alimento.id, [a.id for a in CatalogoAlimentos.obtener().por_categoria('almuerzo')])
+
+    def test_version_se_publica_solo_al_confirmar(self):
+        antes = CatalogoAlimentos.obtener()
+        with self.captureOnCommitCallbacks(execute=False):
+            Alimento.objects.filter(categoria='cena').first().save()
+        self.assertIs(CatalogoAlimentos.obtener(), antes)
+
+    def test_guardar_parametro_reconstruye_el_indice(self):
+        version = obtener_version(ParametroReferencia)
+        antes = IndiceParametros.obtener()
+        parametro = ParametroReferencia.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            parametro.calorias = 1500
+            parametro.save()
+        self.assertGreater(obtener_version(ParametroReferencia), version)
+
+        despues = IndiceParametros.obtener()
+        self.assertIsNot(despues, antes)
+        self.assertEqual(despues.buscar(6).calorias, 1500)
+
+
+class PersistenciaRecomendacionTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def _plan_con_items(self, cantidad):
+        nino, historial, parametro = cargar_datos_nino(self.nino.id)
+        plan = planificar_recomendacion(nino, historial, parametro)
+        comidas = {}
+        for categoria in ('desayuno', 'almuerzo', 'cena'):
+            comidas[categoria] = [
+                AlimentoConPuntuacion(alimento, 0, 0, 0, 1.0)
+                for alimento in Alimento.objects.filter(categoria=categoria)[:cantidad]
+            ]
+        return replace(plan, **comidas)
+
+    def test_guardar_recomendacion_usa_consultas_constantes(self):
+        plan_corto = self._plan_con_items(1)
+        plan_largo = self._plan_con_items(5)
+
+        with CaptureQueriesContext(connection) as corto:
+            guardar_recomendacion(plan_corto, "corto")
+        with CaptureQueriesContext(connection) as largo:
+            recomendacion = guardar_recomendacion(plan_largo, "largo")
+
+        self.assertEqual(len(corto), len(largo))
+        self.assertLessEqual(len(largo), 12)
+        self.assertEqual(recomendacion.desayunos.count(), 5)
+        self.assertEqual(recomendacion.cenas.count(), 5)
+
+    def test_una_entrada_de_auditoria_por_recomendacion(self):
+        recomendacion = guardar_recomendacion(self._plan_con_items(5), "auditoria")
+
+        logs = LogActividad.objects.filter(modulo='recomendacion_alimentos')
+        self.assertEqual(logs.count(), 1)
+        self.assertIn(f"recomendación {recomendacion.id}", logs.get().descripcion)
+        self.assertFalse(LogActividad.objects.filter(modulo__in=[
+            'recomendacion_desayuno', 'recomendacion_almuerzo', 'recomendacion_cena'
+        ]).exists())
+
+    def test_serializer_create_usa_el_mismo_camino(self):
+        def crear(cantidad):
+            validated_data = {'nino': self.nino, 'fecha': date(2025, 1, 1), 'motivo': 'manual', 'fuente': {}}
+            for campo, categoria in (('desayunos', 'desayuno'), ('almuerzos', 'almuerzo'), ('cenas', 'cena')):
+                validated_data[campo] = [
+                    {'alimento': alimento} for alimento in Alimento.objects.filter(categoria=categoria)[:cantidad]
+                ]
+            with CaptureQueriesContext(connection) as consultas:
+                recomendacion = RecomendacionSerializer().create(validated_data)
+            return recomendacion, len(consultas)
+
+        _, consultas_cortas = crear(1)
+        larga, consultas_largas = crear(6)
+
+        self.assertEqual(consultas_cortas, consultas_largas)
+        self.assertEqual(larga.almuerzos.count(), 6)
+        self.assertEqual(
+            larga.calorias_totales,
+            sum(item.alimento.calorias for comida in (larga.desayunos, larga.almuerzos, larga.cenas) for item in comida.all())
+        )
+
+
+class MemoRequerimientosTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_reutiliza_hasta_que_cambia_el_historial(self):
+        CalculadoraNutricional._memo.limpiar()
+        nino, historial, parametro = cargar_datos_nino(self.nino.id)
+
+        primero = planificar_recomendacion(nino, historial, parametro)
+        planificar_recomendacion(nino, historial, parametro)
+        self.assertEqual(CalculadoraNutricional.estadisticas_memo()['aciertos'], 1)
+
+        historial.peso = 25
+        historial.save()
+        segundo = planificar_recomendacion(nino, historial, parametro)
+        self.assertEqual(CalculadoraNutricional.estadisticas_memo()['fallos'], 2)
+        self.assertGreater(segundo.requisitos.calorias_totales, primero.requisitos.calorias_totales)
+        self.assertEqual(segundo.fuente()['calculos_personalizados']['tmb_calculada'], 22.6 * 25 + 497)
+
+
+class IndiceParametrosTests(PruebaTestCase):
+
+    def test_solapamientos_y_busqueda_vectorizada(self):
+        parametros = [
+            ParametroReferencia(id=1, edad_min=1, edad_max=3, calorias=1000, proteinas=13, hierro=7, fuente='OMS'),
+            ParametroReferencia(id=2, edad_min=4, edad_max=8, calorias=1400, proteinas=19, hierro=10, fuente='OMS'),
+            ParametroReferencia(id=3, edad_min=7, edad_max=12, calorias=1800, proteinas=34, hierro=8, fuente='OMS'),
+        ]
+        indice = InstantaneaParametros.desde_parametros(reversed(parametros))
+
+        self.assertEqual(indice.solapamientos, ((2, 3),))
+        self.assertEqual(indice.buscar(8).id, 2)
+        self.assertEqual(indice.buscar(9).id, 3)
+        self.assertIsNone(indice.buscar(0))
+        self.assertIsNone(indice.buscar(13))
+        self.assertEqual(
+            [p.id if p else None for p in indice.buscar_varios([0, 1, 3, 4, 7, 12, 13])],
+            [None, 1, 1, 2, 2, 3, None]
+        )
+
+
+class ReglasRecomendadorTests(PruebaTestCase):
+
+    def test_comparador_encuentra_palabras_solapadas(self):
+        comparador = ComparadorPalabras([('pan', 'a'), ('panqueque', 'b'), ('queso', 'c'), ('pure', 'd')])
+        self.assertEqual(comparador.etiquetas('Panqueques con QUESO'), {'a', 'b', 'c'})
+        self.assertEqual(comparador.etiquetas('Puré de papa'), {'d'})
+        self.assertEqual(comparador.etiquetas('sopa'), set())
+
+    def test_rasgos_al_guardar_y_recarga_en_caliente(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = Path(directorio) / 'reglas.json'
+            datos = {"grupos_importantes": ["frutas"], "palabras": {"infantil": ["platano"]}, "enfermedades": []}
+            archivo.write_text(json.dumps(datos))
+            with override_settings(RECOMENDADOR={'REGLAS_ARCHIVO': archivo}):
+                ReglasRecomendador.invalidar()
+                alimento = Alimento.objects.create(
+                    nombre='Plátano', categoria='desayuno', calorias=90, proteinas=1,
+                    grasas=0, carbohidratos=23, grupo_alimenticio='Frutas', alergenos=[]
+                )
+                self.assertTrue(alimento.rasgos['infantil'])
+                self.assertTrue(alimento.rasgos['grupo_importante'])
+                self.assertFalse(alimento.rasgos['textura_suave'])
+
+                datos["palabras"]["infantil"] = ["manzana"]
+                archivo.write_text(json.dumps(datos) + "\n")
+                reglas = ReglasRecomendador.obtener()
+                self.assertNotEqual(reglas.version, alimento.rasgos['version'])
+                self.assertFalse(reglas.rasgos_alimento(alimento.nombre, alimento.grupo_alimenticio)['infantil'])
+        ReglasRecomendador.invalidar()
+
+
+class ProcesadorAlergiasTests(PruebaTestCase):
+
+    def test_sinonimos_sin_tildes_y_cache_por_texto(self):
+        ProcesadorAlergias._cache.limpiar()
+        texto = 'Lactosa; NUEZ, Caseína / atún, kiwi'
+        self.assertEqual(
+            ProcesadorAlergias.procesar_alergias(texto), ['frutos_secos', 'kiwi', 'leche', 'pescado']
+        )
+        ProcesadorAlergias.procesar_alergias(texto)
+        estadisticas = ProcesadorAlergias.estadisticas_cache()
+        self.assertEqual((estadisticas['aciertos'], estadisticas['fallos']), (1, 1))
+
+    def test_mapa_extensible_desde_las_reglas(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = Path(directorio) / 'reglas.json'
+            archivo.write_text(json.dumps({"alergias": {"sesamo": ["ajonjolí", "tahini"]}}))
+            with override_settings(RECOMENDADOR={'REGLAS_ARCHIVO': archivo}):
+                ReglasRecomendador.invalidar()
+                self.assertEqual(ProcesadorAlergias.procesar_alergias('Ajonjoli, Tahini'), ['sesamo'])
+        ReglasRecomendador.invalidar()
+
+    def test_entradas_de_varias_palabras_y_sinonimos(self):
+        casos = {
+            'Leche entera': 'leche',
+            'leche de vaca': 'leche',
+            'Caseína': 'leche',
+            'trazas de nuez': 'frutos_secos',
+            'frutos secos': 'frutos_secos',
+            'Maní tostado': 'mani',
+        }
+        for entrada, alergeno in casos.items():
+            with self.subTest(entrada=entrada):
+                alimento = Alimento(nombre='x', alergenos=[entrada])
+                self.assertIn(alergeno, ProcesadorAlergias.alergenos_de_alimento(alimento))
+
+    def test_indice_excluye_por_palabras_completas(self):
+        comun = dict(categoria='desayuno', calorias=100, proteinas=5, grasas=3, carbohidratos=12)
+        entera = Alimento.objects.create(nombre='Leche', alergenos=['Leche entera'], **comun)
+        declarada_falsa = Alimento.objects.create(nombre='Pan', alergenos={'leche': False}, **comun)
+        CatalogoAlimentos.invalidar()
+        catalogo = CatalogoAlimentos.obtener()
+
+        seguros = {a.id for a in catalogo.alimentos_seguros('desayuno', ['leche'])}
+        self.assertEqual(seguros, {declarada_falsa.id})
+        # Antes bastaba con que el texto JSON contuviera la alergia
+        seguros = {a.id for a in catalogo.alimentos_seguros('desayuno', ['le'])}
+        self.assertEqual(seguros, {entera.id, declarada_falsa.id})
+
+    def test_historial_y_alimento_se_normalizan_igual(self):
+        comun = dict(categoria='desayuno', calorias=100, proteinas=5, grasas=3, carbohidratos=12)
+        nuez = Alimento.objects.create(nombre='Nuez', alergenos=['nuez'], **comun)
+        tortilla = Alimento.objects.create(nombre='Tortilla', alergenos=['huevos'], **comun)
+        pan = Alimento.objects.create(nombre='Pan', alergenos=['trigo'], **comun)
+        CatalogoAlimentos.invalidar()
+        catalogo = CatalogoAlimentos.obtener()
+
+        casos = {
+            'frutos secos': nuez.id,
+            'Frutos Secos': nuez.id,
+            'huevo': tortilla.id,
+            'alergia al huevo': tortilla.id,
+            'Huevos': tortilla.id,
+        }
+        for texto, excluido in casos.items():
+            with self.subTest(texto=texto):
+                alergias = ProcesadorAlergias.procesar_alergias(texto)
+                seguros = {a.id for a in catalogo.alimentos_seguros('desayuno', alergias)}
+                self.assertNotIn(excluido, seguros)
+                self.assertIn(pan.id, seguros)
+
+
+class PuntuacionVectorizadaTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_coincide_con_la_puntuacion_por_alimento(self):
+        comun = dict(categoria='cena', proteinas=4, carbohidratos=10, alergenos=[])
+        Alimento.objects.create(nombre='Puré de pollo', grupo_alimenticio='proteinas', calorias=120, grasas=2, **comun)
+        Alimento.objects.create(nombre='Manteca', grupo_alimenticio='grasas', calorias=90, grasas=9, **comun)
+        Alimento.objects.create(nombre='Agua', grupo_alimenticio='bebidas', calorias=0, grasas=0, **comun)
+        CatalogoAlimentos.invalidar()
+        catalogo = CatalogoAlimentos.obtener()
+
+        for categoria in ('desayuno', 'almuerzo', 'cena'):
+            matriz = catalogo.matrices[categoria]
+            for edad in (3, 7, 12):
+                nutricional, palatabilidad, total, porcion = OptimizadorAlimentos.puntuar_matriz(matriz, 450, edad)
+                for i, alimento in enumerate(matriz.alimentos):
+                    with self.subTest(categoria=categoria, edad=edad, alimento=alimento.nombre):
+                        esperada_n = OptimizadorAlimentos.calcular_puntuacion_nutricional(alimento, 450, 12)
+                        esperada_p = OptimizadorAlimentos.calcular_puntuacion_palatabilidad(alimento, edad)
+                        self.assertEqual(nutricional[i], esperada_n)
+                        self.assertEqual(palatabilidad[i], esperada_p)
+                        self.assertEqual(total[i], esperada_n * 0.7 + esperada_p * 0.3)
+                        self.assertEqual(
+                            porcion[i], min(450 / alimento.calorias if alimento.calorias > 0 else 1, 2.0)
+                        )
+
+
+class GeneracionCohorteTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ninos = [self.nino]
+        for i in range(2):
+            nino = Nino.objects.create(
+                usuario=self.usuario, nombres=f'Hermano {i}', apellido_paterno='Rojas', apellido_materno='Vega',
+                ci=f'20{i + 1}', fecha_nacimiento=date(date.today().year - 5, 1, 1)
+            )
+            HistorialClinico.objects.create(nino=nino, peso=18, talla=1.1, actividad_fisica='alta')
+            self.ninos.append(nino)
+
+    def test_una_recomendacion_por_nino(self):
+        resultado = generar_recomendaciones_cohorte(seleccionar_cohorte(), procesos=1, tamano_lote=2)
+
+        self.assertEqual((resultado.total, resultado.fallos), (3, {}))
+        self.assertEqual(
+            sorted(Recomendacion.objects.filter(id__in=resultado.recomendaciones).values_list('nino_id', flat=True)),
+            [nino.id for nino in self.ninos]
+        )
+
+    def test_un_plan_fallido_no_deshace_su_bloque(self):
+        fallido = self.ninos[1]
+
+        def guardar(plan, motivo):
+            recomendacion = guardar_recomendacion(plan, motivo)
+            if plan.nino.id == fallido.id:
+                raise DatabaseError('fallo al guardar')
+            return recomendacion
+
+        with mock.patch('usuarios.lotes.guardar_recomendacion', side_effect=guardar), \
+                self.assertLogs('usuarios.lotes', 'ERROR'):
+            resultado = generar_recomendaciones_cohorte(self.ninos, procesos=1, tamano_lote=10)
+
+        self.assertEqual(list(resultado.fallos), [fallido.id])
+        self.assertEqual(len(resultado.recomendaciones), 2)
+        # El savepoint del plan fallido deshizo lo que alcanzó a escribir
+        self.assertFalse(Recomendacion.objects.filter(nino=fallido).exists())
+        self.assertEqual(Recomendacion.objects.count(), 2)
+
+
+class OpcionesRecomendacionTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_opciones_distintas_y_ordenadas_por_puntuacion(self):
+        nino, historial, parametro = cargar_datos_nino(self.nino.id)
+        planes = planificar_opciones(nino, historial, parametro, 3)
+
+        self.assertEqual(len(planes), 3)
+        firmas = {
+            tuple(tuple(a.alimento.id for a in plan.comidas[categoria]) for categoria in ('desayuno', 'almuerzo', 'cena'))
+            for plan in planes
+        }
+        self.assertEqual(len(firmas), 3)
+        puntuaciones = [plan.puntuacion_media for plan in planes]
+        self.assertEqual(puntuaciones, sorted(puntuaciones, reverse=True))
+        self.assertEqual([plan.solver['almuerzo']['opcion'] for plan in planes], [1, 2, 3])
+
+        recomendaciones = generar_opciones_recomendacion(self.nino.id, 3)
+        self.assertEqual(
+            [r.motivo for r in recomendaciones], [f"Opción {i} de recomendación automática" for i in (1, 2, 3)]
+        )
+        self.assertEqual(
+            [sorted(r.almuerzos.values_list('alimento_id', flat=True)) for r in recomendaciones],
+            [sorted(a.alimento.id for a in plan.almuerzo) for plan in planes]
+        )
+
+
+class SolverComidaExactoTests(PruebaTestCase):
+
+    def _matriz(self):
+        grupos = ['vegetales', 'frutas', 'proteinas']
+        alimentos = [
+            Alimento(
+                id=i + 1, nombre=f'alimento {i}', categoria='almuerzo', grupo_alimenticio=grupos[i % 3],
+                calorias=60 + 35 * i, proteinas=1 + 2 * i, grasas=2, carbohidratos=10,
+            )
+            for i in range(6)
+        ]
+        return MatrizNutricional.desde_alimentos(alimentos)
+
+    def _greedy(self, matriz):
+        return OptimizadorAlimentos.seleccionar_alimentos_optimizados(
+            'almuerzo', matriz.alimentos, 450, 12, 6, 3, matriz=matriz
+        )
+
+    def test_alcanza_el_optimo_de_la_enumeracion(self):
+        matriz = self._matriz()
+        solver = SolverComidaExacto(matriz, 450, 12, 6, max_alimentos=3, presupuesto_ms=500)
+        seleccion, estadisticas = solver.resolver(self._greedy(matriz))
+
+        # Todas las combinaciones de a lo sumo una opción por grupo dentro de los topes
+        mejor = float('-inf')
+        for eleccion in itertools.product(*[[None] + opciones for opciones in solver.opciones]):
+            elegidas = [opcion for opcion in eleccion if opcion is not None]
+            calorias = sum(o[2] for o in elegidas)
+            proteinas = sum(o[3] for o in elegidas)
+            if len(elegidas) <= 3 and calorias <= solver.tope_calorias and proteinas <= solver.tope_proteinas:
+                mejor = max(mejor, solver._objetivo(calorias, proteinas, len(elegidas), sum(o[4] for o in elegidas)))
+
+        self.assertEqual((estadisticas['estado'], estadisticas['gap']), ('optimo', 0.0))
+        self.assertAlmostEqual(estadisticas['objetivo'], round(mejor, 6))
+        self.assertEqual(len({a.alimento.grupo_alimenticio for a in seleccion}), len(seleccion))
+
+    def test_presupuesto_agotado_conserva_el_greedy(self):
+        matriz = self._matriz()
+        greedy = self._greedy(matriz)
+        seleccion, estadisticas = SolverComidaExacto(matriz, 450, 12, 6, 3, presupuesto_ms=0).resolver(greedy)
+
+        self.assertEqual((estadisticas['estado'], estadisticas['metodo']), ('limite_tiempo', 'greedy'))
+        self.assertEqual(seleccion, greedy)
+
+    def test_presupuesto_acotado_por_configuracion(self):
+        with override_settings(RECOMENDADOR={'PRESUPUESTO_SOLVER_MAX_MS': 100}):
+            self.assertEqual(SolverComidaExacto.presupuesto_efectivo(10 ** 9), 100)
+            self.assertEqual(SolverComidaExacto.presupuesto_efectivo(-5), 0)
+            self.assertEqual(SolverComidaExacto.presupuesto_efectivo(), 50)
+            with self.assertRaises(ValueError):
+                SolverComidaExacto.presupuesto_efectivo(float('nan'))
+
+
+class TrabajosRecomendacionTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RolPersonalizado.objects.get(usuario=self.usuario).permisos.add(
+            Permiso.objects.create(nombre='Ver recomendaciones', codigo='ver_recomendacion'),
+            Permiso.objects.create(nombre='Crear recomendaciones', codigo='crear_recomendacion'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def test_encola_con_202_y_reporta_el_estado(self):
+        respuesta = self.client.post(f'/api/recomendacion/{self.nino.id}/crear/')
+        self.assertEqual(respuesta.status_code, 202)
+        trabajo_id = respuesta.json()["trabajo_id"]
+        self.assertEqual(respuesta.json()["estado"], 'pendiente')
+        self.assertFalse(Recomendacion.objects.exists())
+
+        estado = self.client.get(f'/api/recomendacion/trabajos/{trabajo_id}/').json()
+        self.assertEqual((estado["estado"], estado["recomendacion_id"]), ('pendiente', None))
+
+        procesar_trabajo(tomar_siguiente('prueba'))
+        estado = self.client.get(f'/api/recomendacion/trabajos/{trabajo_id}/').json()
+        self.assertEqual((estado["estado"], estado["progreso"]), ('completado', 100))
+        self.assertEqual(estado["recomendacion_id"], Recomendacion.objects.get().id)
+
+        anonimo = APIClient()
+        self.assertEqual(anonimo.post(f'/api/recomendacion/{self.nino.id}/crear/').status_code, 401)
+        self.assertEqual(anonimo.get(f'/api/recomendacion/trabajos/{trabajo_id}/').status_code, 401)
+
+    def test_cada_trabajo_se_reserva_una_sola_vez(self):
+        primero = encolar_recomendacion(self.nino.id)
+        segundo = encolar_recomendacion(self.nino.id)
+
+        with CaptureQueriesContext(connection) as consultas:
+            tomado = tomar_siguiente('a')
+        self.assertEqual((tomado.id, tomado.estado, tomado.trabajador), (primero.id, 'en_proceso', 'a'))
+        if connection.features.has_select_for_update_skip_locked:
+            self.assertTrue(any('SKIP LOCKED' in q['sql'] for q in consultas))
+
+        self.assertEqual(tomar_siguiente('b').id, segundo.id)
+        self.assertIsNone(tomar_siguiente('c'))
+
+    def test_recupera_trabajos_sin_latido(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        abandonado, largo, anterior, reciente = (encolar_recomendacion(self.nino.id) for _ in range(4))
+        TrabajoRecomendacion.objects.filter(id=abandonado.id).update(
+            estado='en_proceso', trabajador='muerto', fecha_inicio=hace_una_hora, latido=hace_una_hora
+        )
+        # Empezó hace una hora pero sigue latiendo
+        TrabajoRecomendacion.objects.filter(id=largo.id).update(
+            estado='en_proceso', trabajador='lento', fecha_inicio=hace_una_hora, latido=timezone.now()
+        )
+        # Reservado antes de existir el latido
+        TrabajoRecomendacion.objects.filter(id=anterior.id).update(
+            estado='en_proceso', trabajador='viejo', fecha_inicio=hace_una_hora
+        )
+        TrabajoRecomendacion.objects.filter(id=reciente.id).update(
+            estado='en_proceso', trabajador='vivo', fecha_inicio=timezone.now(), latido=timezone.now()
+        )
+
+        self.assertEqual(recuperar_abandonados(), 2)
+        estados = dict(TrabajoRecomendacion.objects.values_list('id', 'estado'))
+        self.assertEqual(estados[abandonado.id], 'pendiente')
+        self.assertEqual(estados[anterior.id], 'pendiente')
+        self.assertEqual(estados[largo.id], 'en_proceso')
+        self.assertEqual(estados[reciente.id], 'en_proceso')
+
+    def test_reservar_y_avanzar_renuevan_el_latido(self):
+        encolar_recomendacion(self.nino.id)
+        trabajo = tomar_siguiente('a')
+        self.assertIsNotNone(trabajo.latido)
+
+        TrabajoRecomendacion.objects.filter(id=trabajo.id).update(latido=timezone.now() - timedelta(hours=1))
+        _progreso(trabajo, 50)
+        self.assertGreater(TrabajoRecomendacion.objects.get(id=trabajo.id).latido, timezone.now() - timedelta(minutes=1))
+
+    def test_trabajo_reasignado_no_se_sobrescribe(self):
+        encolar_recomendacion(self.nino.id)
+        trabajo = tomar_siguiente('a')
+        # Se recuperó por falta de latido y lo tomó otro trabajador
+        TrabajoRecomendacion.objects.filter(id=trabajo.id).update(trabajador='b')
+
+        with self.assertLogs('usuarios.trabajos', 'WARNING'):
+            procesar_trabajo(trabajo)
+        actual = TrabajoRecomendacion.objects.get(id=trabajo.id)
+        self.assertEqual((actual.estado, actual.trabajador, actual.recomendacion_id), ('en_proceso', 'b', None))
+        # El primer avance de progreso corta la generación antes de guardar
+        self.assertFalse(Recomendacion.objects.exists())
+
+    def test_resultado_tardio_se_descarta(self):
+        encolar_recomendacion(self.nino.id)
+        trabajo = tomar_siguiente('a')
+
+        def generar_y_perder(*args, **kwargs):
+            TrabajoRecomendacion.objects.filter(id=trabajo.id).update(trabajador='b')
+            return generar_recomendacion_automatica_mejorada(self.nino.id)
+
+        with mock.patch('usuarios.trabajos.generar_recomendacion_automatica_mejorada', side_effect=generar_y_perder), \
+                self.assertLogs('usuarios.trabajos', 'WARNING'):
+            procesar_trabajo(trabajo)
+        actual = TrabajoRecomendacion.objects.get(id=trabajo.id)
+        self.assertEqual((actual.estado, actual.trabajador, actual.recomendacion_id), ('en_proceso', 'b', None))
+
+        with mock.patch('usuarios.trabajos.generar_recomendacion_automatica_mejorada', side_effect=ValueError('x')), \
+                self.assertLogs('usuarios.trabajos', 'WARNING'):
+            procesar_trabajo(trabajo)
+        self.assertEqual(TrabajoRecomendacion.objects.get(id=trabajo.id).estado, 'en_proceso')
+
+    def test_bucle_sobrevive_a_errores_de_base_de_datos(self):
+        with override_settings(RECOMENDADOR={'TRABAJOS_RECUPERAR_CADA_S': 0}), \
+                mock.patch('usuarios.trabajos.recuperar_abandonados', return_value=0) as recuperar, \
+                mock.patch('usuarios.trabajos.tomar_siguiente', side_effect=[DatabaseError('caída'), None]), \
+                self.assertLogs('usuarios.trabajos', 'ERROR'):
+            self.assertEqual(_bucle_trabajador('prueba', 0, hasta_vaciar=True), 0)
+        # La recuperación corre dentro del bucle, en cada vuelta con intervalo 0
+        self.assertEqual(recuperar.call_count, 2)
+
+
+class VistaPreviaTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RolPersonalizado.objects.get(usuario=self.usuario).permisos.add(
+            Permiso.objects.create(nombre='Ver recomendaciones', codigo='ver_recomendacion'),
+            Permiso.objects.create(nombre='Crear recomendaciones', codigo='crear_recomendacion'),
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def test_requiere_autenticacion_y_permisos(self):
+        token = self.client.get(f'/api/recomendacion/{self.nino.id}/vista-previa/').json()["token"]
+        anonimo = APIClient()
+        self.assertEqual(anonimo.get(f'/api/recomendacion/{self.nino.id}/vista-previa/').status_code, 401)
+        self.assertEqual(anonimo.post('/api/recomendacion/confirmar/', {"token": token}, format='json').status_code, 401)
+
+        Permiso.objects.filter(codigo='crear_recomendacion').delete()
+        respuesta = self.client.post('/api/recomendacion/confirmar/', {"token": token}, format='json')
+        self.assertEqual(respuesta.status_code, 403)
+        self.assertFalse(Recomendacion.objects.exists())
+
+    def test_vista_previa_no_escribe_y_se_confirma_sin_recalcular(self):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(f'/api/recomendacion/{self.nino.id}/vista-previa/')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertFalse([q for q in consultas if not q['sql'].lstrip().upper().startswith('SELECT')])
+        self.assertFalse(Recomendacion.objects.exists())
+
+        datos = respuesta.json()
+        respuesta = self.client.post(
+            '/api/recomendacion/confirmar/', json.dumps({"token": datos["token"]}), content_type='application/json'
+        )
+        self.assertEqual(respuesta.status_code, 201)
+        recomendacion = Recomendacion.objects.get(id=respuesta.json()["recomendacion_id"])
+        self.assertEqual(
+            list(recomendacion.almuerzos.values_list('alimento_id', flat=True)),
+            [a["alimento_id"] for a in datos["plan"]["comidas"]["almuerzo"]]
+        )
+        self.assertAlmostEqual(recomendacion.calorias_totales, datos["plan"]["calorias_totales"])
+
+    def test_token_alterado_u_obsoleto(self):
+        token = self.client.get(f'/api/recomendacion/{self.nino.id}/vista-previa/').json()["token"]
+
+        respuesta = self.client.post(
+            '/api/recomendacion/confirmar/', json.dumps({"token": token[:-2] + "xx"}), content_type='application/json'
+        )
+        self.assertEqual(respuesta.status_code, 400)
+
+        HistorialClinico.objects.get(nino=self.nino).save()
+        respuesta = self.client.post(
+            '/api/recomendacion/confirmar/', json.dumps({"token": token}), content_type='application/json'
+        )
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertFalse(Recomendacion.objects.exists())
+
+    def test_alimento_editado_tras_la_vista_previa(self):
+        datos = self.client.get(f'/api/recomendacion/{self.nino.id}/vista-previa/').json()
+        alimento = Alimento.objects.get(id=datos["plan"]["comidas"]["almuerzo"][0]["alimento_id"])
+        with self.captureOnCommitCallbacks(execute=True):
+            alimento.alergenos = ['leche entera']
+            alimento.save()
+
+        respuesta = self.client.post(
+            '/api/recomendacion/confirmar/', json.dumps({"token": datos["token"]}), content_type='application/json'
+        )
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertFalse(Recomendacion.objects.exists())
+
+
+class PlanSemanalTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_variedad_y_guardado_en_bloque(self):
+        for categoria, _ in Alimento.CATEGORIAS:
+            for i in range(6):
+                Alimento.objects.create(
+                    nombre=f"{categoria} ligero {i}", categoria=categoria, calorias=120, proteinas=0.5,
+                    grasas=1, carbohidratos=25, grupo_alimenticio=f"grupo {i}", alergenos=[]
+                )
+        CatalogoAlimentos.invalidar()
+        nino, historial, parametro = cargar_datos_nino(self.nino.id)
+        planes = planificar_semana(nino, historial, parametro, dias=7, max_repeticiones=3)
+
+        self.assertEqual(len(planes), 7)
+        for categoria in ('desayuno', 'almuerzo', 'cena'):
+            usos = Counter(a.alimento.id for plan in planes for a in plan.comidas[categoria])
+            self.assertLessEqual(max(usos.values()), 3)
+            self.assertFalse(any(plan.solver[categoria]['relajado'] for plan in planes))
+            self.assertGreater(len(usos), 1)
+
+        with CaptureQueriesContext(connection) as consultas:
+            recomendaciones = guardar_semana(planes, "semana", fecha_inicio=date(2025, 3, 3))
+        self.assertLessEqual(len(consultas), 10)
+        self.assertEqual([r.fecha.day for r in recomendaciones], list(range(3, 10)))
+        self.assertEqual(
+            list(recomendaciones[2].cenas.values_list('alimento_id', flat=True)),
+            [a.alimento.id for a in planes[2].cena]
+        )
+        self.assertEqual(LogActividad.objects.filter(modulo='recomendacion').count(), 7)
+
+
+class ReutilizacionRecomendacionTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_entradas_iguales_reutilizan_salvo_forzar(self):
+        primera = generar_recomendacion_automatica_mejorada(self.nino.id)
+        with CaptureQueriesContext(connection) as consultas:
+            segunda = generar_recomendacion_automatica_mejorada(self.nino.id)
+        self.assertEqual(segunda.id, primera.id)
+        self.assertFalse([q for q in consultas if 'INSERT' in q['sql'].upper()])
+
+        forzada = generar_recomendacion_automatica_mejorada(self.nino.id, forzar=True)
+        self.assertNotEqual(forzada.id, primera.id)
+        self.assertEqual(forzada.huella, primera.huella)
+
+        historial = HistorialClinico.objects.get(nino=self.nino)
+        historial.peso = 30
+        historial.save()
+        nueva = generar_recomendacion_automatica_mejorada(self.nino.id)
+        self.assertNotEqual(nueva.huella, primera.huella)
+
+    def test_recomendacion_de_otro_dia_se_copia(self):
+        original = generar_recomendacion_automatica_mejorada(self.nino.id)
+        Recomendacion.objects.filter(id=original.id).update(fecha=date(2024, 1, 1))
+
+        copia = generar_recomendacion_automatica_mejorada(self.nino.id)
+        self.assertNotEqual(copia.id, original.id)
+        self.assertEqual(copia.fuente["reutiliza_recomendacion"], original.id)
+        self.assertEqual(
+            list(copia.almuerzos.values_list('alimento_id', flat=True)),
+            list(original.almuerzos.values_list('alimento_id', flat=True))
+        )
+
+
+class MedicionEtapasTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_sin_medicion_no_hay_perf(self):
+        recomendacion = generar_recomendacion_automatica_mejorada(self.nino.id)
+        self.assertNotIn("perf", recomendacion.fuente)
+
+    @override_settings(RECOMENDADOR={'MEDIR_ETAPAS': True})
+    def test_perf_por_etapa_en_fuente(self):
+        with self.assertLogs('usuarios.recomendador', level='INFO') as logs:
+            recomendacion = generar_recomendacion_automatica_mejorada(self.nino.id)
+        recomendacion.refresh_from_db()
+
+        perf = recomendacion.fuente["perf"]
+        self.assertEqual(set(perf["etapas"]), {
+            'carga_datos', 'reutilizacion', 'requerimientos', 'catalogo', 'alergias',
+            'puntuacion', 'validacion', 'persistencia'
+        })
+        self.assertGreater(perf["etapas"]["carga_datos"]["consultas"], 0)
+        self.assertGreater(perf["etapas"]["persistencia"]["consultas"], 0)
+        self.assertTrue(any("Etapas de generación" in linea for linea in logs.output))
+
+        otra = generar_recomendacion_automatica_mejorada(self.nino.id, forzar=True)
+        agregado = resumir_perf([recomendacion.fuente, otra.fuente, {}])
+        self.assertEqual(agregado["total"]["n"], 2)
+        self.assertEqual(agregado["puntuacion"]["n"], 2)
+
+
+class MetricasTests(PruebaTestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directorio.cleanup)
+        ajustes = override_settings(METRICAS={
+            'DIRECTORIO': self.directorio.name, 'INTERVALO_ESCRITURA_S': 0, 'TOKEN': 'secreto'
+        })
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        RegistroMetricas.reiniciar()
+        self.autorizacion = {'HTTP_AUTHORIZATION': 'Bearer secreto'}
+
+    def test_histogramas_por_vista_y_workers(self):
+        self.client.get('/api/usuarios/alimentos/')
+        self.client.get('/api/usuarios/alimentos/')
+        # Archivo de un worker que ya terminó, con una petición a la misma vista
+        terminado = Path(self.directorio.name) / 'metricas_999999_0a1b2c.json'
+        terminado.write_text(json.dumps({
+            'duracion': [[['AlimentoViewSet.list', 'GET', '401'], [1] + [0] * 10 + [0.001, 1]]],
+        }))
+
+        respuesta = self.client.get('/metrics', **self.autorizacion)
+
+        self.assertEqual(respuesta.status_code, 200)
+        texto = respuesta.content.decode()
+        etiquetas = 'view="AlimentoViewSet.list",method="GET",status="401"'
+        self.assertIn(f'nutricion_http_request_duration_seconds_count{{{etiquetas}}} 3', texto)
+        self.assertIn(f'nutricion_http_request_db_queries_count{{{etiquetas}}} 2', texto)
+        self.assertIn(f'nutricion_http_request_duration_seconds_bucket{{{etiquetas},le="+Inf"}} 3', texto)
+        self.assertNotIn('view="metricas"', texto)
+
+        # Se plegó en el archivo de terminados: se borra sin perder su conteo
+        self.assertFalse(terminado.exists())
+        self.assertEqual(
+            sorted(p.name for p in Path(self.directorio.name).glob('metricas_*.json')),
+            sorted([ARCHIVO_TERMINADOS, f'metricas_{os.getpid()}_{RegistroMetricas._instancia}.json'])
+        )
+        texto = self.client.get('/metrics', **self.autorizacion).content.decode()
+        self.assertIn(f'nutricion_http_request_duration_seconds_count{{{etiquetas}}} 3', texto)
+
+    def test_acceso_restringido(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer otro').status_code, 403)
+        respuesta = self.client.get('/metrics', REMOTE_ADDR='10.0.0.8', **self.autorizacion)
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_sin_token_se_niega_incluso_desde_localhost(self):
+        with override_settings(METRICAS={'DIRECTORIO': self.directorio.name}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+                self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.8').status_code, 403)
+
+
+class BenchmarkTests(PruebaTestCase):
+
+    def test_informe_por_etapa(self):
+        informe = ejecutar_benchmark(tamanos=[300], repeticiones=2, num_ninos=3)
+
+        medidas = informe['resultados']['300']
+        self.assertEqual(Alimento.objects.count(), 300)
+        # Las etapas de la medición de producción (fuente['perf']), no una copia del pipeline
+        self.assertEqual(set(medidas['generar']['etapas']), {
+            'carga_datos', 'reutilizacion', 'requerimientos', 'catalogo', 'alergias', 'puntuacion',
+            'validacion', 'persistencia'
+        })
+        self.assertEqual(set(medidas['opciones']['etapas']), {
+            'carga_datos', 'requerimientos', 'catalogo', 'alergias', 'puntuacion', 'validacion', 'persistencia'
+        })
+        self.assertEqual(medidas['generar']['total']['n'], 2)
+        self.assertGreater(medidas['generar']['etapas']['persistencia']['consultas_media'], 0)
+        self.assertGreaterEqual(medidas['opciones']['total']['p95_ms'], medidas['opciones']['total']['p50_ms'])
+        self.assertGreater(medidas['generar']['memoria_pico_kb'], 0)
+        json.dumps(informe)
+
+    def test_siembra_versiona_una_vez_por_tabla(self):
+        sembrar_datos(50, 2)
+        with mock.patch('usuarios.signals.incrementar_version') as por_fila, \
+                mock.patch('usuarios.benchmark.incrementar_version') as por_tabla:
+            sembrar_datos(50, 2)
+        # Borrar los 50 alimentos anteriores no emite un post_delete por fila
+        por_fila.assert_not_called()
+        self.assertEqual(sorted(c.args[0].__name__ for c in por_tabla.call_args_list), ['Alimento', 'ParametroReferencia'])
+        self.assertTrue(post_delete.has_listeners(Alimento))
+        self.assertTrue(post_delete.has_listeners(ParametroReferencia))
+
+    def test_opciones_vacias(self):
+        with mock.patch('usuarios.benchmark.generar_opciones_recomendacion', return_value=[]):
+            with self.assertRaisesMessage(ValueError, 'no devolvió opciones'):
+                ejecutar_benchmark(tamanos=[300], repeticiones=1, num_ninos=2)
+
+
+class HistorialRecienteTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_anotado_igual_que_por_fila(self):
+        HistorialClinico.objects.create(
+            nino=self.nino, peso=21, talla=1.16, actividad_fisica='media', alergias='mani', enfermedades='asma'
+        )
+        sin_historial = Nino.objects.create(
+            usuario=self.usuario, nombres='Eva', apellido_paterno='Rojas', apellido_materno='Vega',
+            ci='201', fecha_nacimiento=date(2019, 1, 1)
+        )
+
+        por_fila = NinoSerializer(Nino.objects.order_by('id'), many=True).data
+        with self.assertNumQueries(1):
+            anotado = NinoSerializer(Nino.objects.con_historial_reciente().order_by('id'), many=True).data
+
+        self.assertEqual(anotado, por_fila)
+        self.assertEqual((anotado[0]['alergias'], anotado[0]['enfermedades']), ('mani', 'asma'))
+        self.assertEqual(anotado[1]['alergias'], 'No registradas')
+        self.assertEqual(anotado[1]['id'], sin_historial.id)
+
+    def test_empate_de_fecha_se_resuelve_por_id_en_todos_los_caminos(self):
+        reciente = HistorialClinico.objects.create(
+            nino=self.nino, peso=21, talla=1.16, actividad_fisica='media', alergias='mani'
+        )
+        HistorialClinico.objects.filter(nino=self.nino).update(fecha_actualizacion=timezone.now())
+
+        _, historial, _ = cargar_datos_nino(self.nino.id)
+        self.assertEqual(historial.id, reciente.id)
+        self.assertEqual(_historiales_recientes([self.nino])[self.nino.id].id, reciente.id)
+        self.assertEqual(NinoSerializer(Nino.objects.con_historial_reciente().get(id=self.nino.id)).data['alergias'], 'mani')
+
+
+class RecomendacionListadoTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def test_listado_con_consultas_fijas(self):
+        for _ in range(3):
+            generar_recomendacion_automatica_mejorada(self.nino.id, forzar=True)
+        queryset = RecomendacionSerializer.optimizar_consulta(Recomendacion.objects.order_by('id'))
+
+        # Recomendaciones, niños, desayunos, almuerzos y cenas
+        with self.assertNumQueries(5):
+            datos = RecomendacionSerializer(queryset, many=True).data
+
+        self.assertEqual(len(datos), 3)
+        self.assertEqual(datos[0]['nino_details']['alergias'], 'lactosa')
+        self.assertEqual(datos, RecomendacionSerializer(Recomendacion.objects.order_by('id'), many=True).data)
+
+
+class FormaRespuestaTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RolPersonalizado.objects.get(usuario=self.usuario).permisos.add(
+            Permiso.objects.create(nombre='Ver recomendaciones', codigo='ver_recomendacion')
+        )
+        for _ in range(3):
+            generar_recomendacion_automatica_mejorada(self.nino.id, forzar=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def _listar(self, **parametros):
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get('/api/usuarios/recomendaciones/', parametros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta.json()['results'], len(consultas)
+
+    def test_campos_y_expansion_adaptan_la_consulta(self):
+        completa, consultas_completa = self._listar()
+        self.assertIn('nino_details', completa[0])
+        self.assertIsInstance(completa[0]['desayunos'][0]['alimento'], dict)
+
+        ligera, consultas_ligera = self._listar(fields='id,fecha,calorias_totales')
+        self.assertEqual(set(ligera[0]), {'id', 'fecha', 'calorias_totales'})
+        # Sin niños, desayunos, almuerzos ni cenas
+        self.assertEqual(consultas_ligera, consultas_completa - 4)
+
+        desayunos, consultas_desayunos = self._listar(fields='id', expand='desayunos')
+        self.assertEqual(set(desayunos[0]), {'id', 'desayunos'})
+        self.assertIsInstance(desayunos[0]['desayunos'][0]['alimento'], int)
+        self.assertEqual(consultas_desayunos, consultas_ligera + 1)
+
+        anidada, _ = self._listar(fields='id,desayunos.alimento.nombre', expand='desayunos.alimento')
+        self.assertEqual(anidada[0]['desayunos'][0], {'alimento': {'nombre': completa[0]['desayunos'][0]['alimento']['nombre']}})
+
+    def test_rol_con_permisos_y_campos(self):
+        permiso = Permiso.objects.get(codigo='ver_recomendacion')
+        serializer = RolPersonalizadoSerializer(data={'usuario': self.usuario.id, 'rol': 'medico', 'permiso_ids': [permiso.id]})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        rol = serializer.save()
+        self.assertEqual(list(rol.permisos.all()), [permiso])
+
+        consulta = RolPersonalizadoSerializer.optimizar_consulta(RolPersonalizado.objects.filter(id=rol.id))
+        with self.assertNumQueries(2):
+            self.assertEqual(RolPersonalizadoSerializer(consulta, many=True).data[0]['permisos'][0]['id'], permiso.id)
+
+
+class GetCondicionalTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RolPersonalizado.objects.get(usuario=self.usuario).permisos.add(
+            Permiso.objects.create(nombre='Ver alimentos', codigo='ver_alimento')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def test_304_sin_consultar_la_tabla(self):
+        primera = self.client.get('/api/usuarios/alimentos/')
+        self.assertEqual(primera.status_code, 200)
+        etag = primera['ETag']
+
+        with CaptureQueriesContext(connection) as consultas:
+            repetida = self.client.get('/api/usuarios/alimentos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repetida.status_code, 304)
+        self.assertEqual(repetida['ETag'], etag)
+        self.assertFalse([q for q in consultas if 'usuarios_alimento' in q['sql']])
+
+        # Otra forma de la respuesta, otro ETag
+        self.assertNotEqual(self.client.get('/api/usuarios/alimentos/', {'fields': 'id'})['ETag'], etag)
+
+        alimento = Alimento.objects.first()
+        alimento.calorias += 1
+        # incrementar_version publica al confirmar; los TestCase nunca confirman
+        with self.captureOnCommitCallbacks(execute=True):
+            alimento.save()
+        cambiada = self.client.get('/api/usuarios/alimentos/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cambiada.status_code, 200)
+        self.assertNotEqual(cambiada['ETag'], etag)
+
+    def test_cambiar_las_reglas_invalida_el_etag(self):
+        Alimento.objects.create(
+            nombre='Almendras', categoria='cena', calorias=200, proteinas=7, grasas=17,
+            carbohidratos=6, grupo_alimenticio='grasas', alergenos=['almendra']
+        )
+        url = '/api/usuarios/alimentos/'
+        parametros = {'paginar': 0, 'sin_alergenos': 'frutos secos'}
+        self.addCleanup(ReglasRecomendador.invalidar)
+        with tempfile.TemporaryDirectory() as directorio:
+            archivo = Path(directorio) / 'reglas.json'
+            archivo.write_text(json.dumps({"alergias": {"frutos_secos": ["nuez"]}}))
+            with override_settings(RECOMENDADOR={'REGLAS_ARCHIVO': archivo}):
+                ReglasRecomendador.invalidar()
+                primera = self.client.get(url, parametros)
+                self.assertIn('Almendras', {a['nombre'] for a in primera.json()})
+
+                # 'almendra' pasa a ser frutos secos: misma tabla, otra respuesta
+                archivo.write_text(json.dumps({"alergias": {"frutos_secos": ["nuez", "almendra"]}}))
+                segunda = self.client.get(url, parametros, HTTP_IF_NONE_MATCH=primera['ETag'])
+                self.assertEqual(segunda.status_code, 200)
+                self.assertNotEqual(segunda['ETag'], primera['ETag'])
+                self.assertNotIn('Almendras', {a['nombre'] for a in segunda.json()})
+
+
+class FiltrosAlimentoTests(DatosRecomendadorMixin, PruebaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RolPersonalizado.objects.get(usuario=self.usuario).permisos.add(
+            Permiso.objects.create(nombre='Ver alimentos', codigo='ver_alimento')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.usuario)
+
+    def _nombres(self, **parametros):
+        respuesta = self.client.get('/api/usuarios/alimentos/', {'paginar': 0, **parametros})
+        self.assertEqual(respuesta.status_code, 200)
+        return {alimento['nombre'] for alimento in respuesta.json()}
+
+    def test_filtros_y_busqueda(self):
+        Alimento.objects.create(
+            nombre='Queso fresco', categoria='cena', calorias=250, proteinas=14, grasas=18,
+            carbohidratos=2, grupo_alimenticio='lacteos', alergenos=['Lactosa']
+        )
+        self.assertTrue(self._nombres(categoria='cena', grupo='lacteos'))
+        self.assertEqual(self._nombres(buscar='QUESO'), {'Queso fresco'})
+        self.assertNotIn('Queso fresco', self._nombres(calorias_max=200))
+        self.assertIn('Queso fresco', self._nombres(calorias_min=240, proteinas_min=10))
+
+        # 'leche' excluye también sus sinónimos ('Lactosa', ...), con las reglas del recomendador
+        self.assertNotIn('Queso fresco', self._nombres(sin_alergenos='leche'))
+        self.assertEqual(self._nombres(sin_alergenos='leche'), {
+            alimento.nombre for alimento in Alimento.objects.all()
+            if 'leche' not in ProcesadorAlergias.alergenos_de_alimento(alimento)
+        })
+
+        self.assertEqual(
+            self.client.get('/api/usuarios/alimentos/', {'calorias_min': 'mucho'}).status_code, 400
+        )
+
+    def test_no_expone_rasgos(self):
+        alimento = Alimento.objects.first()
+        respuesta = self.client.get(f'/api/usuarios/alimentos/{alimento.id}/')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('alergenos', respuesta.json())
+        self.assertNotIn('rasgos', respuesta.json())
+
+    def test_alergenos_con_tildes(self):
+        Alimento.objects.create(
+            nombre='Turrón', categoria='almuerzo', calorias=400, proteinas=8, grasas=20,
+            carbohidratos=50, grupo_alimenticio='dulces', alergenos=['Maní tostado']
+        )
+        self.assertIn('Turrón', self._nombres())
+        self.assertNotIn('Turrón', self._nombres(sin_alergenos='maní'))
+        self.assertNotIn('Turrón', self._nombres(sin_alergenos='MANI'))
+        # Palabras completas: 'man' no es 'maní'
+        self.assertIn('Turrón', self._nombres(sin_alergenos='man'))
+
+    def test_alergenos_de_varias_palabras_y_plurales(self):
+        comun = dict(categoria='almuerzo', calorias=300, proteinas=8, grasas=10, carbohidratos=30)
+        Alimento.objects.create(nombre='Nuez pecana', grupo_alimenticio='grasas', alergenos=['nuez'], **comun)
+        Alimento.objects.create(nombre='Tortilla', grupo_alimenticio='proteinas', alergenos=['huevos'], **comun)
+
+        self.assertNotIn('Nuez pecana', self._nombres(sin_alergenos='frutos secos'))
+        self.assertIn('Tortilla', self._nombres(sin_alergenos='frutos secos'))
+        self.assertNotIn('Tortilla', self._nombres(sin_alergenos='huevo'))
+        self.assertIn('Nuez pecana', self._nombres(sin_alergenos='huevo'))
+        self.assertFalse({'Nuez pecana', 'Tortilla'} & self._nombres(sin_alergenos='frutos secos, huevo'))
+
+    def test_plan_usa_el_indice_compuesto(self):
+        indice = Alimento._meta.indexes[0].name
+        plan = Alimento.objects.filter(categoria='cena', grupo_alimenticio='lacteos').explain()
+        self.assertIn(indice, plan)
+
+    @skipUnless(connection.vendor == 'postgresql', "El índice de trigramas solo existe en PostgreSQL")
+    def test_plan_busqueda_usa_trigramas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Alimento.objects.filter(nombre__icontains='arroz').explain()
+        self.assertIn('usuarios_alimento_nombre_trgm', plan)
+
+
+class PaginacionCursorTests(PruebaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user(
+            correo='admin@example.com', password='clave', nombres='Admin',
+            apellido_paterno='Sistema', apellido_materno='Sistema', ci='1'
+        )
+        RolPersonalizado.objects.create(usuario=cls.admin, rol='admin').permisos.set(
+            [Permiso.objects.create(nombre='Ver logs', codigo='ver_logactividad')]
+        )
+        LogActividad.objects.bulk_create(
+            LogActividad(usuario=cls.admin, rol='admin', accion=f'accion {i}', modulo='pruebas', descripcion='')
+            for i in range(7)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_paginas_estables_ante_inserciones(self):
+        primera = self.client.get('/api/usuarios/logs/', {'page_size': 3}).json()
+        self.assertEqual(len(primera['results']), 3)
+
+        LogActividad.objects.create(usuario=self.admin, rol='admin', accion='nueva', modulo='pruebas', descripcion='')
+        vistos = [log['id'] for log in primera['results']]
+        siguiente = primera['next']
+        while siguiente:
+            pagina = self.client.get(siguiente).json()
+            vistos += [log['id'] for log in pagina['results']]
+            siguiente = pagina['next']
+
+        esperados = list(LogActividad.objects.exclude(accion='nueva').order_by('-fecha_hora', '-id').values_list('id', flat=True))
+        self.assertEqual(vistos, esperados)
+
+    def test_historiales_estables_ante_ediciones(self):
+        RolPersonalizado.objects.get(usuario=self.admin).permisos.add(
+            Permiso.objects.create(nombre='Ver historiales', codigo='ver_historialclinico')
+        )
+        nino = Nino.objects.create(
+            usuario=self.admin, nombres='Eva', apellido_paterno='Paz', apellido_materno='Paz',
+            ci='300', fecha_nacimiento=date(2019, 1, 1)
+        )
+        historiales = [
+            HistorialClinico.objects.create(nino=nino, peso=20, talla=1.1, actividad_fisica='media')
+            for _ in range(5)
+        ]
+
+        primera = self.client.get('/api/usuarios/historiales/', {'page_size': 2}).json()
+        # Editar uno que aún no se listó no debe sacarlo de las páginas siguientes
+        historiales[0].save()
+        vistos = [h['id'] for h in primera['results']]
+        siguiente = primera['next']
+        while siguiente:
+            pagina = self.client.get(siguiente).json()
+            vistos += [h['id'] for h in pagina['results']]
+            siguiente = pagina['next']
+
+        self.assertEqual(vistos, sorted((h.id for h in historiales), reverse=True))
+
+    @override_settings(PAGINACION={'TAMANO_MAXIMO': 4, 'SIN_PAGINAR_MAXIMO': 5})
+    def test_limites_y_sin_paginar(self):
+        self.assertEqual(len(self.client.get('/api/usuarios/logs/', {'page_size': 100}).json()['results']), 4)
+
+        sin_paginar = self.client.get('/api/usuarios/logs/', {'paginar': 0}).json()
+        self.assertIsInstance(sin_paginar, list)
+        self.assertEqual(len(sin_paginar), 5)
+
+
+class ConsultasPorRutaTests(PruebaTestCase):
+    """
+    Cada ruta del router debe hacer las mismas consultas con pocos y con muchos
+    registros; si no, falla mostrando las consultas que crecen con el listado.
+    """
+
+    TAMANOS = (2, 6)
+    # N+1 conocidos, pendientes de corregir en sus viewsets
+    PENDIENTES = set()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_user(
+            correo='admin@example.com', password='clave', nombres='Admin',
+            apellido_paterno='Sistema', apellido_materno='Sistema', ci='1'
+        )
+        rol = RolPersonalizado.objects.create(usuario=cls.admin, rol='admin')
+        rol.permisos.set(
+            Permiso.objects.create(nombre=f'Ver {modelo}', codigo=f'ver_{modelo}')
+            for modelo in {viewset.queryset.model._meta.model_name for _, viewset, _ in router.registry}
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.creados = 0
+
+    def _sembrar_hasta(self, cantidad):
+        """Crea registros de cada modelo hasta tener `cantidad` de cada uno"""
+        for i in range(self.creados, cantidad):
+            usuario = Usuario.objects.create_user(
+                correo=f'tutor{i}@example.com', password='clave', nombres='Tutor',
+                apellido_paterno='P', apellido_materno='M', ci=f'u{i}'
+            )
+            RolPersonalizado.objects.create(usuario=usuario, rol='padre').permisos.set(
+                [Permiso.objects.create(nombre=f'Extra {i}', codigo=f'extra_{i}')]
+            )
+            nino = Nino.objects.create(
+                usuario=usuario, nombres='Niño', apellido_paterno='P', apellido_materno='M',
+                ci=f'n{i}', fecha_nacimiento=date(2018, 1, 1)
+            )
+            HistorialClinico.objects.create(nino=nino, peso=20, talla=1.1, actividad_fisica='media')
+            LogActividad.objects.create(usuario=usuario, rol='padre', accion='crear', modulo='ninos', descripcion='')
+            ParametroReferencia.objects.create(
+                edad_min=i, edad_max=i, calorias=1400, proteinas=19, hierro=10, fuente='OMS'
+            )
+            alimentos = [
+                Alimento.objects.create(
+                    nombre=f'{categoria} {i}', categoria=categoria, calorias=300, proteinas=8,
+                    grasas=5, carbohidratos=40, grupo_alimenticio='cereales', alergenos=[]
+                )
+                for categoria in ('desayuno', 'almuerzo', 'cena')
+            ]
+            recomendacion = Recomendacion.objects.create(
+                nino=nino, fecha=date.today(), motivo='prueba', fuente={}
+            )
+            recomendacion.agregar_alimentos(
+                desayunos=alimentos[:1], almuerzos=alimentos[1:2], cenas=alimentos[2:]
+            )
+        self.creados = max(self.creados, cantidad)
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as capturadas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200, url)
+        return [consulta['sql'] for consulta in capturadas]
+
+    @staticmethod
+    def _diferencia(pocas, muchas):
+        """Plantillas de SQL (sin literales) que se ejecutan más veces con más registros"""
+        plantilla = lambda sql: re.sub(r"\b\d+\b|'[^']*'", '?', sql)
+        antes, despues = Counter(map(plantilla, pocas)), Counter(map(plantilla, muchas))
+        return '\n'.join(
+            f'  {antes[sql]} -> {veces}: {sql}' for sql, veces in despues.items() if veces > antes[sql]
+        )
+
+    def test_consultas_constantes_por_ruta(self):
+        rutas = [prefijo for prefijo, _, _ in router.registry if prefijo not in self.PENDIENTES]
+        medidas = []
+        for tamano in self.TAMANOS:
+            self._sembrar_hasta(tamano)
+            medidas.append({
+                prefijo: {
+                    'list': self._consultas(f'/api/usuarios/{prefijo}/'),
+                    'retrieve': self._consultas(f'/api/usuarios/{prefijo}/{self._primer_id(prefijo)}/'),
+                }
+                for prefijo in rutas
+            })
+
+        pocas, muchas = medidas
+        for prefijo in rutas:
+            for accion in ('list', 'retrieve'):
+                with self.subTest(ruta=prefijo, accion=accion):
+                    self.assertEqual(
+                        len(pocas[prefijo][accion]), len(muchas[prefijo][accion]),
+                        f'{prefijo} {accion}: las consultas crecen con {self.TAMANOS}:\n'
+                        + self._diferencia(pocas[prefijo][accion], muchas[prefijo][accion])
+                    )
+
+    @staticmethod
+    def _primer_id(prefijo):
+        viewset = next(viewset for registrado, viewset, _ in router.registry if registrado == prefijo)
+        return viewset.queryset.model.objects.order_by('id').values_list('id', flat=True).first()
@@ -0,0 +1,248 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import Nino, TrabajoRecomendacion
+from .recomendador import generar_recomendacion_automatica_mejorada
+
+logger = logging.getLogger(__name__)
+
+
+def _configuracion(clave: str, por_defecto):
+    return getattr(settings, 'RECOMENDADOR', {}).get(clave, por_defecto)
+
+
+class TrabajoReasignado(Exception):
+    """El trabajo se devolvió a la cola (sin latido) y ya no es de este trabajador"""
+
+
+def encolar_recomendacion(
+    nino_id: int,
+    motivo: str = "Recomendación automática generada",
+    preferencias_usuario: Optional[Dict] = None
+) -> TrabajoRecomendacion:
+    """Registra un trabajo pendiente; lanza Nino.DoesNotExist si el niño no existe"""
+    nino = Nino.objects.get(id=nino_id)
+    return TrabajoRecomendacion.objects.create(
+        nino=nino, motivo=motivo, preferencias=preferencias_usuario
+    )
+
+
+def tomar_siguiente(trabajador: str) -> Optional[TrabajoRecomendacion]:
+    """
+    Reserva el trabajo pendiente más antiguo para este trabajador.
+
+    En PostgreSQL, SELECT FOR UPDATE SKIP LOCKED hace que cada trabajador salte
+    las filas que otro está reservando. La reserva es además un UPDATE
+    condicionado al estado 'pendiente', así que ni siquiera en bases sin
+    SELECT FOR UPDATE (SQLite) dos trabajadores toman el mismo trabajo.
+    """
+    while True:
+        with transaction.atomic():
+            trabajo_id = (
+                TrabajoRecomendacion.objects.select_for_update(skip_locked=True)
+                .filter(estado='pendiente')
+                .order_by('fecha_creacion', 'id')
+                .values_list('id', flat=True)
+                .first()
+            )
+            if trabajo_id is None:
+                return None
+            reservado = TrabajoRecomendacion.objects.filter(id=trabajo_id, estado='pendiente').update(
+                estado='en_proceso', trabajador=trabajador, fecha_inicio=now(), latido=now(), progreso=0
+            )
+        if reservado:
+            return TrabajoRecomendacion.objects.get(id=trabajo_id)
+
+
+def _propio(trabajo: TrabajoRecomendacion):
+    """El trabajo, solo si sigue 'en_proceso' a nombre de quien lo reservó"""
+    return TrabajoRecomendacion.objects.filter(
+        id=trabajo.id, trabajador=trabajo.trabajador, estado='en_proceso'
+    )
+
+
+def _progreso(trabajo: TrabajoRecomendacion, porcentaje: int) -> None:
+    if not _propio(trabajo).update(progreso=porcentaje, latido=now()):
+        raise TrabajoReasignado(f"Trabajo {trabajo.id} reasignado")
+
+
+def _latir(trabajo: TrabajoRecomendacion, detener: threading.Event, intervalo: float) -> None:
+    try:
+        while not detener.wait(intervalo):
+            try:
+                _propio(trabajo).update(latido=now())
+            except DatabaseError as e:
+                logger.error(f"Trabajo {trabajo.id}: no se pudo renovar el latido: {str(e)}")
+    finally:
+        # Conexiones propias de este hilo
+        connections.close_all()
+
+
+@contextmanager
+def _latiendo(trabajo: TrabajoRecomendacion):
+    """Renueva el latido del trabajo en un hilo mientras se procesa"""
+    detener = threading.Event()
+    hilo = threading.Thread(
+        target=_latir, args=(trabajo, detener, _configuracion('TRABAJOS_LATIDO_S', 30)),
+        name=f"latido-{trabajo.id}", daemon=True,
+    )
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def procesar_trabajo(trabajo: TrabajoRecomendacion) -> None:
+    """
+    Ejecuta el generador para un trabajo reservado y registra su resultado.
+
+    Si las entradas no cambiaron desde una generación anterior se reutiliza su
+    resultado, salvo que las preferencias traigan 'forzar'.
+
+    El resultado solo se registra si el trabajo sigue a nombre de este
+    trabajador: si se recuperó por falta de latido y lo tomó otro, el avance
+    de progreso interrumpe la generación y un resultado tardío se descarta
+    (el otro trabajador reutilizará la recomendación si llegó a guardarse).
+    """
+    preferencias = dict(trabajo.preferencias or {})
+    forzar = preferencias.pop('forzar', False)
+    try:
+        with _latiendo(trabajo):
+            recomendacion = generar_recomendacion_automatica_mejorada(
+                trabajo.nino_id, trabajo.motivo, preferencias, forzar=forzar,
+                progreso=lambda porcentaje: _progreso(trabajo, porcentaje),
+            )
+    except TrabajoReasignado:
+        logger.warning(f"Trabajo {trabajo.id} reasignado mientras lo procesaba {trabajo.trabajador}; se abandona")
+        return
+    except Exception as e:
+        logger.error(f"Trabajo {trabajo.id} falló para niño {trabajo.nino_id}: {str(e)}")
+        if not _propio(trabajo).update(estado='error', error=str(e), fecha_fin=now()):
+            logger.warning(f"Trabajo {trabajo.id} reasignado; no se registra el error")
+        return
+
+    if not _propio(trabajo).update(
+        estado='completado', progreso=100, recomendacion=recomendacion, fecha_fin=now()
+    ):
+        logger.warning(f"Trabajo {trabajo.id} reasignado; se descarta la recomendación {recomendacion.id}")
+        return
+    logger.info(f"Trabajo {trabajo.id} completado: recomendación {recomendacion.id}")
+
+
+def recuperar_abandonados() -> int:
+    """
+    Devuelve a la cola los trabajos 'en_proceso' sin latido en el tiempo máximo.
+
+    Un trabajo largo pero vivo no se recupera: su trabajador renueva el
+    latido cada TRABAJOS_LATIDO_S. Los reservados antes de existir el latido
+    se juzgan por fecha_inicio.
+    """
+    limite = now() - timedelta(seconds=_configuracion('TRABAJOS_TIEMPO_MAXIMO_S', 600))
+    return TrabajoRecomendacion.objects.filter(
+        Q(latido__lt=limite) | Q(latido__isnull=True, fecha_inicio__lt=limite),
+        estado='en_proceso',
+    ).update(estado='pendiente', trabajador='', fecha_inicio=None, latido=None, progreso=0)
+
+
+def _recuperar_y_avisar() -> None:
+    recuperados = recuperar_abandonados()
+    if recuperados:
+        logger.warning(f"{recuperados} trabajos abandonados devueltos a la cola")
+
+
+def _bucle_trabajador(nombre: str, intervalo: float, hasta_vaciar: bool) -> int:
+    """
+    Toma y procesa trabajos hasta vaciar la cola (o indefinidamente).
+
+    Cada TRABAJOS_RECUPERAR_CADA_S segundos devuelve a la cola los trabajos
+    abandonados, también los de otros trabajadores que murieron. Un error de
+    base de datos no termina el bucle: se registra, se descartan las
+    conexiones y se reintenta tras `intervalo`.
+    """
+    cada = _configuracion('TRABAJOS_RECUPERAR_CADA_S', 60)
+    ultima_recuperacion = time.monotonic()
+    procesados = 0
+    while True:
+        try:
+            if time.monotonic() - ultima_recuperacion >= cada:
+                ultima_recuperacion = time.monotonic()
+                _recuperar_y_avisar()
+            trabajo = tomar_siguiente(nombre)
+            if trabajo is not None:
+                procesar_trabajo(trabajo)
+                procesados += 1
+                continue
+        except DatabaseError as e:
+            logger.error(f"Trabajador {nombre}: error de base de datos, se reintenta: {str(e)}")
+            for conexion in connections.all():
+                conexion.close_if_unusable_or_obsolete()
+            time.sleep(intervalo)
+            continue
+
+        if hasta_vaciar:
+            return procesados
+        time.sleep(intervalo)
+
+
+def _proceso_trabajador(nombre: str, intervalo: float, hasta_vaciar: bool) -> None:
+    # Cada proceso abre sus propias conexiones
+    for conexion in connections.all():
+        conexion.close()
+    try:
+        _bucle_trabajador(nombre, intervalo, hasta_vaciar)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connections.close_all()
+
+
+def ejecutar_trabajadores(
+    concurrencia: Optional[int] = None,
+    intervalo: Optional[float] = None,
+    hasta_vaciar: bool = False
+) -> None:
+    """
+    Procesa la cola con `concurrencia` procesos en paralelo.
+
+    Con hasta_vaciar=True termina cuando no quedan trabajos pendientes; si no,
+    consulta la cola cada `intervalo` segundos indefinidamente.
+    """
+    concurrencia = concurrencia or _configuracion('TRABAJOS_CONCURRENCIA', 2)
+    intervalo = intervalo if intervalo is not None else _configuracion('TRABAJOS_INTERVALO_S', 1.0)
+    base = f"{socket.gethostname()}:{os.getpid()}"
+
+    _recuperar_y_avisar()
+
+    if concurrencia == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        _bucle_trabajador(base, intervalo, hasta_vaciar)
+        return
+
+    contexto = multiprocessing.get_context('fork')
+    for conexion in connections.all():
+        conexion.close()
+    procesos = [
+        contexto.Process(target=_proceso_trabajador, args=(f"{base}/{i}", intervalo, hasta_vaciar))
+        for i in range(concurrencia)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    try:
+        for proceso in procesos:
+            proceso.join()
+    except KeyboardInterrupt:
+        for proceso in procesos:
+            proceso.join()
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UsuarioViewSet, NinoViewSet, LogActividadViewSet,HistorialClinicoViewSet, AlimentoViewSet,RecomendacionViewSet,RecomendacionDesayunoViewSet,RecomendacionAlmuerzoViewSet,RecomendacionCenaViewSet, ParametroReferenciaViewSet, generar_recomendacion, PermisoViewSet, RolPermisoViewSet, RolPersonalizadoViewSet
+from .views import UsuarioViewSet, NinoViewSet, LogActividadViewSet,HistorialClinicoViewSet, AlimentoViewSet,RecomendacionViewSet,RecomendacionDesayunoViewSet,RecomendacionAlmuerzoViewSet,RecomendacionCenaViewSet, ParametroReferenciaViewSet, generar_recomendacion, estado_trabajo_recomendacion, vista_previa_recomendacion, confirmar_recomendacion, generar_semana, PermisoViewSet, RolPermisoViewSet, RolPersonalizadoViewSet
 
 router = DefaultRouter()
 router.register(r'usuarios', UsuarioViewSet)
@@ -24,4 +24,8 @@ router.register(r'rol-permisos', RolPermisoViewSet)
 urlpatterns = [
     path('usuarios/', include(router.urls)),
     path('recomendacion/<int:nino_id>/crear/', generar_recomendacion),
+    path('recomendacion/<int:nino_id>/vista-previa/', vista_previa_recomendacion),
+    path('recomendacion/confirmar/', confirmar_recomendacion),
+    path('recomendacion/<int:nino_id>/semana/', generar_semana),
+    path('recomendacion/trabajos/<int:trabajo_id>/', estado_trabajo_recomendacion),
 ]
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def _cache():
+    return caches[getattr(settings, 'USUARIOS_CACHE_VERSIONES', 'default')]
+
+
+def _clave(modelo) -> str:
+    return f"usuarios:version:{modelo._meta.label_lower}"
+
+
+def obtener_version(modelo) -> int:
+    """
+    Devuelve la versión actual de la tabla del modelo.
+
+    Si la clave no existe (primer uso o desalojo de la cache) se inicializa con
+    un valor nuevo, de modo que ninguna instantánea previa pueda darse por válida.
+    """
+    cache = _cache()
+    clave = _clave(modelo)
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, time.time_ns(), timeout=None)
+        version = cache.get(clave)
+    return version
+
+
+def incrementar_version(modelo) -> None:
+    """
+    Marca la tabla del modelo como modificada.
+
+    El cambio se publica al confirmar la transacción en curso, para que ningún
+    proceso recargue datos que todavía no son visibles.
+    """
+    clave = _clave(modelo)
+    transaction.on_commit(lambda: _cache().set(clave, time.time_ns(), timeout=None))
@@ -3,24 +3,31 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .token import CustomTokenObtainPairSerializer
 from rest_framework import viewsets
-from .models import Usuario, Nino, LogActividad,HistorialClinico, Alimento, RecomendacionDesayuno, RecomendacionCena, RecomendacionAlmuerzo, Recomendacion, ParametroReferencia, Permiso, RolPersonalizado,RolPermiso
+from rest_framework.decorators import api_view, permission_classes
+from .models import Usuario, Nino, LogActividad,HistorialClinico, Alimento, RecomendacionDesayuno, RecomendacionCena, RecomendacionAlmuerzo, Recomendacion, ParametroReferencia, Permiso, RolPersonalizado,RolPermiso, TrabajoRecomendacion
 from .serializers import UsuarioSerializer, NinoSerializer, HistorialClinicoSerializer, AlimentoSerializer, RecomendacionAlmuerzoSerializer,RecomendacionCenaSerializer, RecomendacionDesayunoSerializer, RecomendacionSerializer, ParametroReferenciaSerializer, PermisoSerializer, RolPermisoSerializer, RolPersonalizadoSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import LogActividadSerializer
 from django.http import JsonResponse
-from .recomendador import generar_recomendacion_automatica_mejorada
-from .permissions import CustomDjangoModelPermission
+from django.core import signing
+from .trabajos import encolar_recomendacion
+from .recomendador import generar_semana_recomendaciones
+from .vista_previa import previsualizar_recomendacion, confirmar_vista_previa, VistaPreviaObsoleta
+from .permissions import CustomDjangoModelPermission, requiere_permiso
+from .campos import ConsultaAdaptadaMixin
+from .condicional import GetCondicionalMixin
+from .filtros import filtrar_alimentos
 
 
 
 
 
-class UsuarioViewSet(viewsets.ModelViewSet):
+class UsuarioViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = Usuario.objects.all()
     serializer_class = UsuarioSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
-class NinoViewSet(viewsets.ModelViewSet):
+class NinoViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = Nino.objects.all()
     serializer_class = NinoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
@@ -29,42 +36,49 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
-class LogActividadViewSet(viewsets.ModelViewSet):
+class LogActividadViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = LogActividad.objects.all().order_by('-fecha_hora')
     serializer_class = LogActividadSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
+    orden_cursor = ('-fecha_hora', '-id')
+    limitar_sin_paginar = True
 
-class HistorialClinicoViewSet(viewsets.ModelViewSet):
+class HistorialClinicoViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = HistorialClinico.objects.all().order_by('-fecha_actualizacion')
     serializer_class = HistorialClinicoSerializer
-    permission_classes = [IsAuthenticated, CustomDjangoModelPermission]    
+    permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
+    # fecha_actualizacion cambia en cada edición: el cursor va por la clave primaria
+    orden_cursor = '-id'
 
-class AlimentoViewSet(viewsets.ModelViewSet):
+class AlimentoViewSet(GetCondicionalMixin, ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = Alimento.objects.all()
     serializer_class = AlimentoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
-class RecomendacionViewSet(viewsets.ModelViewSet):
+    def get_queryset(self):
+        return filtrar_alimentos(super().get_queryset(), self.request.query_params)
+
+class RecomendacionViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = Recomendacion.objects.all()
     serializer_class = RecomendacionSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
-class RecomendacionDesayunoViewSet(viewsets.ModelViewSet):
+class RecomendacionDesayunoViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = RecomendacionDesayuno.objects.all()
     serializer_class = RecomendacionDesayunoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
-class RecomendacionAlmuerzoViewSet(viewsets.ModelViewSet):
+class RecomendacionAlmuerzoViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = RecomendacionAlmuerzo.objects.all()
     serializer_class = RecomendacionAlmuerzoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
-class RecomendacionCenaViewSet(viewsets.ModelViewSet):
+class RecomendacionCenaViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = RecomendacionCena.objects.all()
     serializer_class = RecomendacionCenaSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
-class ParametroReferenciaViewSet(viewsets.ModelViewSet):
+class ParametroReferenciaViewSet(GetCondicionalMixin, ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = ParametroReferencia.objects.all()
     serializer_class = ParametroReferenciaSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
@@ -73,20 +87,98 @@ class ParametroReferenciaViewSet(viewsets.ModelViewSet):
 
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, requiere_permiso('crear_recomendacion')])
 def generar_recomendacion(request, nino_id):
+    # Se encola; la genera el comando procesar_trabajos_recomendacion
     try:
-        rec = generar_recomendacion_automatica_mejorada(nino_id)
-        return JsonResponse({"ok": True, "recomendacion_id": rec.id})
+        # ?forzar=1 recalcula aunque las entradas no hayan cambiado
+        preferencias = {"forzar": True} if request.GET.get('forzar') in ('1', 'true') else None
+        trabajo = encolar_recomendacion(nino_id, preferencias_usuario=preferencias)
+        return JsonResponse({"ok": True, "trabajo_id": trabajo.id, "estado": trabajo.estado}, status=202)
+    except Nino.DoesNotExist:
+        return JsonResponse({"ok": False, "error": "Niño no encontrado"}, status=404)
     except Exception as e:
         return JsonResponse({"ok": False, "error": str(e)}, status=400)    
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, requiere_permiso('ver_recomendacion')])
+def vista_previa_recomendacion(request, nino_id):
+    # Mismo cálculo que la generación, sin escribir nada; ?solver= y ?presupuesto_ms= opcionales
+    preferencias = {}
+    if request.GET.get('solver'):
+        preferencias['solver'] = request.GET['solver']
+    try:
+        if request.GET.get('presupuesto_ms'):
+            preferencias['presupuesto_ms'] = float(request.GET['presupuesto_ms'])
+        vista = previsualizar_recomendacion(nino_id, preferencias)
+    except Nino.DoesNotExist:
+        return JsonResponse({"ok": False, "error": "Niño no encontrado"}, status=404)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, "plan": vista.plan.resumen(), "token": vista.token})
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, requiere_permiso('crear_recomendacion')])
+def confirmar_recomendacion(request):
+    # Guarda una vista previa sin recalcularla: {"token": ..., "motivo": opcional}
+    try:
+        datos = request.data
+        argumentos = {"motivo": datos["motivo"]} if datos.get("motivo") else {}
+        recomendacion = confirmar_vista_previa(datos.get("token", ""), **argumentos)
+    except signing.BadSignature:
+        return JsonResponse({"ok": False, "error": "Token de vista previa inválido o vencido"}, status=400)
+    except (VistaPreviaObsoleta, Nino.DoesNotExist) as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=409)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({"ok": True, "recomendacion_id": recomendacion.id}, status=201)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated, requiere_permiso('crear_recomendacion')])
+def generar_semana(request, nino_id):
+    # Plan de varios días (?dias=7) sin repetir un alimento más de ?max_repeticiones= veces
+    try:
+        dias = int(request.GET.get('dias', 7))
+        max_repeticiones = int(request.GET['max_repeticiones']) if request.GET.get('max_repeticiones') else None
+        if not 1 <= dias <= 31:
+            raise ValueError("dias debe estar entre 1 y 31")
+        recomendaciones = generar_semana_recomendaciones(nino_id, dias, max_repeticiones)
+    except Nino.DoesNotExist:
+        return JsonResponse({"ok": False, "error": "Niño no encontrado"}, status=404)
+    except ValueError as e:
+        return JsonResponse({"ok": False, "error": str(e)}, status=400)
+    return JsonResponse({
+        "ok": True,
+        "recomendaciones": [{"id": r.id, "fecha": r.fecha.isoformat()} for r in recomendaciones],
+    }, status=201)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, requiere_permiso('ver_recomendacion')])
+def estado_trabajo_recomendacion(request, trabajo_id):
+    try:
+        trabajo = TrabajoRecomendacion.objects.get(id=trabajo_id)
+    except TrabajoRecomendacion.DoesNotExist:
+        return JsonResponse({"ok": False, "error": "Trabajo no encontrado"}, status=404)
+    return JsonResponse({
+        "ok": trabajo.estado != 'error',
+        "trabajo_id": trabajo.id,
+        "nino_id": trabajo.nino_id,
+        "estado": trabajo.estado,
+        "progreso": trabajo.progreso,
+        "recomendacion_id": trabajo.recomendacion_id,
+        "error": trabajo.error or None,
+        "fecha_creacion": trabajo.fecha_creacion.isoformat(),
+        "fecha_fin": trabajo.fecha_fin.isoformat() if trabajo.fecha_fin else None,
+    })
     
-class PermisoViewSet(viewsets.ModelViewSet):
+class PermisoViewSet(GetCondicionalMixin, ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = Permiso.objects.all()
     serializer_class = PermisoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
 
 
-class RolPersonalizadoViewSet(viewsets.ModelViewSet):
+class RolPersonalizadoViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = RolPersonalizado.objects.all()
     serializer_class = RolPersonalizadoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
@@ -120,7 +212,7 @@ class RolPersonalizadoViewSet(viewsets.ModelViewSet):
         return Response(data)
 
 
-class RolPermisoViewSet(viewsets.ModelViewSet):
+class RolPermisoViewSet(ConsultaAdaptadaMixin, viewsets.ModelViewSet):
     queryset = RolPermiso.objects.all()
     serializer_class = RolPermisoSerializer
     permission_classes = [IsAuthenticated, CustomDjangoModelPermission]
\ No newline at end of file
@@ -0,0 +1,104 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core import signing
+
+from .models import Alimento, Recomendacion
+from .recomendador import (
+    COMIDAS, PlanRecomendacion, cargar_datos_nino, crear_recomendacion, huella_generacion,
+    planificar_recomendacion
+)
+
+logger = logging.getLogger(__name__)
+
+SAL_TOKEN = 'usuarios.vista_previa'
+
+
+class VistaPreviaObsoleta(Exception):
+    """
+    Cambió alguna entrada del generador desde la vista previa: el historial,
+    el parámetro de referencia, el catálogo, las reglas o la edad del niño
+    (huella_generacion), o algún alimento del plan ya no existe.
+    """
+
+
+@dataclass
+class VistaPrevia:
+    plan: PlanRecomendacion
+    token: str
+
+
+def _vigencia_s() -> int:
+    return getattr(settings, 'RECOMENDADOR', {}).get('VISTA_PREVIA_VIGENCIA_S', 3600)
+
+
+def previsualizar_recomendacion(nino_id: int, preferencias_usuario: Optional[Dict] = None) -> VistaPrevia:
+    """
+    Calcula la recomendación sin escribir nada en la base de datos.
+
+    Devuelve el plan y un token firmado que contiene todo lo necesario para
+    guardarlo después con confirmar_vista_previa, sin volver a calcularlo, y la
+    huella de las entradas con que se calculó.
+    """
+    nino, historial, parametro = cargar_datos_nino(nino_id)
+    # Antes de planificar: si el catálogo cambia mientras tanto, la huella queda vieja y se rechaza
+    huella = huella_generacion(nino, historial, parametro, preferencias_usuario)
+    plan = planificar_recomendacion(nino, historial, parametro, preferencias_usuario=preferencias_usuario)
+
+    fuente = plan.fuente()
+    fuente["vista_previa"] = True
+    token = signing.dumps({
+        "nino": nino.id,
+        "huella": huella,
+        "preferencias": preferencias_usuario or {},
+        "comidas": {categoria: [a.alimento.id for a in plan.comidas[categoria]] for categoria in COMIDAS},
+        "fuente": fuente,
+        "calorias_totales": plan.calorias_totales,
+        "proteinas_totales": plan.proteinas_totales,
+        "alergias": plan.alergias,
+        "notas": plan.notas(),
+    }, salt=SAL_TOKEN, compress=True)
+    return VistaPrevia(plan=plan, token=token)
+
+
+def confirmar_vista_previa(token: str, motivo: str = "Recomendación automática generada") -> Recomendacion:
+    """
+    Guarda una vista previa a partir de su token.
+
+    Lanza signing.BadSignature (o SignatureExpired) si el token no es válido, y
+    VistaPreviaObsoleta si la huella de las entradas ya no coincide (cambió el
+    historial, el parámetro, el catálogo o las reglas) o algún alimento ya no existe.
+    """
+    datos = signing.loads(token, salt=SAL_TOKEN, max_age=_vigencia_s())
+
+    try:
+        nino, historial, parametro = cargar_datos_nino(datos["nino"])
+    except ValueError as e:
+        raise VistaPreviaObsoleta(str(e))
+    huella = huella_generacion(nino, historial, parametro, datos["preferencias"])
+    if huella != datos["huella"]:
+        raise VistaPreviaObsoleta("Los datos del niño o el catálogo cambiaron desde la vista previa.")
+
+    ids = {alimento_id for categoria in COMIDAS for alimento_id in datos["comidas"][categoria]}
+    alimentos = Alimento.objects.in_bulk(ids)
+    if len(alimentos) != len(ids):
+        raise VistaPreviaObsoleta("Algunos alimentos de la vista previa ya no existen.")
+
+    recomendacion = crear_recomendacion(
+        nino=nino,
+        motivo=motivo,
+        fuente=datos["fuente"],
+        calorias_totales=datos["calorias_totales"],
+        proteinas_totales=datos["proteinas_totales"],
+        alergias=datos["alergias"],
+        notas=datos["notas"],
+        huella=huella,
+        comidas={
+            categoria: [alimentos[alimento_id] for alimento_id in datos["comidas"][categoria]]
+            for categoria in COMIDAS
+        },
+    )
+    logger.info(f"Vista previa confirmada como recomendación {recomendacion.id} para niño {nino.id}")
+    return recomendacion